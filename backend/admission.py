@@ -0,0 +1,224 @@
+from collections import deque
+from auth_utils import bearer_token, token_subject
+from cache import TTLCache
+from metrics import registry
+from serialization import dumps
+import asyncio
+import math
+import os
+import re
+import time
+
+# Admission control, in front of the routers. Each request is classified by
+# method and path into a route class with its own concurrency limit and a
+# bounded FIFO wait queue. A request that finds the queue full, or is still
+# queued after the class's deadline, is shed with 503 before it touches MongoDB.
+# Expensive classes (bulk import/export, list and search) have small limits, so
+# under a spike they are throttled while patient reads and writes keep their own
+# capacity. With RATE_LIMIT_ENABLED, every client also has a token bucket (keyed
+# by the verified JWT "sub", else the IP); an exhausted bucket gets 429. The IP is
+# the connection's unless the request came through a proxy uvicorn trusts
+# (FORWARDED_ALLOW_IPS, see gunicorn.conf.py), which supplies X-Forwarded-For.
+# Without that, every anonymous user behind the proxy would share one bucket, so
+# rate limiting is opt-in. Limits are per worker.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "20"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "40"))
+RATE_LIMIT_CLIENTS = int(os.getenv("RATE_LIMIT_CLIENTS", "10000"))
+
+
+class RouteClass:
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, cost=1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        # Tokens taken from the client's bucket per request
+        self.cost = cost
+
+
+BULK = RouteClass("bulk", int(os.getenv("BULK_CONCURRENCY", "2")), 4, 2.0, cost=10)
+LIST = RouteClass("list", int(os.getenv("LIST_CONCURRENCY", "16")), 32, 1.0, cost=2)
+AUTH = RouteClass("auth", int(os.getenv("AUTH_CONCURRENCY", "8")), 16, 2.0, cost=5)
+DEFAULT = RouteClass("default", int(os.getenv("DEFAULT_CONCURRENCY", "64")), 128, 2.0)
+# (class, method, path pattern); first match wins, anything else is DEFAULT
+ROUTE_RULES = (
+    (BULK, "POST", re.compile(r"^/api/patients/(bulk|analytics/rebuild)/?$")),
+    (BULK, "GET", re.compile(r"^/api/patients/(export|duplicates)/?$")),
+    (LIST, "GET", re.compile(r"^/api/(patients|appointments)/?$")),
+    (LIST, "POST", re.compile(r"^/api/patients/batch-(get|update|delete)/?$")),
+    (AUTH, "POST", re.compile(r"^/api/auth/(token|register)/?$")),
+)
+# Never queued or rate limited: probes, metrics, docs and long-lived event streams
+# (those have their own cap, EVENTS_MAX_SUBSCRIBERS)
+EXEMPT_PATHS = re.compile(r"^/(health|ready|metrics|docs|redoc|openapi\.json|api/patients/events)/?$")
+RETRY_AFTER_SECONDS = 1
+
+admission_requests = registry.counter(
+    "admission_requests_total", "Requests by route class and admission outcome", ("route_class", "outcome")
+)
+admission_in_flight = registry.gauge(
+    "admission_in_flight", "Admitted requests currently running", ("route_class",)
+)
+admission_queued = registry.gauge(
+    "admission_queue_depth", "Requests waiting for a slot", ("route_class",)
+)
+admission_wait = registry.histogram(
+    "admission_queue_wait_seconds", "Time admitted requests spent queued", ("route_class",)
+)
+
+
+def route_class(method, path):
+    if EXEMPT_PATHS.match(path) or method == "OPTIONS":
+        return None
+    for rule_class, rule_method, pattern in ROUTE_RULES:
+        if method == rule_method and pattern.match(path):
+            return rule_class
+    return DEFAULT
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimit:
+    # A semaphore with a bounded FIFO queue and a wait deadline. A released slot
+    # is handed straight to the oldest waiter, so a burst cannot jump the queue.
+    def __init__(self, route):
+        self.route = route
+        self.active = 0
+        self._waiters = deque()
+
+    async def acquire(self):
+        name = self.route.name
+        if self.active < self.route.max_concurrent and not self._waiters:
+            self.active += 1
+            admission_in_flight.set(self.active, route_class=name)
+            return 0.0
+        if len(self._waiters) >= self.route.max_queue:
+            raise Overloaded("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        admission_queued.set(len(self._waiters), route_class=name)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.route.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            raise Overloaded("timeout")
+        except asyncio.CancelledError:
+            # The client went away; give back a slot that was handed over meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        admission_queued.set(len(self._waiters), route_class=name)
+        return time.perf_counter() - started
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        admission_queued.set(len(self._waiters), route_class=self.route.name)
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes to the waiter; active stays the same
+                waiter.set_result(None)
+                admission_queued.set(len(self._waiters), route_class=self.route.name)
+                return
+        self.active -= 1
+        admission_in_flight.set(self.active, route_class=self.route.name)
+
+
+class RateLimiter:
+    # Token buckets per client. An idle bucket refills completely, which is the
+    # same as having none, so buckets expire from the LRU once they would be full.
+    def __init__(self, rate=None, burst=RATE_LIMIT_BURST, max_clients=RATE_LIMIT_CLIENTS):
+        if rate is None:
+            rate = RATE_LIMIT_PER_SECOND if RATE_LIMIT_ENABLED else 0
+        self.rate = rate
+        self.burst = burst
+        self._buckets = TTLCache(max_size=max_clients, ttl=burst / rate if rate > 0 else 60.0)
+
+    def take(self, key, cost=1):
+        # Seconds to wait before retrying, 0 when the request may proceed
+        if self.rate <= 0:
+            return 0.0
+        cost = min(cost, self.burst)
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < cost:
+            self._buckets.set(key, (tokens, now))
+            return (cost - tokens) / self.rate
+        self._buckets.set(key, (tokens - cost, now))
+        return 0.0
+
+
+def client_key(scope):
+    # scope["client"] already holds the X-Forwarded-For address when uvicorn trusts the proxy
+    authorization = next((value for name, value in scope.get("headers", ()) if name == b"authorization"), None)
+    token = bearer_token(authorization.decode("latin-1")) if authorization else None
+    if token:
+        subject = token_subject(token)
+        if subject:
+            return "user:" + subject
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+async def _reject(send, status, detail, retry_after):
+    body = dumps({"detail": detail})
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode())
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    # Plain ASGI middleware; added before CORSMiddleware so shed responses still
+    # carry CORS headers and browsers can read the 429/503
+    def __init__(self, app, enabled=ADMISSION_ENABLED, rate_limiter=None):
+        self.app = app
+        self.enabled = enabled
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.limits = {route.name: ConcurrencyLimit(route) for route in (BULK, LIST, AUTH, DEFAULT)}
+
+    async def __call__(self, scope, receive, send):
+        route = route_class(scope["method"], scope["path"]) if scope["type"] == "http" and self.enabled else None
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.rate_limiter.take(client_key(scope), route.cost)
+        if retry_after > 0:
+            admission_requests.inc(route_class=route.name, outcome="rate_limited")
+            await _reject(send, 429, "Too many requests", retry_after)
+            return
+
+        limit = self.limits[route.name]
+        try:
+            waited = await limit.acquire()
+        except Overloaded as e:
+            admission_requests.inc(route_class=route.name, outcome=str(e))
+            await _reject(send, 503, "Server is busy, please retry", RETRY_AFTER_SECONDS)
+            return
+        admission_requests.inc(route_class=route.name, outcome="admitted")
+        admission_wait.observe(waited, route_class=route.name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
@@ -0,0 +1,321 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, UpdateOne
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rollup documents look like {"_id": "<dim>:<key>", "dim": ..., "key": ..., "count": n}.
+# They are kept up to date by the patient write paths so dashboard reads only
+# touch a handful of small documents, however many patients there are.
+ROLLUP_COLLECTION = "patient_rollups"
+
+# created_at is stored as IST wall-clock time (UTC+5:30)
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+ACTIVE_CASE_WINDOW_DAYS = 30
+DEFAULT_TOP_N = 6
+MONTHS_SHOWN = 12
+
+# Dashboard age groups (exclusive upper bounds) and analytics age ranges (inclusive upper bounds)
+AGE_GROUPS = [(18, "under18"), (60, "adult")]
+AGE_GROUP_DEFAULT = "senior"
+AGE_RANGES = [(18, "0-18"), (30, "19-30"), (50, "31-50"), (70, "51-70")]
+AGE_RANGE_DEFAULT = "70+"
+
+
+def split_conditions(value):
+    if not isinstance(value, str):
+        return []
+    return [c.strip() for c in value.split(",") if c.strip()]
+
+def age_group(age):
+    for bound, label in AGE_GROUPS:
+        if age < bound:
+            return label
+    return AGE_GROUP_DEFAULT
+
+def age_range(age):
+    for bound, label in AGE_RANGES:
+        if age <= bound:
+            return label
+    return AGE_RANGE_DEFAULT
+
+def latest_prescription_day(prescriptions):
+    dates = [p.get("date") for p in prescriptions or [] if isinstance(p, dict) and p.get("date")]
+    return max(dates)[:10] if dates else None
+
+def today_key():
+    return (datetime.utcnow() + IST_OFFSET).strftime("%Y-%m-%d")
+
+def patient_contributions(patient):
+    # Everything a single patient adds to the rollups, keyed by (dim, key)
+    contributions = Counter()
+    if not patient:
+        return contributions
+
+    age = patient.get("age") or 0
+    conditions = split_conditions(patient.get("chronicConditions"))
+    prescriptions = patient.get("prescriptions") or []
+
+    contributions[("total", "")] += 1
+    contributions[("sum", "age")] += age
+    contributions[("sum", "conditions")] += len(conditions)
+    contributions[("sum", "prescriptions")] += len(prescriptions)
+    contributions[("gender", (patient.get("gender") or "other").lower())] += 1
+    contributions[("age_group", age_group(age))] += 1
+    contributions[("age_range", age_range(age))] += 1
+
+    for condition in conditions:
+        contributions[("condition", condition)] += 1
+    for prescription in prescriptions:
+        medication = prescription.get("medication") if isinstance(prescription, dict) else None
+        if medication:
+            contributions[("medication", medication)] += 1
+
+    created_at = patient.get("created_at")
+    if isinstance(created_at, datetime):
+        contributions[("month", created_at.strftime("%Y-%m"))] += 1
+        contributions[("day", created_at.strftime("%Y-%m-%d"))] += 1
+
+    last_rx = latest_prescription_day(prescriptions)
+    if last_rx:
+        contributions[("last_rx", last_rx)] += 1
+
+    return contributions
+
+def _rollup_id(dim, key):
+    return f"{dim}:{key}"
+
+async def apply_patient_change(db, old=None, new=None):
+    await apply_patient_changes(db, [(old, new)])
+
+def contribution_delta(changes):
+    # Net rollup change of a list of (old, new) patient versions, keyed by (dim, key)
+    delta = Counter()
+    for old, new in changes:
+        delta.update(patient_contributions(new))
+        delta.subtract(patient_contributions(old))
+    return delta
+
+async def apply_patient_changes(db, changes):
+    # Apply the net difference of a list of (old, new) patient versions as a
+    # single bulk $inc. Failures are logged rather than raised: the rollups can
+    # always be rebuilt from the patients collection.
+    try:
+        delta = contribution_delta(changes)
+        operations = [
+            UpdateOne(
+                {"_id": _rollup_id(dim, key)},
+                {"$inc": {"count": amount}, "$setOnInsert": {"dim": dim, "key": key}},
+                upsert=True
+            )
+            for (dim, key), amount in delta.items() if amount
+        ]
+        if operations:
+            await db[ROLLUP_COLLECTION].bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.error(f"Error updating patient rollups: {e}")
+
+def _age_switch(bounds, default, operator):
+    return {
+        "$switch": {
+            "branches": [
+                {"case": {operator: ["$age", bound]}, "then": label}
+                for bound, label in bounds
+            ],
+            "default": default
+        }
+    }
+
+def rollup_pipelines():
+    # One aggregation pipeline per rollup dimension, each producing {_id: key, count: n}.
+    # These mirror patient_contributions() and are used to (re)build the rollups.
+    count = {"$sum": 1}
+    return {
+        "total": [{"$group": {"_id": "", "count": count}}],
+        "sum": [
+            {"$project": {
+                "age": {"$ifNull": ["$age", 0]},
+                "prescriptions": {"$size": {"$ifNull": ["$prescriptions", []]}}
+            }},
+            {"$group": {
+                "_id": None,
+                "age": {"$sum": "$age"},
+                "prescriptions": {"$sum": "$prescriptions"}
+            }}
+        ],
+        "gender": [
+            {"$group": {"_id": {"$toLower": {"$ifNull": ["$gender", "other"]}}, "count": count}}
+        ],
+        "age_group": [
+            {"$group": {"_id": _age_switch(AGE_GROUPS, AGE_GROUP_DEFAULT, "$lt"), "count": count}}
+        ],
+        "age_range": [
+            {"$group": {"_id": _age_switch(AGE_RANGES, AGE_RANGE_DEFAULT, "$lte"), "count": count}}
+        ],
+        "condition": [
+            {"$match": {"chronicConditions": {"$type": "string"}}},
+            {"$project": {"condition": {"$split": ["$chronicConditions", ","]}}},
+            {"$unwind": "$condition"},
+            {"$project": {"condition": {"$trim": {"input": "$condition"}}}},
+            {"$match": {"condition": {"$ne": ""}}},
+            {"$group": {"_id": "$condition", "count": count}}
+        ],
+        "medication": [
+            {"$unwind": "$prescriptions"},
+            {"$match": {"prescriptions.medication": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$prescriptions.medication", "count": count}}
+        ],
+        "month": [
+            {"$match": {"created_at": {"$type": "date"}}},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}}, "count": count}}
+        ],
+        "day": [
+            {"$match": {"created_at": {"$type": "date"}}},
+            {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "count": count}}
+        ],
+        "last_rx": [
+            {"$match": {"prescriptions.date": {"$nin": [None, ""]}}},
+            {"$project": {"day": {"$substrCP": [{"$max": "$prescriptions.date"}, 0, 10]}}},
+            {"$group": {"_id": "$day", "count": count}}
+        ]
+    }
+
+async def _run_pipeline(db, dim, pipeline):
+    rows = await db.patients.aggregate(pipeline).to_list(length=None)
+    if dim != "sum":
+        return [(dim, row["_id"], row["count"]) for row in rows]
+    row = rows[0] if rows else {}
+    return [("sum", "age", row.get("age", 0)), ("sum", "prescriptions", row.get("prescriptions", 0))]
+
+async def rebuild_rollups(db):
+    logger.info("Rebuilding patient rollups from the patients collection...")
+    pipelines = rollup_pipelines()
+    results = await asyncio.gather(
+        *(_run_pipeline(db, dim, pipeline) for dim, pipeline in pipelines.items())
+    )
+
+    rows = [row for dim_rows in results for row in dim_rows]
+    # The total number of conditions is derived from the per-condition counts
+    conditions_total = sum(count for dim, _, count in rows if dim == "condition")
+    rows.append(("sum", "conditions", conditions_total))
+
+    operations = [
+        ReplaceOne(
+            {"_id": _rollup_id(dim, key)},
+            {"dim": dim, "key": key, "count": count},
+            upsert=True
+        )
+        for dim, key, count in rows if key is not None
+    ]
+    collection = db[ROLLUP_COLLECTION]
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+    await collection.delete_many({"_id": {"$nin": [op._filter["_id"] for op in operations]}})
+    logger.info(f"Rebuilt {len(operations)} patient rollup documents")
+    return len(operations)
+
+def _percentage(count, total):
+    return round(count * 100 / total, 1) if total else 0.0
+
+async def _counts(db, dim, sort_field="count", limit=0, key_range=None):
+    query = {"dim": dim, "count": {"$gt": 0}}
+    if key_range:
+        query["key"] = key_range
+    cursor = db[ROLLUP_COLLECTION].find(query, {"key": 1, "count": 1}).sort(sort_field, -1)
+    if limit:
+        cursor = cursor.limit(limit)
+    return [(row["key"], row["count"]) async for row in cursor]
+
+async def _load(db, top_n):
+    today = today_key()
+    cutoff = (datetime.utcnow() + IST_OFFSET - timedelta(days=ACTIVE_CASE_WINDOW_DAYS)).strftime("%Y-%m-%d")
+    fixed, conditions, medications, months, day, active = await asyncio.gather(
+        db[ROLLUP_COLLECTION].find(
+            {"dim": {"$in": ["total", "sum", "gender", "age_group", "age_range"]}}
+        ).to_list(length=None),
+        _counts(db, "condition", limit=top_n),
+        _counts(db, "medication", limit=top_n),
+        _counts(db, "month", sort_field="key", limit=MONTHS_SHOWN),
+        db[ROLLUP_COLLECTION].find_one({"_id": _rollup_id("day", today)}),
+        _counts(db, "last_rx", key_range={"$gt": cutoff, "$lte": today})
+    )
+
+    by_dim = {}
+    for row in fixed:
+        by_dim.setdefault(row["dim"], {})[row["key"]] = row["count"]
+
+    return {
+        "total": by_dim.get("total", {}).get("", 0),
+        "sums": by_dim.get("sum", {}),
+        "gender": by_dim.get("gender", {}),
+        "age_group": by_dim.get("age_group", {}),
+        "age_range": by_dim.get("age_range", {}),
+        "conditions": conditions,
+        "medications": medications,
+        "months": list(reversed(months)),
+        "today": day["count"] if day else 0,
+        "active": sum(count for _, count in active)
+    }
+
+def _gender_distribution(gender_counts):
+    distribution = {"male": 0, "female": 0, "other": 0}
+    for gender, count in gender_counts.items():
+        if count > 0:
+            distribution[gender] = distribution.get(gender, 0) + count
+    return distribution
+
+async def get_analytics(db, top_n=DEFAULT_TOP_N):
+    data = await _load(db, top_n)
+    total = data["total"]
+    prescriptions_total = data["sums"].get("prescriptions", 0)
+
+    return {
+        "total_patients": total,
+        "average_age": round(data["sums"].get("age", 0) / total, 1) if total else 0.0,
+        "new_today": data["today"],
+        "active_cases": data["active"],
+        "gender_distribution": _gender_distribution(data["gender"]),
+        "age_distribution": [
+            {
+                "range": label,
+                "count": data["age_range"].get(label, 0),
+                "percentage": _percentage(data["age_range"].get(label, 0), total)
+            }
+            for label in [label for _, label in AGE_RANGES] + [AGE_RANGE_DEFAULT]
+        ],
+        "conditions": [
+            {"name": name, "count": count, "percentage": _percentage(count, total)}
+            for name, count in data["conditions"]
+        ],
+        "medications": [
+            {"name": name, "count": count, "percentage": _percentage(count, prescriptions_total)}
+            for name, count in data["medications"]
+        ],
+        "monthly_visits": [{"month": month, "visits": count} for month, count in data["months"]],
+        "generated_at": datetime.utcnow()
+    }
+
+async def get_summary(db):
+    data = await _load(db, 3)
+    total = data["total"]
+    top_conditions = [
+        {"name": name, "count": count, "percentage": _percentage(count, total)}
+        for name, count in data["conditions"]
+    ]
+
+    return {
+        "total_patients": total,
+        "today_visits": data["today"],
+        "active_cases": data["active"],
+        "common_diagnosis": top_conditions[0]["name"] if top_conditions else "None",
+        "total_conditions": data["sums"].get("conditions", 0),
+        "top_conditions": top_conditions,
+        "gender_distribution": _gender_distribution(data["gender"]),
+        "age_distribution": {
+            label: data["age_group"].get(label, 0)
+            for label in [label for _, label in AGE_GROUPS] + [AGE_GROUP_DEFAULT]
+        }
+    }
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+from pymongo import ReplaceOne, DeleteMany
+from analytics import IST_OFFSET
+from pagination import InvalidCursor
+import base64
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Appointments are embedded in their patient, which is what the patient API
+# reads and writes. This collection is a denormalized copy, one document per
+# embedded appointment:
+#   {"_id": "<patient _id>:<position>", "patient_id": ..., "patient_name": ...,
+#    "position": n, "date": <datetime>, "date_text": <as entered>, "department": ..., "doctor": ...}
+# so calendar queries ("Cardiology today", "Dr. X this week") are index range
+# scans instead of a pass over every patient. The patient write paths keep it in
+# step after the response is sent, like the rollups; migration 8 rebuilds it
+# (`python migrations.py redo 8`).
+APPOINTMENT_COLLECTION = "appointments"
+APPOINTMENT_SORT = [("date", 1), ("_id", 1)]
+
+
+def appointment_id(patient_id, position):
+    return f"{patient_id}:{position}"
+
+def parse_appointment_date(value):
+    # Dates are entered as "YYYY-MM-DD" or "YYYY-MM-DDTHH:MM"; times with an
+    # offset are converted to IST wall-clock time, like created_at
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None) + IST_OFFSET
+    return parsed
+
+def appointment_document(patient, position, appointment):
+    patient_id = str(patient["_id"])
+    return {
+        "_id": appointment_id(patient_id, position),
+        "patient_id": patient_id,
+        "patient_name": patient.get("name"),
+        "position": position,
+        "date": parse_appointment_date(appointment.get("date")),
+        "date_text": appointment.get("date"),
+        "department": appointment.get("department"),
+        "doctor": appointment.get("doctor")
+    }
+
+def appointment_operations(patient):
+    # Upserts every embedded appointment and removes copies past the end of the array
+    appointments = [a for a in patient.get("appointments") or [] if isinstance(a, dict)]
+    operations = [
+        ReplaceOne({"_id": appointment_id(patient["_id"], position)},
+                   appointment_document(patient, position, appointment), upsert=True)
+        for position, appointment in enumerate(appointments)
+    ]
+    operations.append(DeleteMany({"patient_id": str(patient["_id"]), "position": {"$gte": len(appointments)}}))
+    return operations
+
+async def apply_appointment_changes(db, changes):
+    # changes are (old, new) pairs of complete patient documents; old is None for
+    # an insert and new is None for a delete. Unchanged patients cost nothing.
+    operations = []
+    for old, new in changes:
+        if new is None:
+            if old is not None:
+                operations.append(DeleteMany({"patient_id": str(old["_id"])}))
+            continue
+        if old is not None and old.get("appointments") == new.get("appointments") \
+                and old.get("name") == new.get("name"):
+            continue
+        if old is None and not new.get("appointments"):
+            continue
+        operations.extend(appointment_operations(new))
+    if operations:
+        try:
+            await db[APPOINTMENT_COLLECTION].bulk_write(operations, ordered=False)
+        except Exception as e:
+            # A missed sync is repaired by `python migrations.py redo 8`
+            logger.error(f"Failed to sync appointments: {e}")
+
+async def apply_appointment_change(db, old=None, new=None):
+    await apply_appointment_changes(db, [(old, new)])
+
+async def insert_appointment(db, patient, position, appointment):
+    # The append endpoint only knows the new entry and where it landed in the array
+    try:
+        await db[APPOINTMENT_COLLECTION].replace_one(
+            {"_id": appointment_id(patient["_id"], position)},
+            appointment_document(patient, position, appointment),
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f"Failed to add appointment for patient {patient['_id']}: {e}")
+
+async def rename_patient(db, patient_id, name):
+    try:
+        await db[APPOINTMENT_COLLECTION].update_many(
+            {"patient_id": str(patient_id)}, {"$set": {"patient_name": name}}
+        )
+    except Exception as e:
+        logger.error(f"Failed to rename appointments of patient {patient_id}: {e}")
+
+
+def encode_cursor(document):
+    payload = {"t": document["date"].isoformat(), "i": document["_id"]}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return datetime.fromisoformat(payload["t"]), str(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+
+def date_range(start=None, end=None, day=None):
+    # Returns the [start, end) datetime range of a query. day selects one whole
+    # day; without any bound the range starts today (IST), i.e. upcoming only.
+    if day:
+        start = parse_appointment_date(day)
+        if start is None:
+            raise ValueError("day must be an ISO date (YYYY-MM-DD)")
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        return start, start + timedelta(days=1)
+    parsed_start = parse_appointment_date(start) if start else None
+    parsed_end = parse_appointment_date(end) if end else None
+    if (start and parsed_start is None) or (end and parsed_end is None):
+        raise ValueError("start and end must be ISO dates or datetimes")
+    if parsed_start is None:
+        parsed_start = (datetime.utcnow() + IST_OFFSET).replace(hour=0, minute=0, second=0, microsecond=0)
+    return parsed_start, parsed_end
+
+async def find_appointments(db, start, end=None, department=None, doctor=None, patient_id=None, limit=50, cursor=None):
+    # One page in (date, _id) order plus the cursor of the next page. With a
+    # department or doctor the query is a range scan of (department|doctor, date, _id).
+    query = {}
+    if department:
+        query["department"] = department
+    if doctor:
+        query["doctor"] = doctor
+    if patient_id:
+        query["patient_id"] = patient_id
+    query["date"] = {"$gte": start, **({"$lt": end} if end else {})}
+    if cursor:
+        date, last_id = decode_cursor(cursor)
+        query = {"$and": [query, {"$or": [{"date": {"$gt": date}}, {"date": date, "_id": {"$gt": last_id}}]}]}
+
+    documents = await db[APPOINTMENT_COLLECTION].find(query, {"position": 0}) \
+        .sort(APPOINTMENT_SORT).limit(limit + 1).to_list(length=limit + 1)
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    next_cursor = encode_cursor(documents[-1]) if has_more else None
+    return documents, next_cursor
@@ -1,18 +1,21 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from models import TokenData
+from models import TokenData, Principal
+from password_hashing import get_crypt_context, password_hasher, HashingOverloaded
+from database import get_db
+from cache import TTLCache
+import hashlib
+import time
 import os
 from dotenv import load_dotenv
 import logging
-import warnings
-
-# Suppress the bcrypt version warning
-warnings.filterwarnings("ignore", category=UserWarning, module="passlib.handlers.bcrypt")
+from logging_config import setup_logging
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -25,13 +28,21 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Configure password context with specific settings
-pwd_context = CryptContext(
-    schemes=["bcrypt"],
-    deprecated="auto",
-    bcrypt__rounds=12,  # Explicitly set rounds
-    bcrypt__ident="2b"  # Use the latest bcrypt format
-)
+# When false, patient endpoints accept anonymous requests but still resolve a
+# principal whenever a bearer token is sent
+REQUIRE_AUTH = os.getenv("REQUIRE_AUTH", "false").lower() == "true"
+
+# Users with role "admin" are administrators, as are these usernames (comma separated)
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
+# Principal caches (see get_current_principal)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+INVALID_TOKEN_CACHE_TTL = 60
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+
+# Configure password context with specific settings (rounds come from BCRYPT_ROUNDS)
+pwd_context = get_crypt_context()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
@@ -47,6 +58,26 @@ def get_password_hash(password: str) -> str:
         logger.error(f"Error hashing password: {e}")
         raise
 
+# Async variants used by request handlers: bcrypt runs in the hashing pool,
+# never on the event loop. Both raise HashingOverloaded when the pool is saturated.
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except HashingOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error verifying password: {e}")
+        return False, None
+
+async def get_password_hash_async(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except HashingOverloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error hashing password: {e}")
+        raise
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     try:
         to_encode = data.copy()
@@ -74,4 +105,154 @@ def verify_token(token: str) -> Optional[TokenData]:
         return None
     except Exception as e:
         logger.error(f"Unexpected error during token verification: {e}")
-        return None 
\ No newline at end of file
+        return None
+
+# Authenticated principal resolution.
+# Principals are cached by the token's SHA-256 digest, invalid tokens for a short
+# while, and user records for USER_CACHE_TTL seconds, so a protected request
+# normally costs a dict lookup rather than an HMAC check plus a users query.
+# A principal lives no longer than the user record it was built from: other
+# workers, whose caches invalidate_user cannot reach, see a deactivation or a
+# role change within USER_CACHE_TTL seconds.
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token", auto_error=False)
+
+token_cache = TTLCache(max_size=TOKEN_CACHE_SIZE, clock=time.time)
+invalid_token_cache = TTLCache(max_size=TOKEN_CACHE_SIZE, ttl=INVALID_TOKEN_CACHE_TTL)
+user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_user_tokens = {}
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+def invalidate_user(username: str):
+    # Drop the cached user record and every cached principal for that user,
+    # e.g. after the account is deactivated
+    user_cache.delete(username)
+    for digest in _user_tokens.pop(username, set()):
+        token_cache.delete(digest)
+
+async def _load_user(db, username: str) -> Tuple[Optional[dict], float]:
+    # (user or None, wall-clock time the record was read)
+    cached = user_cache.get(username)
+    if cached is None:
+        user = await db.users.find_one({"username": username}, {"password": 0})
+        if user is None:
+            return None, time.time()
+        cached = (user, time.time())
+        user_cache.set(username, cached)
+    return cached
+
+def _credentials_exception(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def resolve_principal(token: str, db) -> Principal:
+    digest = _token_digest(token)
+    principal = token_cache.get(digest)
+    if principal is not None:
+        return principal
+    if digest in invalid_token_cache:
+        raise _credentials_exception()
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as e:
+        logger.warning(f"JWT verification failed: {e}")
+        invalid_token_cache.set(digest, True)
+        raise _credentials_exception()
+
+    username = payload.get("sub")
+    expires_at = payload.get("exp")
+    if not username or not expires_at:
+        invalid_token_cache.set(digest, True)
+        raise _credentials_exception()
+
+    user, loaded_at = await _load_user(db, username)
+    if user is None or not user.get("is_active", True):
+        # Not negatively cached: the user may be created or reactivated
+        raise _credentials_exception("Inactive or unknown user")
+
+    principal = Principal(
+        username=username,
+        user_id=str(user["_id"]),
+        email=user.get("email"),
+        is_active=user.get("is_active", True),
+        is_admin=user.get("role") == "admin" or username in ADMIN_USERNAMES,
+        expires_at=expires_at
+    )
+    token_cache.set(digest, principal, ttl=min(expires_at, loaded_at + USER_CACHE_TTL) - time.time())
+    digests = _user_tokens.setdefault(username, set())
+    if len(digests) >= 16:
+        # Forget tokens that have already expired or been evicted
+        digests.intersection_update([d for d in digests if d in token_cache])
+    digests.add(digest)
+    return principal
+
+async def get_current_principal(
+    request: Request,
+    token: Optional[str] = Depends(oauth2_scheme),
+    db=Depends(get_db)
+) -> Principal:
+    if not token:
+        raise _credentials_exception("Not authenticated")
+    principal = await resolve_principal(token, db)
+    request.state.principal = principal
+    return principal
+
+async def get_optional_principal(
+    request: Request,
+    token: Optional[str] = Depends(oauth2_scheme),
+    db=Depends(get_db)
+) -> Optional[Principal]:
+    # An absent token is anonymous; a bad token is still rejected
+    if not token:
+        return None
+    principal = await resolve_principal(token, db)
+    request.state.principal = principal
+    return principal
+
+async def require_principal(
+    request: Request,
+    token: Optional[str] = Depends(oauth2_scheme),
+    db=Depends(get_db)
+) -> Optional[Principal]:
+    # Router-level guard; enforcement follows REQUIRE_AUTH
+    if REQUIRE_AUTH:
+        return await get_current_principal(request, token, db)
+    return await get_optional_principal(request, token, db)
+
+async def require_admin(principal: Principal = Depends(get_current_principal)) -> Principal:
+    if not principal.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return principal
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    # Token from a raw Authorization header, for code running outside dependency injection
+    scheme, _, token = (authorization or "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+
+def token_subject(token: str) -> Optional[str]:
+    # Verified "sub" of a token without a database lookup, or None; used by
+    # admission control, which runs before routing and dependency injection
+    digest = _token_digest(token)
+    principal = token_cache.get(digest)
+    if principal is not None:
+        return principal.username
+    if digest in invalid_token_cache:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        invalid_token_cache.set(digest, True)
+        return None
+    return payload.get("sub")
+
+def principal_cache_stats() -> dict:
+    return {
+        "tokens": token_cache.stats(),
+        "invalid_tokens": invalid_token_cache.stats(),
+        "users": user_cache.stats()
+    }
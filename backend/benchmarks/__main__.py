@@ -0,0 +1,167 @@
+import os
+
+# The whole benchmark load comes from one user, so per-client rate limits would
+# measure the limiter rather than the code; ADMISSION_ENABLED=true keeps them
+os.environ.setdefault("ADMISSION_ENABLED", "false")
+
+from benchmarks.compare import compare_results, format_comparison, DEFAULT_THRESHOLD, DEFAULT_MIN_DELTA_MS
+from benchmarks.dataset import SIZES, DEFAULT_SEED
+from benchmarks.runner import run_benchmark, open_backend, OPERATIONS, BACKENDS
+from benchmarks.codec import run_codec_benchmark
+from benchmarks.query_advisor import run_advisor, format_report, MAX_EXAMINED_RATIO, MIN_DOCS_EXAMINED
+from benchmarks import dataset
+from migrations import migrate
+from logging_config import setup_logging
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+# Run from the backend directory:
+#   python -m benchmarks run --size 1k --backend memory --output before.json
+#   python -m benchmarks run --size 100k --backend mongodb --mongodb-url mongodb://localhost:27017 --output after.json
+#   python -m benchmarks compare before.json after.json
+#   python -m benchmarks seed --size 1m --mongodb-url mongodb://localhost:27017
+#   python -m benchmarks advise --size 100k --mongodb-url mongodb://localhost:27017
+
+
+def write_json(data, path):
+    text = json.dumps(data, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def add_database_arguments(parser):
+    parser.add_argument("--size", choices=list(SIZES), default="1k")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--mongodb-url", default="mongodb://localhost:27017")
+    parser.add_argument(
+        "--database", default=None,
+        help="database to seed and use (default: healthcare_bench_<size>); its collections are replaced"
+    )
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Healthcare API benchmarks")
+    parser.add_argument("--verbose", action="store_true", help="keep application INFO logging")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="seed if needed, drive the API and report latencies")
+    add_database_arguments(run)
+    run.add_argument("--backend", choices=BACKENDS, default="memory")
+    run.add_argument("--operations", default=",".join(OPERATIONS), help="comma separated subset of operations")
+    run.add_argument("--requests", type=int, default=200, help="timed requests per operation")
+    run.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    run.add_argument("--warmup", type=int, default=20, help="untimed requests per operation")
+    run.add_argument("--reseed", action="store_true", help="reseed even if the database already has the right size")
+    run.add_argument("--url", default=None, help="benchmark a running server instead of the in-process app")
+    run.add_argument("--output", default=None, help="write results JSON here instead of stdout")
+
+    seed = commands.add_parser("seed", help="seed a mongod with synthetic patients and users")
+    add_database_arguments(seed)
+
+    advise = commands.add_parser(
+        "advise", help="explain every query shape the API issues; exits 1 if any scans or over-examines"
+    )
+    add_database_arguments(advise)
+    advise.add_argument("--requests", type=int, default=5, help="requests per operation while recording")
+    advise.add_argument("--reseed", action="store_true")
+    advise.add_argument("--max-ratio", type=float, default=MAX_EXAMINED_RATIO, help="documents examined per document returned")
+    advise.add_argument("--min-docs", type=int, default=MIN_DOCS_EXAMINED, help="ignore ratios below this many examined documents")
+    advise.add_argument("--output", default=None, help="also write the report as JSON")
+
+    codec = commands.add_parser(
+        "codec", help="CPU of the default and raw BSON read paths, and reply sizes per wire compressor"
+    )
+    codec.add_argument("--size", choices=list(SIZES), default="1k")
+    codec.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    codec.add_argument("--output", default=None, help="write results JSON here instead of stdout")
+
+    compare = commands.add_parser("compare", help="compare two result files and flag regressions")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="relative change counted as a regression")
+    compare.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS)
+    compare.add_argument("--output", default=None, help="also write the comparison as JSON")
+    return parser
+
+async def seed_database(args):
+    database_name = args.database or f"healthcare_bench_{args.size}"
+    async with open_backend("mongodb", args.mongodb_url, database_name) as db:
+        await dataset.seed(db, SIZES[args.size], args.seed)
+        await migrate(db)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    setup_logging()
+
+    if args.command == "compare":
+        comparison = compare_results(
+            load_json(args.baseline), load_json(args.candidate), args.threshold, args.min_delta_ms
+        )
+        print(format_comparison(comparison))
+        if args.output:
+            write_json(comparison, args.output)
+        return 1 if comparison["regressions"] else 0
+
+    if args.command == "codec":
+        write_json(run_codec_benchmark(args.size, args.seed), args.output)
+        return 0
+
+    if args.command == "seed":
+        asyncio.run(seed_database(args))
+        return 0
+
+    if not args.verbose:
+        # Importing main configures INFO logging; per-request log lines would dominate the output
+        import main  # noqa: F401
+        logging.getLogger().setLevel(logging.WARNING)
+
+    if args.command == "advise":
+        report = asyncio.run(run_advisor(
+            size=args.size,
+            requests=args.requests,
+            seed_value=args.seed,
+            mongodb_url=args.mongodb_url,
+            database_name=args.database,
+            reseed=args.reseed,
+            max_ratio=args.max_ratio,
+            min_docs=args.min_docs
+        ))
+        print(format_report(report))
+        if args.output:
+            write_json(report, args.output)
+        return 1 if report["flagged"] else 0
+
+    operations = [op.strip() for op in args.operations.split(",") if op.strip()]
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        print(f"Unknown operations: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    if args.backend == "memory" and args.size == "1m":
+        logging.getLogger(__name__).warning("The in-memory backend scans every document per query; 1m rows will be very slow")
+
+    results = asyncio.run(run_benchmark(
+        size=args.size,
+        backend=args.backend,
+        operations=operations,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        warmup=args.warmup,
+        seed_value=args.seed,
+        mongodb_url=args.mongodb_url,
+        database_name=args.database,
+        reseed=args.reseed,
+        url=args.url
+    ))
+    write_json(results, args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+from datetime import datetime
+from bson import ObjectId, decode_all, encode
+from benchmarks.dataset import SIZES, DEFAULT_SEED, make_patient
+from bson_json import RAW_CODEC_OPTIONS, response_documents
+from bulk_io import _export_row, BULK_BATCH_SIZE
+from routers.patients import to_response
+from search import SEARCH_PROJECTION
+from serialization import dumps
+import gc
+import json
+import random
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # optional, like in the driver
+    zstandard = None
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+# CPU and bytes of the read path without a server: patients are encoded to BSON
+# the way a find reply carries them, then turned into response JSON by the
+# default path (dicts + to_response) and the RAW_BSON_READS path (see
+# bson_json.py). Wire compression is measured on the same reply batches with
+# each compressor MongoDB supports whose package is installed.
+PAGE_SIZE = 50
+MIN_SECONDS = 0.5
+
+
+def _encoded_patients(size, seed_value):
+    rng = random.Random(seed_value)
+    now = datetime(2025, 1, 1)
+    documents = []
+    for index in range(size):
+        patient = make_patient(index, rng, now)
+        patient["_id"] = ObjectId(f"{index:024x}")
+        # What the server sends back after SEARCH_PROJECTION
+        documents.append(encode({k: v for k, v in patient.items() if k not in SEARCH_PROJECTION}))
+    return documents
+
+def _batches(documents, batch_size):
+    return [b"".join(documents[i:i + batch_size]) for i in range(0, len(documents), batch_size)]
+
+def _cpu_ms(fn, batches):
+    # CPU milliseconds (this thread only) for one pass over all batches, best of
+    # several passes; collections are paused so one pass doesn't pay for another's garbage
+    best = None
+    started = time.perf_counter()
+    gc.collect()
+    gc.disable()
+    try:
+        while best is None or time.perf_counter() - started < MIN_SECONDS:
+            cpu = time.thread_time()
+            for batch in batches:
+                fn(batch)
+            elapsed = (time.thread_time() - cpu) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return round(best, 2)
+
+def list_default(batch):
+    return dumps({"patients": [to_response(patient) for patient in decode_all(batch)]})
+
+def list_raw(batch):
+    return dumps({"patients": response_documents(decode_all(batch, RAW_CODEC_OPTIONS))})
+
+def export_default(batch):
+    return "".join(json.dumps(_export_row(patient), default=str) + "\n" for patient in decode_all(batch)).encode()
+
+def export_raw(batch):
+    return b"".join(dumps(row) + b"\n" for row in response_documents(decode_all(batch, RAW_CODEC_OPTIONS)))
+
+def compressors():
+    # name -> (compress, decompress), as the driver would use them
+    available = {
+        "zlib": (lambda data: zlib.compress(data, -1), zlib.decompress),
+        "zlib-1": (lambda data: zlib.compress(data, 1), zlib.decompress)
+    }
+    if zstandard is not None:
+        compressor, decompressor = zstandard.ZstdCompressor(), zstandard.ZstdDecompressor()
+        available["zstd"] = (compressor.compress, decompressor.decompress)
+    if snappy is not None:
+        available["snappy"] = (snappy.compress, snappy.uncompress)
+    return available
+
+def run_codec_benchmark(size="1k", seed_value=DEFAULT_SEED):
+    documents = _encoded_patients(SIZES[size], seed_value)
+    # Nobody pages through a whole large collection; 20,000 documents of list pages is plenty
+    pages = _batches(documents[:20000], PAGE_SIZE)
+    exports = _batches(documents, BULK_BATCH_SIZE)
+
+    results = {}
+    for name, default, raw, batches in (
+        ("list", list_default, list_raw, pages),
+        ("export", export_default, export_raw, exports)
+    ):
+        default_ms, raw_ms = _cpu_ms(default, batches), _cpu_ms(raw, batches)
+        count = sum(len(decode_all(batch, RAW_CODEC_OPTIONS)) for batch in batches)
+        results[name] = {
+            "documents": count,
+            "default_cpu_ms": default_ms,
+            "raw_cpu_ms": raw_ms,
+            "default_us_per_document": round(default_ms * 1000 / count, 2),
+            "raw_us_per_document": round(raw_ms * 1000 / count, 2),
+            "cpu_saved": round(1 - raw_ms / default_ms, 3) if default_ms else None,
+            # Export lines differ in whitespace (stdlib json vs orjson), so compare values
+            "same_output": all(
+                [json.loads(line) for line in default(batch).splitlines()] ==
+                [json.loads(line) for line in raw(batch).splitlines()]
+                for batch in batches[:5]
+            )
+        }
+
+    wire_bytes = sum(len(batch) for batch in exports)
+    wire = {"uncompressed": {"bytes": wire_bytes}}
+    for name, (compress, decompress) in compressors().items():
+        compressed = [compress(batch) for batch in exports]
+        wire[name] = {
+            "bytes": sum(len(data) for data in compressed),
+            "ratio": round(sum(len(data) for data in compressed) / wire_bytes, 3),
+            "compress_cpu_ms": _cpu_ms(compress, exports),
+            "decompress_cpu_ms": _cpu_ms(decompress, compressed)
+        }
+    results["wire"] = wire
+
+    return {
+        "benchmark": {
+            "kind": "codec",
+            "size": size,
+            "seed": seed_value,
+            "page_size": PAGE_SIZE,
+            "export_batch_size": BULK_BATCH_SIZE,
+            "started_at": datetime.utcnow().isoformat()
+        },
+        "results": results
+    }
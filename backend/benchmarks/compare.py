@@ -0,0 +1,75 @@
+# Compares two benchmark result files. A regression is a latency percentile
+# that grew, or a throughput that dropped, by more than the threshold. Latency
+# changes smaller than min_delta_ms are treated as noise.
+LATENCY_METRICS = ("p50", "p95", "p99")
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_MIN_DELTA_MS = 0.5
+COMPARABLE_SETTINGS = ("size", "backend", "target", "concurrency", "seed")
+
+
+def _change(baseline, candidate):
+    if not baseline or candidate is None:
+        return None
+    return (candidate - baseline) / baseline
+
+def compare_results(baseline, candidate, threshold=DEFAULT_THRESHOLD, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    comparison = {
+        "threshold": threshold,
+        "min_delta_ms": min_delta_ms,
+        "warnings": [],
+        "operations": {},
+        "regressions": []
+    }
+    for setting in COMPARABLE_SETTINGS:
+        before = baseline["benchmark"].get(setting)
+        after = candidate["benchmark"].get(setting)
+        if before != after:
+            comparison["warnings"].append(f"{setting} differs: {before} vs {after}")
+
+    for operation, old in baseline["results"].items():
+        new = candidate["results"].get(operation)
+        if new is None:
+            comparison["warnings"].append(f"{operation} missing from candidate run")
+            continue
+
+        metrics = {}
+        for metric in LATENCY_METRICS:
+            before, after = old["latency_ms"].get(metric), new["latency_ms"].get(metric)
+            change = _change(before, after)
+            regressed = change is not None and change > threshold and after - before >= min_delta_ms
+            metrics[metric] = {"baseline": before, "candidate": after, "change": change, "regressed": regressed}
+
+        before, after = old.get("throughput_rps"), new.get("throughput_rps")
+        change = _change(before, after)
+        metrics["throughput_rps"] = {
+            "baseline": before,
+            "candidate": after,
+            "change": change,
+            "regressed": change is not None and change < -threshold
+        }
+
+        if new.get("errors", 0) > old.get("errors", 0):
+            comparison["warnings"].append(f"{operation} errors rose from {old.get('errors', 0)} to {new['errors']}")
+
+        comparison["operations"][operation] = metrics
+        comparison["regressions"].extend(
+            f"{operation}.{metric}" for metric, values in metrics.items() if values["regressed"]
+        )
+    return comparison
+
+def format_comparison(comparison):
+    lines = [f"{'operation':<10} {'metric':<15} {'baseline':>12} {'candidate':>12} {'change':>9}"]
+    for operation, metrics in comparison["operations"].items():
+        for metric, values in metrics.items():
+            change = values["change"]
+            lines.append(
+                f"{operation:<10} {metric:<15} {values['baseline']!s:>12} {values['candidate']!s:>12} "
+                f"{'' if change is None else f'{change:+.1%}':>9}{'  REGRESSION' if values['regressed'] else ''}"
+            )
+    for warning in comparison["warnings"]:
+        lines.append(f"warning: {warning}")
+    if comparison["regressions"]:
+        lines.append(f"{len(comparison['regressions'])} regression(s): {', '.join(comparison['regressions'])}")
+    else:
+        lines.append("No regressions")
+    return "\n".join(lines)
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from password_hashing import get_crypt_context
+from patient_repository import derived_fields
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+# Deterministic synthetic patients and users. The same size and seed always
+# produce the same rows, so runs against a freshly seeded database are comparable.
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_SEED = 42
+SEED_BATCH_SIZE = 1000
+BENCHMARK_PASSWORD = "benchmark-password"
+
+FIRST_NAMES = [
+    "Aarav", "Vivaan", "Aditya", "Vihaan", "Arjun", "Sai", "Reyansh", "Krishna", "Ishaan", "Rohan",
+    "Ananya", "Diya", "Aadhya", "Saanvi", "Pari", "Anika", "Navya", "Meera", "Priya", "Kavya",
+    "Rahul", "Sneha", "Vikram", "Pooja", "Amit", "Neha", "Suresh", "Lakshmi", "Ravi", "Sunita"
+]
+LAST_NAMES = [
+    "Sharma", "Verma", "Gupta", "Kumar", "Singh", "Patel", "Reddy", "Nair", "Iyer", "Menon",
+    "Das", "Bose", "Mehta", "Shah", "Joshi", "Rao", "Pillai", "Chopra", "Malhotra", "Banerjee"
+]
+GENDERS = ["Male", "Female", "Other"]
+GENDER_WEIGHTS = [48, 48, 4]
+CONDITIONS = ["Diabetes", "Hypertension", "Asthma", "Arthritis", "Thyroid", "Migraine", "COPD", "Anemia"]
+MEDICATIONS = [
+    ("Metformin", "500mg"), ("Amlodipine", "5mg"), ("Salbutamol", "100mcg"), ("Ibuprofen", "400mg"),
+    ("Levothyroxine", "50mcg"), ("Paracetamol", "650mg"), ("Atorvastatin", "10mg"), ("Iron", "100mg")
+]
+DEPARTMENTS = [
+    ("Cardiology", "Dr. Mehta"), ("General Medicine", "Dr. Rao"), ("Orthopedics", "Dr. Iyer"),
+    ("Endocrinology", "Dr. Shah"), ("Pulmonology", "Dr. Nair"), ("Neurology", "Dr. Bose")
+]
+HISTORY_DAYS = 730
+
+
+def make_patient(index, rng, now):
+    # created_at is IST wall-clock time with millisecond precision, as the API stores it
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    created_at = now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+    created_at = created_at.replace(microsecond=created_at.microsecond // 1000 * 1000)
+    conditions = rng.sample(CONDITIONS, rng.choice([0, 0, 1, 1, 2]))
+
+    prescriptions = []
+    for _ in range(rng.randrange(6)):
+        medication, dosage = rng.choice(MEDICATIONS)
+        day = created_at + timedelta(days=rng.randrange(60))
+        prescriptions.append({"date": day.strftime("%Y-%m-%d"), "medication": medication, "dosage": dosage, "notes": None})
+
+    appointments = []
+    for _ in range(rng.randrange(4)):
+        department, doctor = rng.choice(DEPARTMENTS)
+        day = created_at + timedelta(days=rng.randrange(90))
+        appointments.append({"date": day.strftime("%Y-%m-%d"), "department": department, "doctor": doctor})
+
+    patient = {
+        "name": f"{first} {last}",
+        "age": rng.randrange(1, 95),
+        "gender": rng.choices(GENDERS, GENDER_WEIGHTS)[0],
+        "dob": None,
+        # Unique per row: the index is embedded in the subscriber number
+        "phone": f"+91 9{index:09d}",
+        "email": f"{first.lower()}.{last.lower()}.{index}@example.com" if rng.random() < 0.6 else None,
+        "address": f"{rng.randrange(1, 500)} MG Road, Bengaluru" if rng.random() < 0.5 else None,
+        "chronicConditions": ", ".join(conditions) or None,
+        "allergies": None,
+        "notes": None,
+        "prescriptions": prescriptions,
+        "appointments": appointments,
+        "created_at": created_at,
+        "version": 1
+    }
+    patient.update(derived_fields(patient))
+    return patient
+
+def make_user(index, password_hash, now):
+    return {
+        "username": f"bench_user_{index}",
+        "email": f"bench_user_{index}@example.com",
+        "password": password_hash,
+        "created_at": now,
+        "is_active": True
+    }
+
+def iter_batches(factory, count, batch_size=SEED_BATCH_SIZE):
+    batch = []
+    for index in range(count):
+        batch.append(factory(index))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def seed(db, size, seed_value=DEFAULT_SEED):
+    # Replaces the patients and users collections of db with `size` rows each. The
+    # derived collections and the schema history are dropped too, so migrations
+    # (indexes, rollups, appointments) must be applied afterwards.
+    rng = random.Random(seed_value)
+    now = datetime.utcnow() + timedelta(hours=5, minutes=30)
+    # All users share one password, so it is hashed once
+    password_hash = get_crypt_context().hash(BENCHMARK_PASSWORD)
+
+    for name in ("patients", "users", "patient_rollups", "appointments", "schema_migrations"):
+        await db[name].drop()
+
+    for batch in iter_batches(lambda i: make_patient(i, rng, now), size):
+        await db.patients.insert_many(batch, ordered=False)
+    logger.info(f"Seeded {size} patients")
+
+    for batch in iter_batches(lambda i: make_user(i, password_hash, now), size):
+        await db.users.insert_many(batch, ordered=False)
+    logger.info(f"Seeded {size} users")
+
+async def is_seeded(db, size):
+    return (
+        await db.patients.estimated_document_count() == size
+        and await db.users.estimated_document_count() == size
+    )
@@ -0,0 +1,485 @@
+import copy
+from collections import Counter
+
+import bson
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+from request_context import current_request_stats
+from benchmarks.memory_query import (
+    MISSING,
+    apply_update,
+    get_value,
+    matches,
+    normalize_sort,
+    project,
+    run_pipeline,
+    sort_documents,
+    upsert_seed
+)
+
+# In-process stand-in for the subset of the Motor API the application uses, so
+# the benchmarks (and quick local runs) work without a mongod. Documents live in
+# plain dicts and every query is a full scan: timings measure the API layer and
+# are only comparable with other stand-in runs. Each awaited call is counted in
+# client.commands and in the request's X-DB-Round-Trips, like one round trip
+# to a real server.
+
+
+def _key(value):
+    return value if isinstance(value, (str, int, ObjectId)) else repr(value)
+
+
+class UniqueIndex:
+    def __init__(self, name, fields, partial=None, sparse=False):
+        self.name = name
+        self.fields = fields
+        self.partial = partial
+        self.sparse = sparse
+        self.entries = {}
+
+    def key_for(self, document):
+        if self.partial and not matches(document, self.partial):
+            return None
+        values = [get_value(document, field, MISSING) for field in self.fields]
+        if self.sparse and all(value is MISSING for value in values):
+            return None
+        # Missing fields index as null, like MongoDB
+        return repr(tuple(None if value is MISSING else value for value in values))
+
+    def check(self, document, collection):
+        key = self.key_for(document)
+        if key is not None and self.entries.get(key, document["_id"]) != document["_id"]:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {collection} index: {self.name} dup key: {key}"
+            )
+
+    def add(self, document):
+        key = self.key_for(document)
+        if key is not None:
+            self.entries[key] = document["_id"]
+
+    def remove(self, document):
+        key = self.key_for(document)
+        if key is not None and self.entries.get(key) == document["_id"]:
+            del self.entries[key]
+
+
+class MemoryCursor:
+    def __init__(self, collection, query=None, projection=None, sort=None, skip=0, limit=0, **_):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort = normalize_sort(sort) if sort else []
+        self._skip = skip
+        self._limit = limit
+        self._results = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, n):
+        self._skip = n
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def hint(self, index):
+        return self
+
+    def _materialize(self):
+        self._collection.database.client.record_command("find", self._collection.name)
+        docs = self._collection._matching(self._query)
+        if self._sort:
+            docs = sort_documents(docs, self._sort)
+        if self._skip:
+            docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return self._collection._reply([project(doc, self._projection) for doc in docs])
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            self._results = iter(self._materialize())
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        docs = self._materialize()
+        return docs if length is None else docs[:length]
+
+
+class MemoryCommandCursor:
+    def __init__(self, docs):
+        self._all = docs
+        self._docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        return self._all if length is None else self._all[:length]
+
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._docs = {}
+        self._indexes = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        self._unique = {}
+        self._codec_options = None
+
+    def with_options(self, codec_options=None, **_):
+        # A view of the same documents whose reads come back as codec_options
+        # decodes them (e.g. RawBSONDocument), round-tripped through BSON like a reply
+        view = copy.copy(self)
+        view._codec_options = codec_options
+        return view
+
+    def _reply(self, docs):
+        if self._codec_options is None:
+            return docs
+        return [bson.decode(bson.encode(doc), self._codec_options) for doc in docs]
+
+    def _record(self, command):
+        self.database.client.record_command(command, self.name)
+
+    def _matching(self, query):
+        # Exact _id lookups skip the scan
+        if isinstance(query, dict) and len(query) == 1 and "_id" in query and not isinstance(query["_id"], dict):
+            doc = self._docs.get(_key(query["_id"]))
+            return [doc] if doc is not None else []
+        return [doc for doc in self._docs.values() if matches(doc, query)]
+
+    def _first_match(self, query, sort=None):
+        docs = self._matching(query)
+        if sort:
+            docs = sort_documents(docs, normalize_sort(sort))
+        return docs[0] if docs else None
+
+    def _insert(self, document):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        if _key(document["_id"]) in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        for index in self._unique.values():
+            index.check(document, self.name)
+        stored = copy.deepcopy(document)
+        self._docs[_key(stored["_id"])] = stored
+        for index in self._unique.values():
+            index.add(stored)
+        return stored["_id"]
+
+    def _replace(self, current, candidate):
+        for index in self._unique.values():
+            index.check(candidate, self.name)
+        for index in self._unique.values():
+            index.remove(current)
+        current.clear()
+        current.update(candidate)
+        for index in self._unique.values():
+            index.add(current)
+
+    def _remove(self, document):
+        del self._docs[_key(document["_id"])]
+        for index in self._unique.values():
+            index.remove(document)
+
+    def _update(self, query, update, upsert, many=False):
+        matched = modified = 0
+        upserted_id = None
+        targets = self._matching(query)
+        if not many:
+            targets = targets[:1]
+        for doc in targets:
+            candidate = copy.deepcopy(doc)
+            apply_update(candidate, update)
+            matched += 1
+            if candidate != doc:
+                self._replace(doc, candidate)
+                modified += 1
+        if not targets and upsert:
+            doc = upsert_seed(query)
+            apply_update(doc, update, is_insert=True)
+            upserted_id = self._insert(doc)
+        return matched, modified, upserted_id
+
+    async def insert_one(self, document, **_):
+        self._record("insert")
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents, ordered=True, **_):
+        self._record("insert")
+        ids, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                ids.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(ids)})
+        return InsertManyResult(ids, True)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return MemoryCursor(self, filter, projection, **kwargs)
+
+    async def find_one(self, filter=None, projection=None, sort=None, **_):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        docs = await MemoryCursor(self, filter, projection, sort=sort, limit=1).to_list(1)
+        return docs[0] if docs else None
+
+    async def update_one(self, filter, update, upsert=False, **_):
+        self._record("update")
+        matched, modified, upserted_id = self._update(filter, update, upsert)
+        raw = {"n": matched or (1 if upserted_id is not None else 0), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def update_many(self, filter, update, upsert=False, **_):
+        self._record("update")
+        matched, modified, upserted_id = self._update(filter, update, upsert, many=True)
+        raw = {"n": matched, "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+
+    async def replace_one(self, filter, replacement, upsert=False, **_):
+        self._record("update")
+        matched, modified, upserted_id = self._update(filter, replacement, upsert)
+        return UpdateResult({"n": matched, "nModified": modified, "upserted": upserted_id}, True)
+
+    async def find_one_and_update(
+        self, filter, update, projection=None, sort=None, upsert=False,
+        return_document=ReturnDocument.BEFORE, **_
+    ):
+        self._record("findAndModify")
+        doc = self._first_match(filter, sort)
+        if doc is None:
+            if not upsert:
+                return None
+            new_doc = upsert_seed(filter)
+            apply_update(new_doc, update, is_insert=True)
+            self._insert(new_doc)
+            return project(new_doc, projection) if return_document == ReturnDocument.AFTER else None
+        before = copy.deepcopy(doc)
+        candidate = copy.deepcopy(doc)
+        apply_update(candidate, update)
+        self._replace(doc, candidate)
+        return project(doc if return_document == ReturnDocument.AFTER else before, projection)
+
+    async def find_one_and_replace(self, filter, replacement, **kwargs):
+        return await self.find_one_and_update(filter, replacement, **kwargs)
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **_):
+        self._record("findAndModify")
+        doc = self._first_match(filter, sort)
+        if doc is None:
+            return None
+        self._remove(doc)
+        return project(doc, projection)
+
+    async def delete_one(self, filter, **_):
+        self._record("delete")
+        doc = self._first_match(filter)
+        if doc is None:
+            return DeleteResult({"n": 0}, True)
+        self._remove(doc)
+        return DeleteResult({"n": 1}, True)
+
+    async def delete_many(self, filter, **_):
+        self._record("delete")
+        targets = self._matching(filter)
+        for doc in targets:
+            self._remove(doc)
+        return DeleteResult({"n": len(targets)}, True)
+
+    async def count_documents(self, filter, limit=0, **_):
+        self._record("aggregate")
+        count = len(self._docs) if not filter else len(self._matching(filter))
+        return min(count, limit) if limit else count
+
+    async def estimated_document_count(self, **_):
+        self._record("count")
+        return len(self._docs)
+
+    async def bulk_write(self, requests, ordered=True, **_):
+        self._record("bulkWrite")
+        inserted = matched = modified = deleted = 0
+        upserted = {}
+        errors = []
+        for index, request in enumerate(requests):
+            kind = type(request).__name__
+            try:
+                if kind == "InsertOne":
+                    self._insert(request._doc)
+                    inserted += 1
+                elif kind in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+                    m, mod, upserted_id = self._update(
+                        request._filter, request._doc, request._upsert, many=kind == "UpdateMany"
+                    )
+                    matched += m
+                    modified += mod
+                    if upserted_id is not None:
+                        upserted[index] = upserted_id
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    targets = self._matching(request._filter)
+                    if kind == "DeleteOne":
+                        targets = targets[:1]
+                    for target in targets:
+                        self._remove(target)
+                    deleted += len(targets)
+                else:
+                    raise NotImplementedError(f"Unsupported bulk operation {kind}")
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        result = {
+            "nInserted": inserted,
+            "nMatched": matched,
+            "nModified": modified,
+            "nRemoved": deleted,
+            "nUpserted": len(upserted),
+            "upserted": [{"index": i, "_id": _id} for i, _id in upserted.items()],
+            "writeErrors": errors,
+            "writeConcernErrors": []
+        }
+        if errors:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    async def create_index(self, keys, **kwargs):
+        self._record("createIndexes")
+        keys = normalize_sort(keys, 1)
+        name = kwargs.get("name") or "_".join(f"{field}_{direction}" for field, direction in keys)
+        spec = {"key": keys}
+        spec.update({k: v for k, v in kwargs.items() if k not in ("name", "background")})
+        if spec.get("unique"):
+            index = UniqueIndex(
+                name, [field for field, _ in keys], spec.get("partialFilterExpression"), spec.get("sparse", False)
+            )
+            for doc in self._docs.values():
+                index.check(doc, self.name)
+                index.add(doc)
+            self._unique[name] = index
+        self._indexes[name] = spec
+        return name
+
+    async def create_indexes(self, models, **_):
+        names = []
+        for model in models:
+            document = dict(model.document)
+            keys = list(document.pop("key").items())
+            names.append(await self.create_index(keys, **document))
+        return names
+
+    async def drop_index(self, name, **_):
+        self._indexes.pop(name, None)
+        self._unique.pop(name, None)
+
+    async def drop_indexes(self, **_):
+        self._indexes = {"_id_": self._indexes["_id_"]}
+        self._unique = {}
+
+    async def index_information(self, **_):
+        return copy.deepcopy(self._indexes)
+
+    def list_indexes(self, **_):
+        return MemoryCommandCursor(
+            [dict(spec, name=name, key=dict(spec["key"])) for name, spec in self._indexes.items()]
+        )
+
+    async def drop(self, **_):
+        self._docs.clear()
+        await self.drop_indexes()
+
+    def aggregate(self, pipeline, **_):
+        self._record("aggregate")
+        return MemoryCommandCursor(self._reply(self._aggregate(pipeline)))
+
+    def _aggregate(self, pipeline):
+        # A leading $match runs against the stored documents so only matches are copied
+        if pipeline and "$match" in pipeline[0]:
+            docs, pipeline = self._matching(pipeline[0]["$match"]), pipeline[1:]
+        else:
+            docs = list(self._docs.values())
+        # $unionWith sub-pipelines are part of the same command
+        union = lambda name, sub: self.database[name]._aggregate(sub)
+        return run_pipeline([copy.deepcopy(doc) for doc in docs], pipeline, union)
+
+
+class MemoryDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def get_collection(self, name, **_):
+        return self[name]
+
+    async def list_collection_names(self, **_):
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    async def command(self, command, *args, **kwargs):
+        self.client.record_command(command if isinstance(command, str) else next(iter(command)), None)
+        return {"ok": 1.0}
+
+
+class MemoryMotorClient:
+    # Accepts and ignores AsyncIOMotorClient's arguments so it can be swapped in for it
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+        self.commands = Counter()
+        self.admin = self["admin"]
+
+    def record_command(self, name, collection):
+        self.commands[name] += 1
+        # What the driver's command listener does for the X-DB-Round-Trips header
+        stats = current_request_stats()
+        if stats is not None:
+            stats.record_command(0.0)
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    def get_database(self, name, **_):
+        return self[name]
+
+    def close(self):
+        pass
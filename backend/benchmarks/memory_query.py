@@ -0,0 +1,628 @@
+import copy
+import functools
+import random
+import re
+from datetime import datetime
+
+from bson import ObjectId
+
+# Query, update and aggregation evaluation for the in-memory MongoDB stand-in
+# (see memory_motor.py). Covers the operators this application uses; anything
+# else raises NotImplementedError rather than silently matching.
+
+MISSING = object()
+
+
+def _get_path(doc, path):
+    parts = path.split(".")
+    values = [doc]
+    for part in parts:
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    next_values.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    idx = int(part)
+                    if idx < len(value):
+                        next_values.append(value[idx])
+                else:
+                    for item in value:
+                        if isinstance(item, dict) and part in item:
+                            next_values.append(item[part])
+        values = next_values
+    return values
+
+
+def get_value(doc, path, default=None):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+    return value
+
+
+def set_path(doc, path, value):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target.setdefault(part, {})
+    if isinstance(target, list):
+        target[int(parts[-1])] = value
+    else:
+        target[parts[-1]] = value
+
+
+def unset_path(doc, path):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        if not isinstance(target, dict) or part not in target:
+            return
+        target = target[part]
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+
+
+def _type_rank(value):
+    if value is None:
+        return 1
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value):
+    if value is MISSING:
+        value = None
+    return (_type_rank(value), value if value is not None else 0)
+
+
+def compare(a, b):
+    ka, kb = _sort_key(a), _sort_key(b)
+    if ka[0] != kb[0]:
+        return (ka[0] > kb[0]) - (ka[0] < kb[0])
+    try:
+        return (ka[1] > kb[1]) - (ka[1] < kb[1])
+    except TypeError:
+        return 0
+
+
+def _match_value(values, condition):
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        return all(_match_operator(values, op, arg, condition) for op, arg in condition.items())
+    if isinstance(condition, re.Pattern):
+        return any(isinstance(v, str) and condition.search(v) for v in _flatten(values))
+    if condition is None:
+        return not values or any(v is None for v in values)
+    return any(v == condition for v in _flatten(values)) or any(v == condition for v in values)
+
+
+def _flatten(values):
+    for value in values:
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+
+def _match_operator(values, op, arg, condition):
+    flat = list(_flatten(values))
+    if op == "$eq":
+        return _match_value(values, arg)
+    if op == "$ne":
+        return not _match_value(values, arg)
+    if op == "$in":
+        return any(_match_value(values, item) for item in arg)
+    if op == "$nin":
+        return not any(_match_value(values, item) for item in arg)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        for value in flat:
+            if _type_rank(value) != _type_rank(arg):
+                continue
+            cmp = compare(value, arg)
+            if (op == "$gt" and cmp > 0) or (op == "$gte" and cmp >= 0) or (
+                op == "$lt" and cmp < 0
+            ) or (op == "$lte" and cmp <= 0):
+                return True
+        return False
+    if op == "$exists":
+        return bool(values) == bool(arg)
+    if op == "$regex":
+        flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+        pattern = arg if isinstance(arg, re.Pattern) else re.compile(arg, flags)
+        return any(isinstance(v, str) and pattern.search(v) for v in flat)
+    if op == "$options":
+        return True
+    if op == "$all":
+        return all(_match_value(values, item) for item in arg)
+    if op == "$size":
+        return any(isinstance(v, list) and len(v) == arg for v in values)
+    if op == "$type":
+        names = {"string": str, "date": datetime, "array": list, "object": dict}
+        expected = names.get(arg)
+        return any(isinstance(v, expected) for v in values)
+    if op == "$elemMatch":
+        return any(
+            isinstance(v, list) and any(isinstance(i, dict) and matches(i, arg) for i in v)
+            for v in values
+        )
+    if op == "$not":
+        return not _match_value(values, arg)
+    raise NotImplementedError(f"Unsupported query operator {op}")
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$text":
+            raise NotImplementedError("$text is not supported by the in-memory store")
+        else:
+            if not _match_value(_get_path(doc, key), condition):
+                return False
+    return True
+
+
+def _include_path(source, target, parts):
+    head, rest = parts[0], parts[1:]
+    if not isinstance(source, dict) or head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = copy.deepcopy(value)
+    elif isinstance(value, dict):
+        _include_path(value, target.setdefault(head, {}), rest)
+    elif isinstance(value, list):
+        # Sub-field projections reach into arrays of embedded documents
+        items = [item for item in value if isinstance(item, dict)]
+        projected = target.get(head)
+        if not isinstance(projected, list):
+            projected = target[head] = [{} for _ in items]
+        for item, out in zip(items, projected):
+            _include_path(item, out, rest)
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = [k for k, v in projection.items() if v and not isinstance(v, dict)]
+    exclude = [k for k, v in projection.items() if not v]
+    if include:
+        result = {}
+        if "_id" not in exclude and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for field in include:
+            _include_path(doc, result, field.split("."))
+        return result
+    result = copy.deepcopy(doc)
+    for field in exclude:
+        unset_path(result, field)
+    return result
+
+
+def apply_update(doc, update, is_insert=False):
+    if isinstance(update, list):
+        for stage in update:
+            (op, fields), = stage.items()
+            if op not in ("$set", "$addFields"):
+                raise NotImplementedError(f"Unsupported update pipeline stage {op}")
+            values = {path: evaluate(expr, doc) for path, expr in fields.items()}
+            for path, value in values.items():
+                set_path(doc, path, copy.deepcopy(value))
+        return
+    if not any(k.startswith("$") for k in update):
+        new_doc = copy.deepcopy(update)
+        new_doc["_id"] = doc["_id"]
+        doc.clear()
+        doc.update(new_doc)
+        return
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                set_path(doc, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if is_insert:
+                    set_path(doc, path, copy.deepcopy(value))
+            elif op == "$unset":
+                unset_path(doc, path)
+            elif op == "$inc":
+                set_path(doc, path, get_value(doc, path, 0) + value)
+            elif op == "$max":
+                current = get_value(doc, path, MISSING)
+                if current is MISSING or compare(value, current) > 0:
+                    set_path(doc, path, value)
+            elif op == "$min":
+                current = get_value(doc, path, MISSING)
+                if current is MISSING or compare(value, current) < 0:
+                    set_path(doc, path, value)
+            elif op == "$push":
+                current = get_value(doc, path, None)
+                if current is None:
+                    current = []
+                    set_path(doc, path, current)
+                if isinstance(value, dict) and "$each" in value:
+                    current.extend(copy.deepcopy(value["$each"]))
+                    if "$slice" in value:
+                        current[:] = current[value["$slice"]:] if value["$slice"] < 0 else current[: value["$slice"]]
+                else:
+                    current.append(copy.deepcopy(value))
+            elif op == "$addToSet":
+                current = get_value(doc, path, None)
+                if current is None:
+                    current = []
+                    set_path(doc, path, current)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in items:
+                    if item not in current:
+                        current.append(copy.deepcopy(item))
+            elif op == "$pull":
+                current = get_value(doc, path, None)
+                if isinstance(current, list):
+                    current[:] = [
+                        item for item in current
+                        if not (matches(item, value) if isinstance(value, dict) and isinstance(item, dict) else item == value)
+                    ]
+            elif op == "$currentDate":
+                set_path(doc, path, datetime.utcnow())
+            else:
+                raise NotImplementedError(f"Unsupported update operator {op}")
+
+
+def upsert_seed(query):
+    seed = {}
+    for key, value in (query or {}).items():
+        if key.startswith("$"):
+            continue
+        if isinstance(value, dict) and any(k.startswith("$") for k in value):
+            if "$eq" in value:
+                set_path(seed, key, value["$eq"])
+            continue
+        set_path(seed, key, copy.deepcopy(value))
+    return seed
+
+
+def sort_documents(docs, sort):
+    def cmp(a, b):
+        for field, direction in sort:
+            if isinstance(direction, dict):
+                continue
+            va = get_value(a, field, MISSING)
+            vb = get_value(b, field, MISSING)
+            result = compare(va, vb)
+            if result:
+                return result * (1 if direction >= 0 else -1)
+        return 0
+
+    return sorted(docs, key=functools.cmp_to_key(cmp))
+
+
+def normalize_sort(key_or_list, direction=None):
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+def _field(doc, path):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            value = [v.get(part) for v in value if isinstance(v, dict) and part in v]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+
+def evaluate(expr, doc):
+    if isinstance(expr, str):
+        if expr.startswith("$$ROOT"):
+            return doc
+        if expr.startswith("$"):
+            value = _field(doc, expr[1:])
+            return None if value is MISSING else value
+        return expr
+    if isinstance(expr, list):
+        return [evaluate(e, doc) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) == 1:
+        op, arg = next(iter(expr.items()))
+        if op.startswith("$"):
+            return _operator(op, arg, doc)
+    return {k: evaluate(v, doc) for k, v in expr.items()}
+
+
+def _operator(op, arg, doc):
+    if op == "$literal":
+        return arg
+    args = arg if isinstance(arg, list) else [arg]
+    if op == "$toLower":
+        value = evaluate(args[0], doc)
+        return (value or "").lower() if isinstance(value, str) or value is None else str(value).lower()
+    if op == "$toUpper":
+        value = evaluate(args[0], doc)
+        return (value or "").upper()
+    if op == "$ifNull":
+        for a in args:
+            value = evaluate(a, doc)
+            if value is not None:
+                return value
+        return None
+    if op == "$split":
+        value, sep = evaluate(args[0], doc), evaluate(args[1], doc)
+        return None if value is None else value.split(sep)
+    if op == "$trim":
+        value = evaluate(arg["input"], doc)
+        return None if value is None else value.strip()
+    if op == "$substrCP":
+        value, start, length = (evaluate(a, doc) for a in args)
+        return "" if value is None else value[start:start + length]
+    if op == "$dateToString":
+        value = evaluate(arg["date"], doc)
+        if not isinstance(value, datetime):
+            return None
+        return value.strftime(arg["format"])
+    if op == "$switch":
+        for branch in arg["branches"]:
+            if evaluate(branch["case"], doc):
+                return evaluate(branch["then"], doc)
+        return evaluate(arg.get("default"), doc)
+    if op == "$cond":
+        if isinstance(arg, dict):
+            cond, then, other = arg["if"], arg["then"], arg["else"]
+        else:
+            cond, then, other = arg
+        return evaluate(then, doc) if evaluate(cond, doc) else evaluate(other, doc)
+    if op in ("$lt", "$lte", "$gt", "$gte", "$eq", "$ne"):
+        a, b = evaluate(args[0], doc), evaluate(args[1], doc)
+        cmp = compare(a, b)
+        return {"$lt": cmp < 0, "$lte": cmp <= 0, "$gt": cmp > 0, "$gte": cmp >= 0, "$eq": cmp == 0, "$ne": cmp != 0}[op]
+    if op == "$and":
+        return all(evaluate(a, doc) for a in args)
+    if op == "$or":
+        return any(evaluate(a, doc) for a in args)
+    if op == "$not":
+        return not evaluate(args[0], doc)
+    if op in ("$max", "$min"):
+        values = []
+        for a in args:
+            value = evaluate(a, doc)
+            values.extend(value if isinstance(value, list) else [value])
+        values = [v for v in values if v is not None]
+        if not values:
+            return None
+        ordered = sorted(values, key=functools.cmp_to_key(compare))
+        return ordered[-1] if op == "$max" else ordered[0]
+    if op == "$sum":
+        total = 0
+        for a in args:
+            value = evaluate(a, doc)
+            for v in value if isinstance(value, list) else [value]:
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    total += v
+        return total
+    if op == "$size":
+        value = evaluate(args[0], doc)
+        return len(value or [])
+    if op == "$concat":
+        parts = [evaluate(a, doc) for a in args]
+        return None if any(p is None for p in parts) else "".join(parts)
+    if op == "$add":
+        return sum(evaluate(a, doc) or 0 for a in args)
+    if op == "$subtract":
+        return evaluate(args[0], doc) - evaluate(args[1], doc)
+    if op == "$multiply":
+        result = 1
+        for a in args:
+            result *= evaluate(a, doc)
+        return result
+    if op == "$type":
+        value = evaluate(args[0], doc)
+        if isinstance(value, str):
+            return "string"
+        if isinstance(value, list):
+            return "array"
+        if isinstance(value, datetime):
+            return "date"
+        if value is None:
+            return "missing"
+        return type(value).__name__
+    if op == "$isArray":
+        return isinstance(evaluate(args[0], doc), list)
+    if op == "$toString":
+        value = evaluate(args[0], doc)
+        return None if value is None else str(value)
+    if op == "$indexOfCP":
+        value, sub = evaluate(args[0], doc), evaluate(args[1], doc)
+        return None if value is None else value.find(sub)
+    if op == "$in":
+        return evaluate(args[0], doc) in (evaluate(args[1], doc) or [])
+    if op == "$concatArrays":
+        result = []
+        for a in args:
+            value = evaluate(a, doc)
+            if value is None:
+                return None
+            result.extend(value)
+        return result
+    if op == "$filter":
+        items = evaluate(arg["input"], doc) or []
+        name = arg.get("as", "this")
+        return [i for i in items if evaluate(_rebind(arg["cond"], name), {**doc, "__var": i})]
+    raise NotImplementedError(f"Unsupported aggregation operator {op}")
+
+
+def _rebind(expr, name):
+    if isinstance(expr, str) and expr.startswith(f"$${name}"):
+        return "$__var" + expr[len(name) + 2:]
+    if isinstance(expr, list):
+        return [_rebind(e, name) for e in expr]
+    if isinstance(expr, dict):
+        return {k: _rebind(v, name) for k, v in expr.items()}
+    return expr
+
+
+def _accumulate(op, arg, docs):
+    if op == "$sum":
+        total = 0
+        for d in docs:
+            value = evaluate(arg, d)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total += value
+        return total
+    if op == "$avg":
+        values = [evaluate(arg, d) for d in docs]
+        values = [v for v in values if isinstance(v, (int, float))]
+        return sum(values) / len(values) if values else None
+    if op in ("$max", "$min"):
+        values = [v for v in (evaluate(arg, d) for d in docs) if v is not None]
+        if not values:
+            return None
+        ordered = sorted(values, key=functools.cmp_to_key(compare))
+        return ordered[-1] if op == "$max" else ordered[0]
+    if op == "$first":
+        return evaluate(arg, docs[0]) if docs else None
+    if op == "$last":
+        return evaluate(arg, docs[-1]) if docs else None
+    if op == "$push":
+        return [evaluate(arg, d) for d in docs]
+    if op == "$addToSet":
+        result = []
+        for d in docs:
+            value = evaluate(arg, d)
+            if value not in result:
+                result.append(value)
+        return result
+    raise NotImplementedError(f"Unsupported accumulator {op}")
+
+
+def run_pipeline(docs, pipeline, union=None):
+    # union(collection name, pipeline) runs a $unionWith sub-pipeline
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if matches(d, spec)]
+        elif name in ("$project", "$addFields", "$set"):
+            new_docs = []
+            for d in docs:
+                if name == "$project" and all(v in (0, False) for v in spec.values()):
+                    out = copy.deepcopy(d)
+                    for key in spec:
+                        out.pop(key, None)
+                elif name == "$project":
+                    out = {}
+                    if spec.get("_id", 1) and "_id" in d:
+                        out["_id"] = d["_id"]
+                    for key, value in spec.items():
+                        if key == "_id" and value in (0, 1, True, False):
+                            continue
+                        if value in (1, True):
+                            found = get_value(d, key, MISSING)
+                            if found is not MISSING:
+                                set_path(out, key, found)
+                        elif value not in (0, False):
+                            set_path(out, key, evaluate(value, d))
+                else:
+                    out = copy.deepcopy(d)
+                    for key, value in spec.items():
+                        set_path(out, key, evaluate(value, d))
+                new_docs.append(out)
+            docs = new_docs
+        elif name == "$unwind":
+            path = spec if isinstance(spec, str) else spec["path"]
+            preserve = isinstance(spec, dict) and spec.get("preserveNullAndEmptyArrays")
+            field = path[1:]
+            new_docs = []
+            for d in docs:
+                value = get_value(d, field, MISSING)
+                if isinstance(value, list):
+                    if not value and preserve:
+                        new_docs.append(d)
+                    for item in value:
+                        out = copy.deepcopy(d)
+                        set_path(out, field, item)
+                        new_docs.append(out)
+                elif value is not MISSING and value is not None:
+                    new_docs.append(d)
+                elif preserve:
+                    new_docs.append(d)
+            docs = new_docs
+        elif name == "$group":
+            groups = {}
+            order = []
+            for d in docs:
+                key = evaluate(spec["_id"], d)
+                marker = repr(key)
+                if marker not in groups:
+                    groups[marker] = (key, [])
+                    order.append(marker)
+                groups[marker][1].append(d)
+            new_docs = []
+            for marker in order:
+                key, members = groups[marker]
+                out = {"_id": key}
+                for field, acc in spec.items():
+                    if field == "_id":
+                        continue
+                    (op, arg), = acc.items()
+                    out[field] = _accumulate(op, arg, members)
+                new_docs.append(out)
+            docs = new_docs
+        elif name == "$sort":
+            docs = sort_documents(docs, list(spec.items()))
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == "$facet":
+            docs = [{key: run_pipeline(copy.deepcopy(docs), sub, union) for key, sub in spec.items()}]
+        elif name == "$unionWith":
+            if union is None:
+                raise NotImplementedError("$unionWith needs a collection")
+            docs = docs + union(spec["coll"], spec.get("pipeline", []))
+        elif name == "$replaceRoot":
+            docs = [evaluate(spec["newRoot"], d) for d in docs]
+        elif name == "$sample":
+            docs = random.sample(docs, min(spec["size"], len(docs)))
+        elif name == "$sortByCount":
+            docs = run_pipeline(docs, [{"$group": {"_id": spec, "count": {"$sum": 1}}}, {"$sort": {"count": -1}}])
+        else:
+            raise NotImplementedError(f"Unsupported pipeline stage {name}")
+    return docs
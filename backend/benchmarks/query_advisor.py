@@ -0,0 +1,391 @@
+from datetime import datetime
+from pymongo import monitoring
+from pymongo.errors import OperationFailure
+from request_context import current_request_stats
+from benchmarks.dataset import SIZES, DEFAULT_SEED, seed, is_seeded
+from benchmarks.runner import Workload, OPERATIONS, API, open_backend, sample_patients, authenticate
+from migrations import migrate
+import copy
+import httpx
+import json
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Query-shape index advisor. While the API serves a workload against a seeded
+# mongod, a command listener records every distinct query shape it issues:
+# collection, filter fields and operators (values replaced by "?"), sort and
+# projection. Each shape is then explained with executionStats. A shape is
+# flagged when its winning plan scans the collection, sorts in memory, or
+# examines far more documents than it returns. Flagged shapes get a proposed
+# compound index: equality fields, then sort fields, then range fields.
+MAX_EXAMINED_RATIO = 10
+# Below this many examined documents a high ratio is noise (tiny collections)
+MIN_DOCS_EXAMINED = 100
+
+# Fields the driver adds to every command; explain rejects some of them
+DRIVER_FIELDS = (
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit",
+    "startTransaction", "readConcern", "writeConcern"
+)
+EQUALITY_OPERATORS = ("$eq", "$in")
+SORT_STAGES = ("SORT", "SORT_KEY_GENERATOR")
+
+# Requests beyond the benchmark operations that reach other query paths
+EXTRA_REQUESTS = ("list_gender", "list_cursor", "list_summary", "export", "analytics", "summary", "patch", "append")
+
+
+def shape_of(value):
+    # The query with every literal replaced by "?"; operators and field names stay
+    if isinstance(value, dict):
+        return {key: shape_of(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            item_shape = shape_of(item)
+            if item_shape not in shapes:
+                shapes.append(item_shape)
+        return shapes
+    return "?"
+
+def _without_driver_fields(command):
+    return {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+
+def _pipeline_query(pipeline):
+    # Leading $match stages are what the planner can answer from an index,
+    # plus a $sort that directly follows them
+    query, sort = {}, None
+    for stage in pipeline:
+        if "$match" in stage:
+            query = {"$and": [query, stage["$match"]]} if query else dict(stage["$match"])
+            continue
+        if "$sort" in stage:
+            sort = dict(stage["$sort"])
+        break
+    return query, sort
+
+def command_queries(command_name, command):
+    # Yields (filter, sort, projection, explainable command) for each query in a command
+    if command_name == "find":
+        yield command.get("filter", {}), command.get("sort"), command.get("projection"), command
+    elif command_name == "aggregate":
+        query, sort = _pipeline_query(command.get("pipeline", []))
+        yield query, sort, None, command
+        # A $unionWith sub-pipeline is planned on its own, as a separate aggregate
+        for stage in command.get("pipeline", []):
+            if "$unionWith" in stage:
+                union = stage["$unionWith"]
+                sub = {"aggregate": union["coll"], "pipeline": union.get("pipeline", []), "cursor": {}}
+                yield from command_queries("aggregate", sub)
+    elif command_name == "count":
+        yield command.get("query", {}), None, None, command
+    elif command_name == "distinct":
+        yield command.get("query", {}), None, None, command
+    elif command_name.lower() == "findandmodify":
+        yield command.get("query", {}), command.get("sort"), command.get("fields"), command
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes", [])
+        for statement in statements:
+            single = {key: value for key, value in command.items() if key not in ("updates", "deletes")}
+            single["updates" if command_name == "update" else "deletes"] = [statement]
+            yield statement.get("q", {}), None, None, single
+
+
+class QueryShape:
+    def __init__(self, database, collection, operation, query, sort, projection, command):
+        self.database = database
+        self.collection = collection
+        self.operation = operation
+        self.filter = shape_of(query)
+        self.sort = dict(sort) if sort else None
+        self.projection = sorted(projection) if projection else None
+        self.command = command
+        self.count = 0
+        self.plan = None
+        self.docs_examined = None
+        self.keys_examined = None
+        self.returned = None
+        self.problems = []
+        self.proposals = []
+        self.status = "recorded"
+
+    def query(self):
+        # The recorded example's actual filter (operators intact, values real)
+        for query, _, _, _ in command_queries(self.operation, self.command):
+            return query
+        return {}
+
+    @property
+    def key(self):
+        return (
+            self.collection, self.operation, json.dumps(self.filter, sort_keys=True),
+            json.dumps(self.sort), json.dumps(self.projection)
+        )
+
+    def report(self):
+        return {
+            "status": self.status,
+            "collection": self.collection,
+            "operation": self.operation,
+            "filter": self.filter,
+            "sort": self.sort,
+            "projection": self.projection,
+            "count": self.count,
+            "plan": self.plan,
+            "docs_examined": self.docs_examined,
+            "keys_examined": self.keys_examined,
+            "returned": self.returned,
+            "problems": self.problems,
+            "proposed_indexes": self.proposals
+        }
+
+
+class QueryShapeRecorder(monitoring.CommandListener):
+    # Only commands issued while an API request is being handled are recorded,
+    # so seeding and the advisor's own queries stay out of the report
+    def __init__(self):
+        self.shapes = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if current_request_stats() is None:
+            return
+        command = _without_driver_fields(event.command)
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            return
+        for query, sort, projection, explainable in command_queries(event.command_name, command):
+            shape = QueryShape(
+                event.database_name, explainable.get(event.command_name, collection), event.command_name,
+                query, sort, projection,
+                copy.deepcopy(explainable)
+            )
+            with self._lock:
+                shape = self.shapes.setdefault(shape.key, shape)
+                shape.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def _plan_sections(explain):
+    # (winning plan, execution stats) pairs, wherever the server nested them
+    # (aggregate puts them under stages[0].$cursor, sharded clusters per shard)
+    if isinstance(explain, dict):
+        if "queryPlanner" in explain:
+            planner = explain["queryPlanner"]
+            winning = planner.get("winningPlan", {})
+            yield winning.get("queryPlan", winning), explain.get("executionStats", {})
+            return
+        for value in explain.values():
+            yield from _plan_sections(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from _plan_sections(value)
+
+def plan_stages(plan):
+    # Flattens a plan tree into (stage, index name) pairs, root first
+    if not isinstance(plan, dict):
+        return []
+    stages = [(plan.get("stage"), plan.get("indexName"))] if plan.get("stage") else []
+    for child in ("inputStage", "outerStage", "innerStage", "queryPlan"):
+        stages.extend(plan_stages(plan.get(child)))
+    for child in plan.get("inputStages", []) + plan.get("shards", []):
+        stages.extend(plan_stages(child))
+    return stages
+
+def _describe_plan(stages):
+    return " <- ".join(f"{stage}[{index}]" if index else stage for stage, index in stages)
+
+def _is_range(condition):
+    if not isinstance(condition, dict):
+        return False
+    operators = [key for key in condition if key.startswith("$")]
+    return bool(operators) and not all(op in EQUALITY_OPERATORS for op in operators)
+
+def propose_indexes(query, sort):
+    # ESR rule: fields compared for equality first, then the sort, then ranges.
+    # A top-level $or needs an index per branch, each led by the shared fields.
+    equality, ranges, branches = [], [], []
+    for field, condition in query.items():
+        if field == "$and":
+            for clause in condition:
+                for proposal in propose_indexes(clause, None):
+                    for key, _ in proposal:
+                        if key not in equality and key not in ranges:
+                            equality.append(key)
+        elif field == "$or":
+            branches = condition
+        elif field.startswith("$"):
+            continue
+        elif _is_range(condition):
+            ranges.append(field)
+        else:
+            equality.append(field)
+
+    def build(extra_equality, extra_ranges):
+        # An equality field that is also sorted on keeps the sort's direction
+        keys = [(field, (sort or {}).get(field, 1)) for field in equality + extra_equality]
+        for field, direction in (sort or {}).items():
+            if all(field != key for key, _ in keys):
+                keys.append((field, direction))
+        for field in ranges + extra_ranges:
+            if all(field != key for key, _ in keys):
+                keys.append((field, 1))
+        # _id alone is always indexed
+        return keys if keys and keys != [("_id", 1)] else None
+
+    if not branches:
+        proposal = build([], [])
+        return [proposal] if proposal else []
+    proposals = []
+    for branch in branches:
+        branch_equality = [f for f, c in branch.items() if not f.startswith("$") and not _is_range(c)]
+        branch_ranges = [f for f, c in branch.items() if not f.startswith("$") and _is_range(c)]
+        proposal = build(branch_equality, branch_ranges)
+        if proposal and proposal not in proposals:
+            proposals.append(proposal)
+    return proposals
+
+def analyze(shape, explain, max_ratio=MAX_EXAMINED_RATIO, min_docs=MIN_DOCS_EXAMINED):
+    stages, docs_examined, keys_examined, returned = [], 0, 0, 0
+    for plan, stats in _plan_sections(explain):
+        stages.extend(plan_stages(plan))
+        docs_examined += stats.get("totalDocsExamined", 0)
+        keys_examined += stats.get("totalKeysExamined", 0)
+        returned += stats.get("nReturned", 0)
+    shape.plan = _describe_plan(stages)
+    shape.docs_examined, shape.keys_examined, shape.returned = docs_examined, keys_examined, returned
+    names = [stage for stage, _ in stages]
+
+    query = shape.query()
+    if "COLLSCAN" in names:
+        if query:
+            shape.problems.append("collection scan")
+        else:
+            # Reading a whole collection is what an unfiltered query asks for
+            shape.status = "unfiltered"
+    if any(name in SORT_STAGES for name in names):
+        shape.problems.append("in-memory sort")
+    if docs_examined >= min_docs and docs_examined > max_ratio * max(returned, 1):
+        shape.problems.append(f"examined {docs_examined} documents to return {returned}")
+
+    if shape.problems:
+        shape.status = "flagged"
+        shape.proposals = propose_indexes(query, shape.sort)
+    elif shape.status != "unfiltered":
+        shape.status = "ok"
+    return shape
+
+
+async def explain_shapes(client, shapes, max_ratio=MAX_EXAMINED_RATIO, min_docs=MIN_DOCS_EXAMINED):
+    for shape in shapes:
+        try:
+            explain = await client[shape.database].command(
+                {"explain": shape.command, "verbosity": "executionStats"}
+            )
+        except OperationFailure as e:
+            shape.status = "unexplained"
+            shape.problems.append(f"explain failed: {e}")
+            continue
+        analyze(shape, explain, max_ratio, min_docs)
+
+async def extra_request(name, workload):
+    # (method, url, request kwargs) for one of EXTRA_REQUESTS
+    sample = workload.rng.choice(workload.samples)
+    if name == "list_gender":
+        return "GET", f"{API}/", {"params": {"gender": sample["gender"], "page": 2}}
+    if name == "list_cursor":
+        return "GET", f"{API}/", {"params": {"mode": "cursor", "gender": sample["gender"]}}
+    if name == "list_summary":
+        return "GET", f"{API}/", {"params": {"view": "summary", "count": "estimated"}}
+    if name == "export":
+        return "GET", f"{API}/export", {"params": {"gender": sample["gender"]}}
+    if name == "analytics":
+        return "GET", f"{API}/analytics", {}
+    if name == "summary":
+        return "GET", f"{API}/metrics/summary", {}
+    if name == "patch":
+        return "PATCH", f"{API}/{sample['id']}", {"json": {"notes": f"advisor patch {workload.next_index()}"}}
+    if name == "append":
+        prescription = {"date": "2024-01-01", "medication": "Metformin", "dosage": "500mg"}
+        return "POST", f"{API}/{sample['id']}/prescriptions", {"json": prescription}
+    raise ValueError(f"Unknown request: {name}")
+
+async def record_shapes(client, workload, headers, requests):
+    for operation in OPERATIONS:
+        for _ in range(requests):
+            method, url, kwargs = await workload.prepare(operation, client, headers)
+            response = await client.request(method, url, headers=headers, **kwargs)
+            if operation == "create" and response.status_code < 400:
+                workload.created.append(response.json()["id"])
+    for name in EXTRA_REQUESTS:
+        for _ in range(requests):
+            method, url, kwargs = await extra_request(name, workload)
+            await client.request(method, url, headers=headers, **kwargs)
+
+async def run_advisor(
+    size="1k",
+    requests=5,
+    seed_value=DEFAULT_SEED,
+    mongodb_url="mongodb://localhost:27017",
+    database_name=None,
+    reseed=False,
+    max_ratio=MAX_EXAMINED_RATIO,
+    min_docs=MIN_DOCS_EXAMINED
+):
+    rows = SIZES[size]
+    database_name = database_name or f"healthcare_bench_{size}"
+    recorder = QueryShapeRecorder()
+    # Registered globally so the app's own client, created at startup, reports to it
+    monitoring.register(recorder)
+
+    # Needs a real mongod: the in-memory stand-in neither emits command events nor explains
+    async with open_backend("mongodb", mongodb_url, database_name) as db:
+        if reseed or not await is_seeded(db, rows):
+            logger.info(f"Seeding {rows} rows into {database_name}")
+            await seed(db, rows, seed_value)
+        await migrate(db)
+        rng = random.Random(seed_value)
+        workload = Workload(rows, await sample_patients(db, rng), rng)
+
+        from main import app
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://advisor", timeout=60) as client:
+                headers = await authenticate(client)
+                await record_shapes(client, workload, headers, requests)
+
+            shapes = sorted(recorder.shapes.values(), key=lambda s: (s.collection, s.operation, -s.count))
+            await explain_shapes(db.client, shapes, max_ratio, min_docs)
+
+    return {
+        "advisor": {"size": size, "rows": rows, "database": database_name},
+        "started_at": datetime.utcnow().isoformat(),
+        "thresholds": {"max_examined_ratio": max_ratio, "min_docs_examined": min_docs},
+        "shapes": [shape.report() for shape in shapes],
+        "flagged": sum(1 for shape in shapes if shape.status in ("flagged", "unexplained"))
+    }
+
+def format_report(report):
+    lines = []
+    for shape in report["shapes"]:
+        query = json.dumps(shape["filter"], separators=(",", ":"))
+        sort = f" sort={json.dumps(shape['sort'], separators=(',', ':'))}" if shape["sort"] else ""
+        lines.append(f"[{shape['status']:>10}] {shape['collection']}.{shape['operation']} x{shape['count']} {query}{sort}")
+        if shape["plan"]:
+            lines.append(
+                f"{'':13}plan: {shape['plan']} (docs {shape['docs_examined']}, "
+                f"keys {shape['keys_examined']}, returned {shape['returned']})"
+            )
+        for problem in shape["problems"]:
+            lines.append(f"{'':13}problem: {problem}")
+        for keys in shape["proposed_indexes"]:
+            lines.append(f"{'':13}proposed index: {keys}")
+    lines.append(f"{len(report['shapes'])} query shapes, {report['flagged']} flagged")
+    return "\n".join(lines)
@@ -0,0 +1,265 @@
+from datetime import datetime
+from benchmarks.dataset import (
+    SIZES,
+    DEFAULT_SEED,
+    BENCHMARK_PASSWORD,
+    FIRST_NAMES,
+    CONDITIONS,
+    make_patient,
+    seed,
+    is_seeded
+)
+from migrations import migrate
+from models import PatientBase
+import asyncio
+import contextlib
+import httpx
+import logging
+import math
+import platform
+import random
+import subprocess
+import time
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("list", "search", "detail", "create", "update", "delete", "login")
+BACKENDS = ("memory", "mongodb")
+PERCENTILES = (50, 95, 99)
+SAMPLE_SIZE = 1000
+API = "/api/patients"
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(latencies, statuses, round_trips, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    errors = sum(n for status, n in statuses.items() if status >= 400)
+    result = {
+        "count": count,
+        "errors": errors,
+        "statuses": {str(status): n for status, n in sorted(statuses.items())},
+        "throughput_rps": round(count / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / count * 1000, 3) if count else None,
+            "max": round(latencies[-1] * 1000, 3) if count else None
+        },
+        "db_round_trips_mean": round(sum(round_trips) / len(round_trips), 2) if round_trips else None
+    }
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        result["latency_ms"][f"p{p}"] = round(value * 1000, 3) if value is not None else None
+    return result
+
+
+class Workload:
+    # Builds the requests for each operation from a sample of the seeded data
+    def __init__(self, rows, samples, rng):
+        self.rows = rows
+        self.samples = samples
+        self.rng = rng
+        self.created = []
+        self.counter = 0
+        self.now = datetime.utcnow()
+
+    def next_index(self):
+        # Row indexes past the seeded range keep generated phone numbers unique
+        self.counter += 1
+        return self.rows + self.counter
+
+    def search_term(self):
+        kind = self.rng.random()
+        if kind < 0.6:
+            name = self.rng.choice(self.samples)["name"] if self.samples else self.rng.choice(FIRST_NAMES)
+            token = self.rng.choice(name.split())
+            return token[:self.rng.randint(3, len(token))]
+        if kind < 0.8:
+            return self.rng.choice(CONDITIONS)[:5]
+        return f"9{self.rng.randrange(10 ** 4):04d}"
+
+    def new_patient(self):
+        patient = make_patient(self.next_index(), self.rng, self.now)
+        body = {field: patient[field] for field in PatientBase.model_fields}
+        body["prescriptions"] = patient["prescriptions"]
+        body["appointments"] = patient["appointments"]
+        return body
+
+    async def create_for_delete(self, client, headers):
+        response = await client.post(f"{API}/", json=self.new_patient(), headers=headers)
+        response.raise_for_status()
+        self.created.append(response.json()["id"])
+
+    async def prepare(self, operation, client, headers):
+        # Returns (method, url, request kwargs); any setup here is not timed
+        if operation == "list":
+            return "GET", f"{API}/", {"params": {"page": self.rng.randint(1, 20), "limit": 10}}
+        if operation == "search":
+            return "GET", f"{API}/", {"params": {"search": self.search_term(), "limit": 10}}
+        if operation == "detail":
+            return "GET", f"{API}/{self.rng.choice(self.samples)['id']}", {}
+        if operation == "create":
+            return "POST", f"{API}/", {"json": self.new_patient()}
+        if operation == "update":
+            sample = self.rng.choice(self.samples)
+            body = {field: sample.get(field) for field in PatientBase.model_fields}
+            body["notes"] = f"benchmark update {self.next_index()}"
+            return "PUT", f"{API}/{sample['id']}/", {"json": body}
+        if operation == "delete":
+            # Only patients created by this run are deleted, so the seeded set stays intact
+            if not self.created:
+                await self.create_for_delete(client, headers)
+            return "DELETE", f"{API}/{self.created.pop()}", {}
+        if operation == "login":
+            user = f"bench_user_{self.rng.randrange(self.rows)}"
+            return "POST", "/api/auth/token", {"data": {"username": user, "password": BENCHMARK_PASSWORD}}
+        raise ValueError(f"Unknown operation: {operation}")
+
+
+async def run_operation(client, workload, operation, requests, concurrency, headers):
+    latencies = []
+    round_trips = []
+    statuses = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            method, url, kwargs = await workload.prepare(operation, client, headers)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, headers=headers, **kwargs)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                logger.warning(f"{operation} request failed: {e}")
+                response, status = None, 599
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            if response is not None and operation == "create" and status < 400:
+                workload.created.append(response.json()["id"])
+            if response is not None and "x-db-round-trips" in response.headers:
+                round_trips.append(int(response.headers["x-db-round-trips"]))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, round_trips, time.perf_counter() - started)
+
+async def sample_patients(db, rng):
+    fields = {field: 1 for field in PatientBase.model_fields}
+    cursor = db.patients.aggregate([{"$sample": {"size": SAMPLE_SIZE}}, {"$project": fields}])
+    samples = []
+    async for document in cursor:
+        document["id"] = str(document.pop("_id"))
+        samples.append(document)
+    rng.shuffle(samples)
+    return samples
+
+async def authenticate(client):
+    # Needed when REQUIRE_AUTH is on; also exercises the principal cache otherwise
+    response = await client.post(
+        "/api/auth/token", data={"username": "bench_user_0", "password": BENCHMARK_PASSWORD}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@contextlib.asynccontextmanager
+async def open_backend(backend, mongodb_url, database_name):
+    # Points database.py at the chosen backend and yields the database handle used for seeding
+    import database
+    if backend == "memory":
+        from benchmarks.memory_motor import MemoryMotorClient
+        client = MemoryMotorClient()
+        database.AsyncIOMotorClient = lambda *args, **kwargs: client
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(mongodb_url)
+        database.MONGODB_URL = mongodb_url
+    database.DATABASE_NAME = database_name
+    try:
+        yield client[database_name]
+    finally:
+        client.close()
+
+async def run_benchmark(
+    size="1k",
+    backend="memory",
+    operations=OPERATIONS,
+    requests=200,
+    concurrency=16,
+    warmup=20,
+    seed_value=DEFAULT_SEED,
+    mongodb_url="mongodb://localhost:27017",
+    database_name=None,
+    reseed=False,
+    url=None
+):
+    rows = SIZES[size]
+    database_name = database_name or f"healthcare_bench_{size}"
+    rng = random.Random(seed_value)
+    started_at = datetime.utcnow().isoformat()
+
+    async with open_backend(backend, mongodb_url, database_name) as db:
+        if reseed or not await is_seeded(db, rows):
+            logger.info(f"Seeding {rows} rows into {backend}:{database_name}")
+            await seed(db, rows, seed_value)
+        await migrate(db)
+        samples = await sample_patients(db, rng)
+        workload = Workload(rows, samples, rng)
+
+        if url:
+            # A separately running server (e.g. several workers) that uses the same database
+            lifespan = contextlib.nullcontext()
+            transport = httpx.AsyncHTTPTransport()
+            base_url = url
+        else:
+            from main import app
+            lifespan = app.router.lifespan_context(app)
+            transport = httpx.ASGITransport(app=app)
+            base_url = "http://benchmark"
+
+        results = {}
+        async with lifespan:
+            async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) as client:
+                headers = await authenticate(client)
+                for operation in operations:
+                    if warmup:
+                        await run_operation(client, workload, operation, warmup, concurrency, headers)
+                    results[operation] = await run_operation(
+                        client, workload, operation, requests, concurrency, headers
+                    )
+                    logger.info(f"{operation}: {results[operation]['throughput_rps']} req/s")
+
+    return {
+        "benchmark": {
+            "size": size,
+            "rows": rows,
+            "backend": backend,
+            "target": url or "in-process",
+            "operations": list(operations),
+            "requests": requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "seed": seed_value
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "git_commit": git_commit()
+        },
+        "started_at": started_at,
+        "results": results
+    }
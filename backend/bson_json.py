@@ -0,0 +1,41 @@
+from bson import decode_all
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+import os
+
+# Opt-in fast read path for the patient list and export (RAW_BSON_READS=true).
+# Their queries run on a view of the collection that returns RawBSONDocument, so
+# the driver only slices each reply into per-document byte strings. A page is
+# then decoded in a single decode_all call over the concatenated bytes and goes
+# to orjson as it is: no to_response copy per document, and created_at is
+# encoded natively rather than through isoformat(). The JSON is the same as on
+# the default path. Code that reads a field of a raw document (cursor tokens)
+# keeps working, since RawBSONDocument decodes itself on first access.
+RAW_BSON_READS = os.getenv("RAW_BSON_READS", "false").lower() == "true"
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+# Used when a page of raw documents is decoded for the response
+RESPONSE_CODEC_OPTIONS = CodecOptions(unicode_decode_error_handler="replace")
+
+
+def raw_collection(collection):
+    return collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+def read_collection(collection):
+    # The collection reads should go to: the raw view when the fast path is on
+    return raw_collection(collection) if RAW_BSON_READS else collection
+
+def is_raw(documents) -> bool:
+    return bool(documents) and isinstance(documents[0], RawBSONDocument)
+
+def decode_documents(documents) -> list:
+    # Raw documents -> dicts, in one call
+    if not documents:
+        return []
+    return decode_all(b"".join(document.raw for document in documents), RESPONSE_CODEC_OPTIONS)
+
+def response_documents(documents) -> list:
+    # Raw patient documents in response shape: decoded once, _id renamed to id
+    patients = decode_documents(documents)
+    for patient in patients:
+        patient["id"] = str(patient.pop("_id"))
+    return patients
@@ -0,0 +1,288 @@
+from datetime import datetime, timedelta
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from models import PatientCreate, PatientBase
+from search import SEARCH_PROJECTION
+from patient_repository import derived_fields
+from analytics import apply_patient_changes
+from appointments import apply_appointment_changes
+from events import event_bus
+from etags import bump_change_counter, list_version
+from pagination import PATIENT_SORT, count_cache
+from serialization import dumps
+from bson_json import RAW_BSON_READS, raw_collection, response_documents
+import csv
+import io
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Streaming NDJSON/CSV import and export of patients. Neither direction holds
+# more than one batch of rows in memory.
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "100000"))
+# A longer NDJSON line or CSV record is reported as a failed row, not buffered
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(1024 * 1024)))
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Scalar columns in CSV files; prescriptions and appointments are JSON arrays
+CSV_COLUMNS = ["id"] + list(PatientBase.model_fields) + ["created_at", "prescriptions", "appointments"]
+CSV_JSON_COLUMNS = ("prescriptions", "appointments")
+
+
+def detect_format(content_type, requested=None):
+    if requested:
+        return requested
+    if content_type and "csv" in content_type:
+        return "csv"
+    return "ndjson"
+
+class RowTooLong(ValueError):
+    def __init__(self, max_length=BULK_MAX_LINE_BYTES):
+        super().__init__(f"row is longer than {max_length} bytes")
+
+
+def _decode_line(line):
+    return bytes(line).rstrip(b"\r").decode("utf-8-sig")
+
+async def iter_lines(chunks, max_length=BULK_MAX_LINE_BYTES):
+    # Split a stream of byte chunks into decoded lines without buffering the body.
+    # A line longer than max_length is yielded as a RowTooLong error instead, and
+    # the rest of it is skipped as it arrives.
+    pending = bytearray()
+    skipping = False
+    async for chunk in chunks:
+        start = 0
+        end = chunk.find(b"\n")
+        while end >= 0:
+            if skipping:
+                skipping = False
+            elif len(pending) + end - start > max_length:
+                yield RowTooLong(max_length)
+            else:
+                pending += chunk[start:end]
+                yield _decode_line(pending)
+            pending.clear()
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        if skipping:
+            continue
+        pending += chunk[start:]
+        if len(pending) > max_length:
+            yield RowTooLong(max_length)
+            pending.clear()
+            skipping = True
+    if pending:
+        yield _decode_line(pending)
+
+async def iter_csv_records(lines, max_length=BULK_MAX_LINE_BYTES):
+    # Re-join physical lines belonging to one quoted, multi-line CSV field. A
+    # record that grows past max_length (e.g. an unterminated quote) is yielded
+    # as a RowTooLong error and reading starts over at the next line.
+    parts, quotes, length = [], 0, 0
+    async for line in lines:
+        if isinstance(line, Exception):
+            parts, quotes, length = [], 0, 0
+            yield line
+            continue
+        parts.append(line)
+        quotes += line.count('"')
+        length += len(line) + 1
+        if length > max_length:
+            parts, quotes, length = [], 0, 0
+            yield RowTooLong(max_length)
+        elif quotes % 2 == 0:
+            yield next(csv.reader(["\n".join(parts)]), [])
+            parts, quotes, length = [], 0, 0
+    if parts:
+        yield next(csv.reader(["\n".join(parts)]), [])
+
+async def iter_rows(chunks, fmt):
+    # Yields (row_number, dict or exception) for every non-blank row
+    lines = iter_lines(chunks)
+    if fmt == "ndjson":
+        row_number = 0
+        async for line in lines:
+            row_number += 1
+            if isinstance(line, Exception):
+                yield row_number, line
+                continue
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("each line must be a JSON object")
+                yield row_number, row
+            except ValueError as e:
+                yield row_number, e
+        return
+
+    header = None
+    row_number = 0
+    async for record in iter_csv_records(lines):
+        if header is None:
+            if isinstance(record, Exception):
+                yield 0, ValueError(f"CSV header: {record}")
+                return
+            header = [column.strip() for column in record]
+            continue
+        row_number += 1
+        if isinstance(record, Exception):
+            yield row_number, record
+            continue
+        if not any(value.strip() for value in record):
+            continue
+        try:
+            row = {}
+            for column, value in zip(header, record):
+                value = value.strip()
+                if not value:
+                    continue
+                row[column] = json.loads(value) if column in CSV_JSON_COLUMNS else value
+            yield row_number, row
+        except ValueError as e:
+            yield row_number, e
+
+def _error_message(error):
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors()
+        )
+    return str(error)
+
+
+class ImportReport:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def as_dict(self):
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+
+async def _flush(db, batch, report):
+    # batch is a list of (row_number, document); inserts keep going past bad rows
+    if not batch:
+        return
+    documents = [document for _, document in batch]
+    failed_indexes = set()
+    try:
+        await db.patients.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed_indexes.add(error["index"])
+            report.add_error(batch[error["index"]][0], error.get("errmsg", "write error"))
+
+    inserted = [document for index, document in enumerate(documents) if index not in failed_indexes]
+    report.inserted += len(inserted)
+    changes = [(None, document) for document in inserted]
+    if inserted:
+        list_version.bump()
+        await bump_change_counter(db)
+    await apply_patient_changes(db, changes)
+    await apply_appointment_changes(db, changes)
+    event_bus.publish_patient_changes(changes)
+
+async def import_patients(db, chunks, fmt):
+    report = ImportReport()
+    batch = []
+    async for row_number, row in iter_rows(chunks, fmt):
+        report.received += 1
+        if report.received > BULK_MAX_ROWS:
+            report.add_error(row_number, f"row limit of {BULK_MAX_ROWS} exceeded")
+            break
+        if isinstance(row, Exception):
+            report.add_error(row_number, _error_message(row))
+            continue
+        try:
+            document = PatientCreate(**row).model_dump()
+        except ValidationError as e:
+            report.add_error(row_number, _error_message(e))
+            continue
+
+        # Same derived fields as create_patient (created_at in IST, millisecond precision)
+        ist_time = datetime.utcnow() + timedelta(hours=5, minutes=30)
+        document["created_at"] = ist_time.replace(microsecond=ist_time.microsecond // 1000 * 1000)
+        document.update(derived_fields(document))
+        document["version"] = 1
+        batch.append((row_number, document))
+
+        if len(batch) >= BULK_BATCH_SIZE:
+            await _flush(db, batch, report)
+            batch = []
+
+    await _flush(db, batch, report)
+    if report.inserted:
+        count_cache.clear()
+    logger.info("Bulk import finished: %d inserted, %d failed", report.inserted, report.failed)
+    return report.as_dict()
+
+def _export_row(document):
+    document["id"] = str(document.pop("_id"))
+    if isinstance(document.get("created_at"), datetime):
+        document["created_at"] = document["created_at"].isoformat()
+    return document
+
+async def _export_raw_ndjson(db, query):
+    # RAW_BSON_READS path (see bson_json.py): each batch is decoded in one call and encoded by orjson
+    cursor = raw_collection(db.patients).find(query, SEARCH_PROJECTION).sort(PATIENT_SORT).batch_size(BULK_BATCH_SIZE)
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= BULK_BATCH_SIZE:
+            yield b"".join(dumps(row) + b"\n" for row in response_documents(batch))
+            batch = []
+    if batch:
+        yield b"".join(dumps(row) + b"\n" for row in response_documents(batch))
+
+async def export_patients(db, query, fmt):
+    # Async generator of encoded chunks, one per cursor batch
+    if fmt == "ndjson" and RAW_BSON_READS:
+        async for chunk in _export_raw_ndjson(db, query):
+            yield chunk
+        return
+
+    cursor = db.patients.find(query, SEARCH_PROJECTION).sort(PATIENT_SORT).batch_size(BULK_BATCH_SIZE)
+    buffer = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+
+    rows = 0
+    async for document in cursor:
+        row = _export_row(document)
+        if writer:
+            for column in CSV_JSON_COLUMNS:
+                row[column] = json.dumps(row.get(column) or [])
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, default=str))
+            buffer.write("\n")
+        rows += 1
+        if rows % BULK_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
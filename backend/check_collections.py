@@ -3,10 +3,10 @@ import asyncio
 import os
 from dotenv import load_dotenv
 import logging
-from bson import ObjectId
+from logging_config import setup_logging
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -59,35 +59,5 @@ async def check_database():
             client.close()
             logger.info("Database connection closed.")
 
-async def check_and_fix_patients():
-    try:
-        # Connect to MongoDB
-        client = AsyncIOMotorClient(MONGODB_URL)
-        db = client[DATABASE_NAME]
-        
-        # Find all patients with null id
-        patients_with_null_id = await db.patients.find({"id": None}).to_list(length=None)
-        logger.info(f"Found {len(patients_with_null_id)} patients with null id")
-        
-        # Fix each patient document
-        for patient in patients_with_null_id:
-            # Generate a new ObjectId and convert to string
-            new_id = str(ObjectId())
-            # Update the document
-            await db.patients.update_one(
-                {"_id": patient["_id"]},
-                {"$set": {"id": new_id}}
-            )
-            logger.info(f"Updated patient {patient['_id']} with new id: {new_id}")
-        
-        # Close the connection
-        client.close()
-        logger.info("Successfully checked and fixed patients collection")
-        
-    except Exception as e:
-        logger.error(f"Error checking/fixing patients collection: {e}")
-        raise e
-
 if __name__ == "__main__":
     asyncio.run(check_database())
-    asyncio.run(check_and_fix_patients()) 
\ No newline at end of file
@@ -0,0 +1,142 @@
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+# Response compression (brotli when the client accepts it and the package is
+# installed, otherwise gzip). Bodies under COMPRESSION_MIN_SIZE bytes are sent
+# as is: compressing them costs more CPU than the bytes saved. Streamed bodies
+# (exports) are compressed chunk by chunk; event streams are left alone so every
+# event is delivered immediately.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+EXCLUDED_MEDIA_TYPES = (b"text/event-stream",)
+NO_BODY_STATUSES = (204, 304)
+
+
+def accepted_encodings(header):
+    # {encoding: q} from an Accept-Encoding header
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    return accepted
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    if brotli is not None and accepted.get("br", wildcard) > 0:
+        return "br"
+    if accepted.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._gzip = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, final):
+        if self.encoding == "br":
+            out = self._brotli.process(data)
+            return out + (self._brotli.finish() if final else self._brotli.flush())
+        out = self._gzip.compress(data)
+        return out + self._gzip.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    # Plain ASGI middleware. The response start is held back until the first body
+    # chunk shows whether compressing is worth it.
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value for name, value in scope.get("headers", ()) if name == b"accept-encoding"), b"")
+        encoding = choose_encoding(accept.decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+            if passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = start.get("headers", [])
+                content_type = next((v for k, v in headers if k == b"content-type"), b"")
+                if (
+                    start["status"] in NO_BODY_STATUSES
+                    or any(k == b"content-encoding" for k, _ in headers)
+                    or content_type.split(b";")[0].strip() in EXCLUDED_MEDIA_TYPES
+                    or (not more_body and len(body) < self.minimum_size)
+                ):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                body = compressor.compress(body, final=not more_body)
+                await send({**start, "headers": _compressed_headers(headers, encoding, None if more_body else len(body))})
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            await send({
+                "type": "http.response.body",
+                "body": compressor.compress(body, final=not more_body),
+                "more_body": more_body
+            })
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _compressed_headers(headers, encoding, length):
+    result = []
+    for name, value in headers:
+        if name == b"content-length":
+            continue
+        if name == b"etag" and not value.startswith(b"W/"):
+            # The compressed bytes differ from the identity ones, so the tag can only be weak
+            value = b"W/" + value
+        if name == b"vary":
+            continue
+        result.append((name, value))
+    vary = [value for name, value in headers if name == b"vary"]
+    result.append((b"vary", b", ".join(vary + [b"Accept-Encoding"])))
+    result.append((b"content-encoding", encoding.encode()))
+    if length is not None:
+        result.append((b"content-length", str(length).encode()))
+    return result
@@ -1,15 +1,15 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, OperationFailure
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 import os
 from dotenv import load_dotenv
 import logging
 import asyncio
+from migrations import check_schema
+from metrics import event_listeners, pool_max_size
+from logging_config import setup_logging
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -18,42 +18,51 @@ load_dotenv()
 MONGODB_URL = os.getenv("MONGODB_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
+# Pool limits of a single-process deployment
+MAX_POOL_SIZE = 50
+MIN_POOL_SIZE = 10
+# Connections all workers of one instance may hold together (per MongoDB server).
+# Each worker gets an equal share; WEB_CONCURRENCY is the worker count (set by
+# gunicorn.conf.py). Every client also keeps a few monitoring connections outside the pool.
+MONGO_CONNECTION_BUDGET = int(os.getenv("MONGO_CONNECTION_BUDGET", str(MAX_POOL_SIZE)))
+
+# Indexes and backfills are applied by `python migrations.py up`; startup only
+# checks the schema version unless MIGRATE_ON_STARTUP is set (single-instance setups)
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "false").lower() == "true"
+
+# Wire compression between the app and MongoDB, in order of preference, e.g.
+# "zstd,snappy,zlib"; the server picks the first one it also supports. zstd needs
+# the zstandard package and snappy python-snappy; the driver skips unavailable ones
+# with a warning. Empty (the default) sends uncompressed messages.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "")
+# -1 is zlib's default level; 1 is fastest, 9 smallest
+MONGO_ZLIB_LEVEL = int(os.getenv("MONGO_ZLIB_LEVEL", "-1"))
+
 client = None
 db = None
+min_pool_size = MIN_POOL_SIZE
 
-async def create_indexes():
-    try:
-        # Create indexes with background=True to avoid blocking operations
-        await db.users.create_index("email", unique=True, name="unique_email", background=True)
-        logger.info("Created email index")
-        
-        await db.users.create_index("username", unique=True, name="unique_username", background=True)
-        logger.info("Created username index")
-        
-        # First ensure no null IDs exist
-        null_id_count = await db.patients.count_documents({"id": None})
-        if null_id_count > 0:
-            logger.warning(f"Found {null_id_count} patients with null IDs. Please run check_collections.py to fix this issue.")
-            return
-            
-        # Create patient ID index only if no null IDs exist
-        await db.patients.create_index("id", unique=True, name="unique_patient_id", background=True)
-        logger.info("Created patient ID index")
-        
-    except OperationFailure as e:
-        if "already exists" in str(e):
-            logger.info("Indexes already exist, continuing...")
-        else:
-            logger.error(f"Error creating indexes: {e}")
-            raise e
-    except Exception as e:
-        logger.error(f"Unexpected error creating indexes: {e}")
-        raise e
+def pool_limits(workers=None):
+    # (maxPoolSize, minPoolSize) for one worker; the minimum keeps MIN:MAX's ratio
+    workers = max(1, workers or int(os.getenv("WEB_CONCURRENCY", "1")))
+    max_size = max(1, MONGO_CONNECTION_BUDGET // workers)
+    min_size = min(max_size, max(1, MIN_POOL_SIZE * max_size // MAX_POOL_SIZE))
+    return max_size, min_size
+
+def compression_options():
+    compressors = [name.strip() for name in MONGO_COMPRESSORS.split(",") if name.strip()]
+    if not compressors:
+        return {}
+    options = {"compressors": compressors}
+    if "zlib" in compressors:
+        options["zlibCompressionLevel"] = MONGO_ZLIB_LEVEL
+    return options
 
 async def init_db():
-    global client, db
+    global client, db, min_pool_size
     max_retries = 3
     retry_delay = 2  # seconds
+    max_size, min_pool_size = pool_limits()
     
     for attempt in range(max_retries):
         try:
@@ -65,18 +74,24 @@ async def init_db():
                 serverSelectionTimeoutMS=5000,  # 5 seconds timeout
                 connectTimeoutMS=5000,
                 socketTimeoutMS=5000,
-                maxPoolSize=50,
-                minPoolSize=10
+                maxPoolSize=max_size,
+                minPoolSize=min_pool_size,
+                # Command and pool metrics (see metrics.py)
+                event_listeners=event_listeners(),
+                **compression_options()
             )
+            pool_max_size.set(max_size)
             
             db = client[DATABASE_NAME]
             
             # Verify the connection
             await client.admin.command('ping')
-            logger.info(f"Successfully connected to MongoDB Atlas! Using database: {DATABASE_NAME}")
+            logger.info(
+                f"Successfully connected to MongoDB Atlas! Using database: {DATABASE_NAME} "
+                f"(pool {min_pool_size}-{max_size}, compression {MONGO_COMPRESSORS or 'off'})"
+            )
             
-            # Create indexes
-            await create_indexes()
+            await check_schema(db, apply_pending=MIGRATE_ON_STARTUP)
             logger.info("Database initialization completed successfully")
             
             return  # Successfully connected
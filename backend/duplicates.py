@@ -0,0 +1,326 @@
+from datetime import datetime, timedelta
+from difflib import SequenceMatcher
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from search import normalize, tokenize, phone_digits, MIN_PHONE_PREFIX, NATIONAL_NUMBER_LENGTH
+from logging_config import setup_logging
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Duplicate-patient detection. Every patient carries blocking keys, maintained
+# on every write alongside the search fields (see patient_repository.derived_fields):
+#   dedup_keys    - behind the patient_dedup_keys index: "p:" national phone
+#                   number, "e:" lowercased email, "n:" phonetic name key + "|" + DOB
+#   dedup_name, dedup_dob - the two halves of the "n:" key, so a partial update
+#                   of only one of them can rebuild it
+# Only patients sharing at least one key are candidates, and each candidate is
+# scored on name similarity, phone, email and date of birth (or age).
+POSSIBLE_DUPLICATE_SCORE = float(os.getenv("POSSIBLE_DUPLICATE_SCORE", "0.6"))
+# Keys shared by more patients than this (e.g. a clinic's placeholder phone
+# number) say nothing about identity and grow quadratically. A duplicate check
+# reads at most one more than this per key; the batch scan finds them up front
+# and never reads their blocks.
+MAX_BLOCK_SIZE = 100
+SCAN_CHUNKS = int(os.getenv("DUPLICATE_SCAN_CHUNKS", "4"))
+SCAN_BATCH_SIZE = 500
+
+WEIGHTS = {"name": 0.4, "phone": 0.25, "email": 0.2, "dob": 0.15}
+NAME_MATCH = 0.85
+CANDIDATE_PROJECTION = {"name": 1, "phone": 1, "email": 1, "dob": 1, "age": 1, "dedup_keys": 1}
+
+_SOUNDEX_CODES = {
+    letter: digit
+    for digit, letters in (("1", "bfpv"), ("2", "cgjkqsxz"), ("3", "dt"), ("4", "l"), ("5", "mn"), ("6", "r"))
+    for letter in letters
+}
+DOB_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y")
+
+def soundex(token):
+    letters = [ch for ch in token if "a" <= ch <= "z"]
+    if not letters:
+        return ""
+    code, last = letters[0].upper(), _SOUNDEX_CODES.get(letters[0], "")
+    for ch in letters[1:]:
+        digit = _SOUNDEX_CODES.get(ch, "")
+        if digit and digit != last:
+            code += digit
+        if ch not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+def phonetic_name(name):
+    # Order-insensitive, so "Kumar Ravi" and "Ravee Kumaar" share a key with "Ravi Kumar"
+    return " ".join(sorted(filter(None, (soundex(token) for token in tokenize(name)))))
+
+def normalize_dob(dob):
+    if not isinstance(dob, str):
+        return ""
+    for fmt in DOB_FORMATS:
+        try:
+            return datetime.strptime(dob.strip()[:10], fmt).date().isoformat()
+        except ValueError:
+            pass
+    return ""
+
+def national_number(phone):
+    digits = phone_digits(phone)
+    return digits[-NATIONAL_NUMBER_LENGTH:] if len(digits) >= MIN_PHONE_PREFIX else ""
+
+def normalize_email(email):
+    return email.strip().lower() if isinstance(email, str) else ""
+
+def dedup_fields(patient):
+    name, dob = phonetic_name(patient.get("name")), normalize_dob(patient.get("dob"))
+    keys = set()
+    if national_number(patient.get("phone")):
+        keys.add(f"p:{national_number(patient.get('phone'))}")
+    if normalize_email(patient.get("email")):
+        keys.add(f"e:{normalize_email(patient.get('email'))}")
+    if name and dob:
+        keys.add(f"n:{name}|{dob}")
+    return {"dedup_name": name, "dedup_dob": dob, "dedup_keys": sorted(keys)}
+
+def dedup_fields_update(fields):
+    # Update pipeline expressions for dedup_* when only some sources change (see search_fields_update)
+    stale = [namespace for field, namespace in (("phone", "p:"), ("email", "e:"), ("name", "n:"), ("dob", "n:"))
+             if field in fields]
+    if not stale:
+        return {}
+    changed = dedup_fields({field: fields.get(field) for field in ("phone", "email", "name", "dob")})
+    keys = [key for key in changed["dedup_keys"] if key[:2] in stale and not key.startswith("n:")]
+    update = {}
+    name_key = []
+    if "n:" in stale:
+        name = {"$literal": changed["dedup_name"]} if "name" in fields else {"$ifNull": ["$dedup_name", ""]}
+        dob = {"$literal": changed["dedup_dob"]} if "dob" in fields else {"$ifNull": ["$dedup_dob", ""]}
+        name_key = [{"$cond": [
+            {"$and": [{"$ne": [name, ""]}, {"$ne": [dob, ""]}]},
+            [{"$concat": ["n:", name, "|", dob]}],
+            []
+        ]}]
+        if "name" in fields:
+            update["dedup_name"] = name
+        if "dob" in fields:
+            update["dedup_dob"] = dob
+    update["dedup_keys"] = {"$concatArrays": [
+        {"$filter": {
+            "input": {"$ifNull": ["$dedup_keys", []]},
+            "cond": {"$not": [{"$in": [{"$substrCP": ["$$this", 0, 2]}, stale]}]}
+        }},
+        {"$literal": keys}
+    ] + name_key}
+    return update
+
+
+def score_pair(patient, other):
+    # (score in [0, 1], matching fields)
+    name = SequenceMatcher(None, normalize(patient.get("name")), normalize(other.get("name"))).ratio()
+    phone = bool(national_number(patient.get("phone"))) and \
+        national_number(patient.get("phone")) == national_number(other.get("phone"))
+    email = bool(normalize_email(patient.get("email"))) and \
+        normalize_email(patient.get("email")) == normalize_email(other.get("email"))
+    dob, other_dob = normalize_dob(patient.get("dob")), normalize_dob(other.get("dob"))
+    if dob and other_dob:
+        birth = 1.0 if dob == other_dob else 0.0
+    else:
+        # Without both dates, a matching age is weaker evidence
+        ages = (patient.get("age"), other.get("age"))
+        birth = 0.5 if all(isinstance(age, int) for age in ages) and abs(ages[0] - ages[1]) <= 1 else 0.0
+
+    score = WEIGHTS["name"] * name + WEIGHTS["phone"] * phone + WEIGHTS["email"] * email + WEIGHTS["dob"] * birth
+    reasons = [field for field, matched in (
+        ("name", name >= NAME_MATCH), ("phone", phone), ("email", email), ("dob", birth == 1.0)
+    ) if matched]
+    return round(score, 3), reasons
+
+def patient_entry(patient):
+    return {
+        "id": str(patient["_id"]),
+        "name": patient.get("name"),
+        "phone": patient.get("phone"),
+        "email": patient.get("email"),
+        "dob": patient.get("dob")
+    }
+
+def duplicate_entry(other, score, reasons):
+    return {**patient_entry(other), "score": score, "reasons": reasons}
+
+async def _block(db, key, exclude_id):
+    # Patients sharing one key, or [] when the key is shared by too many to mean anything
+    query = {"dedup_keys": key}
+    if exclude_id is not None:
+        query["_id"] = {"$ne": exclude_id}
+    block = await db.patients.find(query, CANDIDATE_PROJECTION).limit(MAX_BLOCK_SIZE + 1).to_list(length=MAX_BLOCK_SIZE + 1)
+    return block if len(block) <= MAX_BLOCK_SIZE else []
+
+async def find_possible_duplicates(db, patient, min_score=POSSIBLE_DUPLICATE_SCORE, exclude_id=None):
+    # Existing patients that look like the given (new or edited) one, best first.
+    # Each key (at most three) is looked up on its own, concurrently, so an
+    # oversized block such as a placeholder phone cannot crowd out the others.
+    keys = patient.get("dedup_keys") or dedup_fields(patient)["dedup_keys"]
+    if not keys:
+        return []
+    candidates = {}
+    for block in await asyncio.gather(*(_block(db, key, exclude_id) for key in keys)):
+        for other in block:
+            candidates[other["_id"]] = other
+    matches = []
+    for other in candidates.values():
+        score, reasons = score_pair(patient, other)
+        if score >= min_score:
+            matches.append(duplicate_entry(other, score, reasons))
+    matches.sort(key=lambda match: -match["score"])
+    return matches
+
+
+async def _id_ranges(db, chunks):
+    # Splits the patients' ObjectId range into chunks of equal time span
+    first = await db.patients.find({}, {"_id": 1}).sort("_id", 1).limit(1).to_list(length=1)
+    last = await db.patients.find({}, {"_id": 1}).sort("_id", -1).limit(1).to_list(length=1)
+    if not first:
+        return []
+    low, high = first[0]["_id"], last[0]["_id"]
+    if chunks <= 1 or not isinstance(low, ObjectId) or not isinstance(high, ObjectId):
+        return [(None, None)]
+    start, end = low.generation_time, high.generation_time + timedelta(seconds=1)
+    step = (end - start) / chunks
+    bounds = [ObjectId.from_datetime(start + step * i) for i in range(1, chunks)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+async def oversized_keys(db):
+    # Keys shared by more than MAX_BLOCK_SIZE patients, found once per scan so no
+    # batch reads those blocks
+    pipeline = [
+        {"$match": {"dedup_keys.0": {"$exists": True}}},
+        {"$project": {"_id": 0, "dedup_keys": 1}},
+        {"$unwind": "$dedup_keys"},
+        {"$group": {"_id": "$dedup_keys", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": MAX_BLOCK_SIZE}}}
+    ]
+    return {document["_id"] async for document in db.patients.aggregate(pipeline, allowDiskUse=True)}
+
+async def _scan_range(db, low, high, min_score, pairs, oversized):
+    query = {"dedup_keys.0": {"$exists": True}}
+    id_range = {}
+    if low is not None:
+        id_range["$gte"] = low
+    if high is not None:
+        id_range["$lt"] = high
+    if id_range:
+        query["_id"] = id_range
+
+    scanned = 0
+    batch = []
+    cursor = db.patients.find(query, CANDIDATE_PROJECTION, batch_size=SCAN_BATCH_SIZE)
+    async for patient in cursor:
+        batch.append(patient)
+        if len(batch) >= SCAN_BATCH_SIZE:
+            await _scan_batch(db, batch, min_score, pairs, oversized)
+            scanned += len(batch)
+            batch = []
+    if batch:
+        await _scan_batch(db, batch, min_score, pairs, oversized)
+        scanned += len(batch)
+    return scanned
+
+async def _scan_batch(db, batch, min_score, pairs, oversized):
+    # One indexed query fetches every candidate of the whole batch
+    keys = {key for patient in batch for key in patient["dedup_keys"]} - oversized
+    if not keys:
+        return
+    blocks = {}
+    async for other in db.patients.find({"dedup_keys": {"$in": sorted(keys)}}, CANDIDATE_PROJECTION):
+        for key in other.get("dedup_keys", ()):
+            if key in keys:
+                blocks.setdefault(key, []).append(other)
+    for patient in batch:
+        seen = set()
+        for key in patient["dedup_keys"]:
+            block = blocks.get(key, ())
+            # Also catches a block that outgrew the limit after oversized_keys ran
+            if len(block) > MAX_BLOCK_SIZE:
+                continue
+            for other in block:
+                # Each pair is scored once, by its lower _id, whichever chunk that is in
+                if other["_id"] <= patient["_id"] or other["_id"] in seen:
+                    continue
+                seen.add(other["_id"])
+                score, reasons = score_pair(patient, other)
+                if score >= min_score:
+                    pairs.append((patient, other, score, reasons))
+
+def _clusters(pairs):
+    # Union-find over matching pairs
+    parent = {}
+
+    def root(node):
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    patients = {}
+    for patient, other, _, _ in pairs:
+        patients[patient["_id"]], patients[other["_id"]] = patient, other
+        parent[root(patient["_id"])] = root(other["_id"])
+    members = {}
+    for patient_id in patients:
+        members.setdefault(root(patient_id), []).append(patient_id)
+    groups = {}
+    for patient, other, score, reasons in pairs:
+        groups.setdefault(root(patient["_id"]), []).append({
+            "ids": [str(patient["_id"]), str(other["_id"])], "score": score, "reasons": reasons
+        })
+    clusters = [{
+        "patients": [patient_entry(patients[patient_id]) for patient_id in sorted(ids)],
+        "pairs": sorted(groups[key], key=lambda pair: -pair["score"])
+    } for key, ids in members.items()]
+    clusters.sort(key=lambda cluster: -cluster["pairs"][0]["score"])
+    return clusters
+
+async def find_duplicate_clusters(db, chunks=SCAN_CHUNKS, min_score=POSSIBLE_DUPLICATE_SCORE):
+    # Batch scan of the whole collection; chunks of the _id range run concurrently
+    started = datetime.utcnow()
+    pairs = []
+    ranges = await _id_ranges(db, chunks)
+    oversized = await oversized_keys(db)
+    scanned = await asyncio.gather(*(
+        _scan_range(db, low, high, min_score, pairs, oversized) for low, high in ranges
+    ))
+    clusters = _clusters(pairs)
+    logger.info(
+        f"Duplicate scan: {sum(scanned)} patients in {len(ranges)} chunk(s), {len(clusters)} cluster(s) "
+        f"in {(datetime.utcnow() - started).total_seconds():.1f}s"
+    )
+    return {"scanned": sum(scanned), "clusters": clusters}
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python duplicates.py", description="Duplicate patient detection")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser("scan", help="find clusters of likely duplicate patients")
+    scan.add_argument("--chunks", type=int, default=SCAN_CHUNKS, help="parts of the collection scanned concurrently")
+    scan.add_argument("--min-score", type=float, default=POSSIBLE_DUPLICATE_SCORE)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URL"))
+    try:
+        db = client[os.getenv("DATABASE_NAME")]
+        result = await find_duplicate_clusters(db, args.chunks, args.min_score)
+        print(json.dumps(result, indent=2, default=str))
+        return 0
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    setup_logging()
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,89 @@
+from fastapi.responses import Response
+from events import event_bus
+import hashlib
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Conditional GET for patient reads. A patient's ETag is its _id plus the version
+# every write path increments, so a matching If-None-Match is answered with 304
+# before anything is serialized. A list's ETag is derived from the query string
+# and an in-process version of the patients collection (list_version), and is
+# checked before the page or count is queried. The version can only be trusted
+# when this process sees every patient write: a change stream feeds the event
+# bus, or this is the only worker. Otherwise the list ETag is a hash of the
+# response body, which still saves sending an unchanged page.
+# The patients collection's change counter (in MongoDB so all workers agree) is
+# bumped after writes and tells the typeahead index when to rebuild.
+CHANGE_COUNTERS = "change_counters"
+# Bump when the JSON shape of patient responses changes, so old ETags stop matching
+REPRESENTATION_VERSION = 1
+# Patient data must not sit in shared caches; browsers keep it but revalidate every time
+CACHE_CONTROL = "private, no-cache"
+
+
+async def bump_change_counter(db, collection="patients"):
+    # Must run after the write it accounts for: a reader that sees the old count
+    # then gets data at least as new as that count, never older
+    try:
+        await db[CHANGE_COUNTERS].update_one({"_id": collection}, {"$inc": {"count": 1}}, upsert=True)
+    except Exception as e:
+        logger.error(f"Failed to bump the {collection} change counter: {e}")
+
+async def change_counter(db, collection="patients"):
+    document = await db[CHANGE_COUNTERS].find_one({"_id": collection})
+    return document["count"] if document else 0
+
+class ListVersion:
+    # Incremented by the write handlers before they respond and by every change
+    # the event bus publishes. The epoch keeps a restarted process, or another
+    # worker, from producing an ETag that an older page could match.
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.count = 0
+
+    def bump(self, changes=None):
+        self.count += 1
+
+    def current(self):
+        # None when writes may happen that this process never hears about
+        if event_bus.source == "changestream" or int(os.getenv("WEB_CONCURRENCY", "1")) == 1:
+            return f"{self.epoch}.{self.count}"
+        return None
+
+
+list_version = ListVersion()
+event_bus.add_listener(list_version.bump)
+
+def patient_etag(patient):
+    return f'"p{REPRESENTATION_VERSION}-{patient["_id"]}-{patient.get("version", 0)}"'
+
+def list_etag(version, query_params):
+    query = "&".join(f"{key}={value}" for key, value in sorted(query_params.multi_items()))
+    digest = hashlib.sha1(f"{version}|{query}".encode()).hexdigest()[:24]
+    return f'"l{REPRESENTATION_VERSION}-{digest}"'
+
+def body_etag(body):
+    # Fallback list ETag when list_version is not trusted
+    digest = hashlib.sha1(body).hexdigest()[:24]
+    return f'"b{REPRESENTATION_VERSION}-{digest}"'
+
+def _opaque(tag):
+    # If-None-Match uses weak comparison: W/"x" matches "x" (compression weakens ETags)
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(_opaque(tag) == _opaque(etag) for tag in if_none_match.split(","))
+
+def cache_headers(etag):
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+def not_modified(etag):
+    return Response(status_code=304, headers=cache_headers(etag))
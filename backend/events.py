@@ -0,0 +1,291 @@
+from collections import Counter
+from pymongo.errors import OperationFailure, PyMongoError
+from analytics import contribution_delta
+from metrics import registry
+from serialization import dumps
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# In-process event bus behind GET /api/patients/events (Server-Sent Events).
+# Patient writes publish deltas: patient.created (the new patient's summary),
+# patient.updated (changed summary fields), patient.deleted and counters (rollup
+# deltas keyed like the rollup ids, e.g. {"total:": 1, "gender:male": 1}).
+#
+# Every subscriber has its own pending buffer. Events for the same patient are
+# merged there and counter deltas are summed, so a burst of writes reaches a
+# client as one small batch. A client that falls more than EVENTS_MAX_PENDING
+# patients behind gets a single "resync" event instead of the backlog, so a slow
+# reader costs bounded memory and never slows the writers.
+#
+# Writes are only seen by the worker that handled them. EVENTS_SOURCE=changestream
+# feeds every worker from a change stream on patients instead (replica sets only;
+# exact counter deltas need changeStreamPreAndPostImages enabled on the collection).
+EVENTS_SOURCE = os.getenv("EVENTS_SOURCE", "handlers")
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "1000"))
+EVENTS_MAX_PENDING = int(os.getenv("EVENTS_MAX_PENDING", "100"))
+# Events arriving within this window of the first one are sent together
+EVENTS_COALESCE_MS = int(os.getenv("EVENTS_COALESCE_MS", "250"))
+EVENTS_HEARTBEAT_SECONDS = 15
+CHANGE_STREAM_RETRY_SECONDS = 5
+
+# Fields sent for a new patient and checked for changes on updates (PatientSummary)
+SUMMARY_FIELDS = ("name", "age", "gender", "phone", "chronicConditions", "created_at")
+
+# Error codes for "not a replica set" and "resume token no longer in the oplog"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+CHANGE_STREAM_HISTORY_LOST = 286
+
+event_subscribers = registry.gauge("sse_subscribers", "Open /api/patients/events streams")
+event_resyncs = registry.counter("sse_resyncs_total", "Subscribers sent a resync instead of their backlog")
+
+
+def _summary(patient):
+    summary = {"id": str(patient["_id"])}
+    for field in SUMMARY_FIELDS:
+        if field in patient:
+            summary[field] = patient[field]
+    return summary
+
+def patient_event(old, new):
+    # (type, payload) for one patient write; old/new may be partial documents
+    if old is None:
+        return "patient.created", _summary(new)
+    if new is None:
+        return "patient.deleted", {"id": str(old["_id"])}
+    changed = {field: new[field] for field in SUMMARY_FIELDS if field in new and new[field] != old.get(field)}
+    payload = {"id": str(new["_id"]), "changed": changed}
+    if "version" in new:
+        payload["version"] = new["version"]
+    return "patient.updated", payload
+
+def _merge(previous, event):
+    # Folds a later event for the same patient into the one still pending
+    if previous is None:
+        return event
+    (previous_type, previous_payload), (event_type, payload) = previous, event
+    if event_type == "patient.deleted":
+        # A patient created and deleted before the client saw it never existed for that client
+        return None if previous_type == "patient.created" else event
+    if event_type == "patient.updated":
+        if previous_type == "patient.created":
+            return previous_type, {**previous_payload, **payload["changed"]}
+        if previous_type == "patient.updated":
+            return event_type, {**payload, "changed": {**previous_payload["changed"], **payload["changed"]}}
+    return event
+
+
+class Subscription:
+    def __init__(self, max_pending=EVENTS_MAX_PENDING):
+        self.max_pending = max_pending
+        self.pending = {}
+        self.counters = Counter()
+        self.counters_stale = False
+        self.resync = False
+        self.closed = False
+        self._wakeup = asyncio.Event()
+
+    def push(self, event=None, counters=None, counters_stale=False):
+        if self.resync:
+            # Everything pending is about to be replaced by a resync anyway
+            return
+        if event is not None:
+            key = event[1]["id"]
+            merged = _merge(self.pending.pop(key, None), event)
+            if merged is not None:
+                self.pending[key] = merged
+        if counters:
+            self.counters.update(counters)
+        self.counters_stale = self.counters_stale or counters_stale
+        if len(self.pending) > self.max_pending:
+            self.request_resync()
+        self._wakeup.set()
+
+    def request_resync(self):
+        self.pending.clear()
+        self.counters.clear()
+        self.resync = True
+        event_resyncs.inc()
+        self._wakeup.set()
+
+    def close(self):
+        # Ends the stream at its next batch (server shutdown)
+        self.closed = True
+        self._wakeup.set()
+
+    async def next_batch(self, timeout=EVENTS_HEARTBEAT_SECONDS, coalesce=EVENTS_COALESCE_MS / 1000):
+        # Waits for events, then lets more arrive for the coalescing window.
+        # Returns a list of (type, payload), or None on timeout (send a heartbeat).
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if coalesce:
+            await asyncio.sleep(coalesce)
+        self._wakeup.clear()
+
+        if self.closed:
+            return []
+        if self.resync:
+            self.resync = False
+            return [("resync", {})]
+        events = list(self.pending.values())
+        counters = {f"{dim}:{key}": amount for (dim, key), amount in self.counters.items() if amount}
+        if counters:
+            events.append(("counters", {"delta": counters}))
+        elif self.counters_stale:
+            events.append(("counters", {"stale": True}))
+        self.pending = {}
+        self.counters = Counter()
+        self.counters_stale = False
+        return events
+
+
+class EventBus:
+    def __init__(self, source=EVENTS_SOURCE, max_subscribers=EVENTS_MAX_SUBSCRIBERS):
+        self.requested_source = source
+        # Handlers publish until a change stream has actually been opened
+        self.source = "handlers"
+        self.max_subscribers = max_subscribers
+        self.sequence = 0
+        self.draining = False
+        self._listeners = []
+        self._subscriptions = set()
+        self._task = None
+
+    @property
+    def subscribers(self):
+        return len(self._subscriptions)
+
+    def subscribe(self):
+        if self.draining or len(self._subscriptions) >= self.max_subscribers:
+            return None
+        subscription = Subscription()
+        self._subscriptions.add(subscription)
+        event_subscribers.set(len(self._subscriptions))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+        event_subscribers.set(len(self._subscriptions))
+
+    def add_listener(self, listener):
+        # In-process consumers (e.g. the suggest index) get every published batch of changes
+        self._listeners.append(listener)
+
+    def publish(self, changes, counters_known=True):
+        # changes are (old, new) patient versions, as passed to the rollups
+        for listener in self._listeners:
+            try:
+                listener(changes)
+            except Exception as e:
+                logger.error(f"Patient change listener failed: {e}")
+        if not self._subscriptions:
+            return
+        self.sequence += 1
+        counters = contribution_delta(changes) if counters_known else None
+        for index, (old, new) in enumerate(changes):
+            event = patient_event(old, new)
+            last = index == len(changes) - 1
+            for subscription in self._subscriptions:
+                subscription.push(
+                    event,
+                    counters if last else None,
+                    counters_stale=last and not counters_known
+                )
+
+    def publish_patient_change(self, old=None, new=None):
+        # Called by the write handlers; a running change stream reports the same writes
+        if self.source == "handlers":
+            self.publish([(old, new)])
+
+    def publish_patient_changes(self, changes):
+        if self.source == "handlers" and changes:
+            self.publish(changes)
+
+    def resync_all(self):
+        for subscription in self._subscriptions:
+            subscription.request_resync()
+
+    def drain(self):
+        # Streams never finish on their own, so a graceful shutdown would wait on them
+        # until it timed out. Clients reconnect (to another worker) with Last-Event-ID.
+        self.draining = True
+        for subscription in self._subscriptions:
+            subscription.close()
+
+    def start(self, db):
+        if self.requested_source == "changestream" and self._task is None:
+            self._task = asyncio.create_task(self._watch(db))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.source = "handlers"
+
+    async def _watch(self, db):
+        resume_token = None
+        while True:
+            try:
+                async with db.patients.watch(
+                    full_document="updateLookup",
+                    full_document_before_change="whenAvailable",
+                    resume_after=resume_token
+                ) as stream:
+                    if self.source != "changestream":
+                        logger.info("Patient events are fed by a change stream")
+                    self.source = "changestream"
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._publish_change(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams need a replica set; patient events stay in-process")
+                    self.source = "handlers"
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    # Events were missed for good: start over and have every client refetch
+                    resume_token = None
+                    self.resync_all()
+                logger.error(f"Patient change stream failed: {e}")
+            except PyMongoError as e:
+                logger.error(f"Patient change stream failed: {e}")
+            await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def _publish_change(self, change):
+        operation = change.get("operationType")
+        key = change.get("documentKey", {})
+        before = change.get("fullDocumentBeforeChange")
+        after = change.get("fullDocument")
+        if operation == "insert":
+            self.publish([(None, after)])
+        elif operation == "delete":
+            # Counter deltas need the pre-image
+            self.publish([(before or key, None)], counters_known=before is not None)
+        elif operation in ("update", "replace"):
+            if after is None:
+                # Deleted again before the post-image was looked up; its delete event follows
+                return
+            old = before
+            if old is None:
+                updated = (change.get("updateDescription") or {}).get("updatedFields", {})
+                old = {**after, **{field: None for field in updated}} if operation == "update" else {"_id": after["_id"]}
+            self.publish([(old, after)], counters_known=before is not None)
+        elif operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            self.resync_all()
+
+
+def format_event(sequence, event_type, payload):
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (sequence, event_type.encode(), dumps(payload))
+
+
+event_bus = EventBus()
@@ -0,0 +1,30 @@
+import os
+
+# Production server: `gunicorn main:app` from backend/ picks this file up.
+# Every worker opens its own MongoDB pool, sized from MONGO_CONNECTION_BUDGET
+# (see database.pool_limits), warms it and its caches during startup, and only
+# then accepts connections. /ready turns 503 as soon as a worker starts draining.
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+worker_class = "worker.AppWorker"
+
+# Seconds a worker gets to finish in-flight requests after SIGTERM
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Not preloaded: the MongoDB client and its threads must be created after the fork
+preload_app = False
+
+accesslog = "-"
+
+# Proxies whose X-Forwarded-For uvicorn believes, so the request's client address
+# (rate limiting, access log) is the user's rather than the proxy's. Behind a
+# platform load balancer that is the only way in (e.g. Render), set it to "*".
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+def on_starting(server):
+    # Workers read the final worker count (after -w/--workers) to size their pools
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
@@ -0,0 +1,198 @@
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from request_context import current_request_id
+from metrics import registry
+from serialization import dumps
+import atexit
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# Central logging setup, shared by the app and the command-line tools
+# (setup_logging). Log calls only put the record on a bounded in-memory queue;
+# a QueueListener thread formats it and writes it to stderr, so neither the
+# I/O nor %-style message formatting runs on the event loop. Pass values, not
+# objects that change later, as log arguments: they are formatted afterwards.
+# Every record carries the id of the request that logged it (X-Request-ID).
+# Below WARNING, records can be sampled and are rate limited per logger:
+#   LOG_SAMPLE_RATES="uvicorn.access=0.1,routers=0.5"   fraction kept, by logger prefix
+#   LOG_RATE_LIMIT_PER_SECOND=50                        per logger, bursts of twice that; 0 turns it off
+# Warnings and errors are always kept. Records that are dropped, including those
+# that find the queue full, are counted in log_records_dropped_total.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_RATE_LIMIT_PER_SECOND = float(os.getenv("LOG_RATE_LIMIT_PER_SECOND", "50"))
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(request_id)s - %(message)s"
+# Loggers that bring their own handlers; their records go through the queue instead
+ROUTED_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+log_records_dropped = registry.counter(
+    "log_records_dropped_total", "Log records not written, by logger and reason", ("logger", "reason")
+)
+
+# Attributes every LogRecord has; anything else was passed with extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+def parse_sample_rates(value):
+    # "name=rate,name=rate" -> {name: rate}
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    # Runs on the logging thread before the record is queued, so it has to be cheap
+    def __init__(self, sample_rates=None, rate_limit=LOG_RATE_LIMIT_PER_SECOND):
+        super().__init__()
+        self.sample_rates = parse_sample_rates(LOG_SAMPLE_RATES) if sample_rates is None else sample_rates
+        self.rate_limit = rate_limit
+        self.burst = rate_limit * 2
+        # logger name -> sample rate, resolved once per logger
+        self._rates = {}
+        # logger name -> (tokens, updated)
+        self._buckets = {}
+        # Motor's executor threads log too
+        self._lock = threading.Lock()
+
+    def _sample_rate(self, name):
+        rate = self._rates.get(name)
+        if rate is None:
+            rate = 1.0
+            # The longest configured prefix wins ("routers" covers "routers.patients")
+            prefix = name
+            while prefix:
+                if prefix in self.sample_rates:
+                    rate = self.sample_rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._rates[name] = rate
+        return rate
+
+    def _take(self, name):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate_limit)
+            if tokens < 1:
+                self._buckets[name] = (tokens, now)
+                return False
+            self._buckets[name] = (tokens - 1, now)
+            return True
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._sample_rate(record.name)
+        if rate < 1.0 and random.random() >= rate:
+            log_records_dropped.inc(logger=record.name, reason="sampled")
+            return False
+        if self.rate_limit > 0 and not self._take(record.name):
+            log_records_dropped.inc(logger=record.name, reason="rate_limited")
+            return False
+        return True
+
+
+class RequestIdFilter(logging.Filter):
+    # Captured where the record is created; the listener thread has no request context
+    def filter(self, record):
+        record.request_id = current_request_id()
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The stock handler formats the message here, on the caller's thread. The
+        # queue never leaves the process, so the record goes as it is and the
+        # listener formats it.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never wait for the writer: a backlog of log lines must not stall requests
+            log_records_dropped.inc(logger=record.name, reason="queue_full")
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room, unlike put_nowait, so stopping never loses the sentinel
+        self.queue.put(self._sentinel)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return dumps(entry).decode("utf-8")
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        if not getattr(record, "request_id", None):
+            record.request_id = "-"
+        return super().format(record)
+
+
+_listener = None
+
+def setup_logging(level=None, fmt=None):
+    # Idempotent: modules that log at import time call it too. A later call
+    # only changes the level, and only when one is given.
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        if level:
+            root.setLevel(level)
+        return
+    root.setLevel(level or LOG_LEVEL)
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(TextFormatter(TEXT_FORMAT) if (fmt or LOG_FORMAT) == "text" else JSONFormatter())
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(RequestIdFilter())
+
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    for name in ROUTED_LOGGERS:
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.propagate = True
+
+    _listener = _Listener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    # Writes out whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,15 +1,24 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, patients
-from database import init_db, close_db
+from routers import auth, patients, analytics, bulk, profiles, appointments, events, suggest, duplicates
+from events import event_bus
+from database import init_db, close_db, get_db
+from password_hashing import password_hasher
+from patient_cache import patient_cache
+from request_context import RequestStatsMiddleware
+from metrics import MetricsMiddleware, metrics_response
+from profiling import ProfilingMiddleware, PROFILING_ENABLED
+from compression import CompressionMiddleware
+from readiness import readiness
+from suggest import suggest_index
+from admission import AdmissionMiddleware
 from contextlib import asynccontextmanager
+from logging_config import setup_logging
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging (see logging_config.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
@@ -19,6 +28,9 @@ async def lifespan(app: FastAPI):
         logger.info("Starting up the application...")
         await init_db()
         logger.info("Database initialized successfully")
+        password_hasher.start()
+        event_bus.start(get_db())
+        await readiness.warm_up(get_db())
     except Exception as e:
         logger.error(f"Error during startup: {e}")
         raise HTTPException(status_code=500, detail="Failed to initialize the application")
@@ -28,8 +40,12 @@ async def lifespan(app: FastAPI):
     # Shutdown
     try:
         logger.info("Shutting down the application...")
+        await event_bus.close()
+        await suggest_index.close()
         await close_db()
         logger.info("Database connection closed successfully")
+        password_hasher.shutdown()
+        await patient_cache.close()
     except Exception as e:
         logger.error(f"Error during shutdown: {e}")
 
@@ -40,6 +56,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Per-route concurrency limits and per-client rate limits; added first so it runs
+# inside CORS and its 429/503 responses are readable from the browser
+app.add_middleware(AdmissionMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -49,9 +69,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Latency, status and MongoDB metrics per route; added before RequestStatsMiddleware
+# so it runs inside it and sees the per-request MongoDB totals
+app.add_middleware(MetricsMiddleware)
+
+# Per-request database round-trip accounting (X-DB-Round-Trips header)
+app.add_middleware(RequestStatsMiddleware)
+
+# gzip/brotli for responses of COMPRESSION_MIN_SIZE bytes or more
+app.add_middleware(CompressionMiddleware)
+
+# Admin-requested and sampled request profiles (X-Profile: 1); outermost so it sees the whole request
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
+app.include_router(profiles.router, prefix="/api/admin/profiles", tags=["admin"])
+# Analytics, bulk, event, suggest and duplicate routes are registered first so "/analytics",
+# "/export", "/events", "/suggest" or "/duplicates" is not captured by "/{patient_id}"
+app.include_router(analytics.router, prefix="/api/patients", tags=["analytics"])
+app.include_router(bulk.router, prefix="/api/patients", tags=["bulk"])
+app.include_router(events.router, prefix="/api/patients", tags=["events"])
+app.include_router(suggest.router, prefix="/api/patients", tags=["suggest"])
+app.include_router(duplicates.router, prefix="/api/patients", tags=["duplicates"])
 app.include_router(patients.router, prefix="/api/patients", tags=["patients"])
+app.include_router(appointments.router, prefix="/api/appointments", tags=["appointments"])
 
 @app.get("/")
 async def root():
@@ -68,6 +111,18 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/ready")
+async def readiness_check():
+    # For load balancers: 503 while starting, draining or unable to reach MongoDB
+    ready, detail = await readiness.check()
+    return JSONResponse(detail, status_code=200 if ready else 503)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus text exposition format
+    return metrics_response()
+
 if __name__ == "__main__":
+    # Development server; production runs gunicorn with gunicorn.conf.py
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
@@ -0,0 +1,317 @@
+from bisect import bisect_left
+from fastapi.responses import Response
+from pymongo import monitoring
+from request_context import current_request_stats
+import threading
+import time
+
+# Prometheus-format metrics for HTTP requests, MongoDB commands and the MongoDB
+# connection pool, served at /metrics. Comparing http_request_duration_seconds
+# with http_request_db_seconds and http_request_pool_wait_seconds for a route
+# shows whether its time goes to Python, to waiting for a connection or to Mongo.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+# Requests that did not match any route share one label, so stray URLs cannot blow up cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, ([*counts], total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")
+)
+http_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")
+)
+http_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled", ("method",)
+)
+http_db_commands = registry.histogram(
+    "http_request_db_commands", "MongoDB commands issued per HTTP request", ("method", "route"), COUNT_BUCKETS
+)
+http_db_time = registry.histogram(
+    "http_request_db_seconds", "Time per HTTP request spent in MongoDB commands", ("method", "route"), DB_BUCKETS
+)
+http_pool_wait = registry.histogram(
+    "http_request_pool_wait_seconds", "Time per HTTP request spent waiting for a pooled connection",
+    ("method", "route"), DB_BUCKETS
+)
+
+mongo_commands = registry.counter(
+    "mongodb_commands_total", "MongoDB commands by outcome", ("command", "collection", "outcome")
+)
+mongo_command_duration = registry.histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency as reported by the driver",
+    ("command", "collection"), DB_BUCKETS
+)
+
+pool_max_size = registry.gauge("mongodb_pool_max_size", "Configured maxPoolSize per server")
+pool_connections = registry.gauge("mongodb_pool_connections", "Open pooled connections", ("address",))
+pool_checked_out = registry.gauge(
+    "mongodb_pool_checked_out_connections", "Pooled connections currently checked out", ("address",)
+)
+pool_checkouts = registry.counter(
+    "mongodb_pool_checkouts_total", "Connection checkouts by outcome", ("address", "outcome")
+)
+pool_wait = registry.histogram(
+    "mongodb_pool_checkout_wait_seconds", "Time spent waiting to check out a connection", ("address",), DB_BUCKETS
+)
+
+
+def _address(address):
+    return f"{address[0]}:{address[1]}" if isinstance(address, tuple) else str(address)
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    # Runs on the thread that issued the command; Motor copies the request's
+    # contextvars into that thread, so per-request totals land on the right request
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if isinstance(collection, str):
+            with self._lock:
+                self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finished(self, event, outcome):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "")
+        duration = event.duration_micros / 1_000_000
+        mongo_commands.inc(command=event.command_name, collection=collection, outcome=outcome)
+        mongo_command_duration.observe(duration, command=event.command_name, collection=collection)
+        stats = current_request_stats()
+        if stats is not None:
+            stats.record_command(duration)
+
+    def succeeded(self, event):
+        self._finished(event, "success")
+
+    def failed(self, event):
+        self._finished(event, "failure")
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    # A checkout starts and completes on the same thread, so the start time is kept thread-locally
+    def __init__(self):
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pool_connections.inc(address=_address(event.address))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pool_connections.dec(address=_address(event.address))
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _waited(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_failed(self, event):
+        address = _address(event.address)
+        pool_wait.observe(self._waited(), address=address)
+        pool_checkouts.inc(address=address, outcome=str(event.reason))
+
+    def connection_checked_out(self, event):
+        address = _address(event.address)
+        waited = self._waited()
+        pool_wait.observe(waited, address=address)
+        pool_checkouts.inc(address=address, outcome="success")
+        pool_checked_out.inc(address=address)
+        stats = current_request_stats()
+        if stats is not None:
+            stats.record_pool_wait(waited)
+
+    def connection_checked_in(self, event):
+        pool_checked_out.dec(address=_address(event.address))
+
+
+def event_listeners():
+    return [CommandMetricsListener(), PoolMetricsListener()]
+
+def route_label(scope):
+    # The route template (e.g. /api/patients/{patient_id}), never the raw path
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware; must run inside RequestStatsMiddleware so the
+    # per-request MongoDB totals are available when the request finishes
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc(method=method)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_in_flight.dec(method=method)
+            route = route_label(scope)
+            http_requests.inc(method=method, route=route, status=status)
+            http_duration.observe(time.perf_counter() - started, method=method, route=route)
+            stats = current_request_stats()
+            if stats is not None:
+                http_db_commands.observe(stats.db_commands, method=method, route=route)
+                http_db_time.observe(stats.db_time, method=method, route=route)
+                http_pool_wait.observe(stats.pool_wait, method=method, route=route)
+
+def metrics_response() -> Response:
+    return Response(registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,352 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from search import search_fields
+from duplicates import dedup_fields
+from analytics import rebuild_rollups
+from appointments import appointment_operations, APPOINTMENT_COLLECTION
+from logging_config import setup_logging
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Versioned schema migrations. Each migration runs once, in version order, and
+# is recorded in the schema_migrations collection:
+#   {"_id": <version>, "name": ..., "state": "running" | "applied",
+#    "started_at": ..., "applied_at": ..., "duration_ms": ..., "checkpoint": <last _id>}
+# Migrations must be idempotent: an interrupted one is simply run again, and
+# backfills resume after their last checkpoint. Startup only compares versions
+# (see check_schema); migrations are applied with `python migrations.py up`.
+MIGRATIONS_COLLECTION = "schema_migrations"
+LOCK_ID = "lock"
+BACKFILL_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+# MIGRATE_ON_STARTUP with several workers: the ones that lose the lock wait this
+# long for the winner to finish (keep it under gunicorn's WORKER_TIMEOUT), then
+# start anyway with a warning
+MIGRATION_LOCK_WAIT_SECONDS = float(os.getenv("MIGRATION_LOCK_WAIT_SECONDS", "30"))
+MIGRATION_LOCK_POLL_SECONDS = 1
+
+MIGRATIONS = []
+
+
+class MigrationLocked(Exception):
+    pass
+
+
+class Migration:
+    def __init__(self, version, name, apply):
+        self.version = version
+        self.name = name
+        self.apply = apply
+
+
+def migration(version, name):
+    def register(apply):
+        if any(m.version == version for m in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, name, apply))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return apply
+    return register
+
+
+class MigrationContext:
+    def __init__(self, db, version, batch_size=BACKFILL_BATCH_SIZE, checkpoint=None):
+        self.db = db
+        self.version = version
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+
+    async def backfill(self, collection, query, projection, update_for, target=None):
+        # Walks the collection in _id order, bulk-writing update_for(document)
+        # (a write operation, a list of them, or None to skip) for each match to
+        # target (default: the same collection), one batch per round trip. The
+        # last _id of every batch is saved, so a rerun continues there.
+        processed = 0
+        while True:
+            batch_query = dict(query)
+            if self.checkpoint is not None:
+                batch_query["_id"] = {"$gt": self.checkpoint}
+            batch = await self.db[collection].find(batch_query, projection) \
+                .sort("_id", 1).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                return processed
+
+            operations = []
+            for document in batch:
+                update = update_for(document)
+                if isinstance(update, list):
+                    operations.extend(update)
+                elif update is not None:
+                    operations.append(update)
+            if operations:
+                await self.db[target or collection].bulk_write(operations, ordered=False)
+            processed += len(batch)
+            self.checkpoint = batch[-1]["_id"]
+            await self.db[MIGRATIONS_COLLECTION].update_one(
+                {"_id": self.version},
+                {"$set": {"checkpoint": self.checkpoint}, "$inc": {"processed": len(batch)}}
+            )
+            logger.info(f"Migration {self.version}: {processed} {collection} documents processed")
+
+    async def replace_index(self, collection, keys, name, **options):
+        # create_index fails if an index of the same name exists with other options
+        existing = (await self.db[collection].index_information()).get(name)
+        if existing is not None:
+            same_keys = [tuple(key) for key in existing["key"]] == [tuple(key) for key in keys]
+            if same_keys and all(existing.get(option) == value for option, value in options.items()):
+                return
+            await self.db[collection].drop_index(name)
+        await self.db[collection].create_index(keys, name=name, **options)
+
+
+@migration(1, "create_user_indexes")
+async def create_user_indexes(ctx):
+    await ctx.db.users.create_index("email", unique=True, name="unique_email")
+    await ctx.db.users.create_index("username", unique=True, name="unique_username")
+
+@migration(2, "create_patient_indexes")
+async def create_patient_indexes(ctx):
+    # Patient list ordering (newest first), optionally filtered by gender
+    await ctx.db.patients.create_index([("created_at", -1), ("_id", -1)], name="patient_created_at")
+    await ctx.db.patients.create_index([("gender", 1), ("created_at", -1), ("_id", -1)], name="patient_gender_created_at")
+    # Multikey index over the edge n-gram search keys (see search.py)
+    await ctx.db.patients.create_index([("search_keys", 1), ("gender", 1)], name="patient_search_keys")
+
+@migration(3, "create_rollup_indexes")
+async def create_rollup_indexes(ctx):
+    # Rollup lookups are by dimension, ordered by count (top-N) or key (time series)
+    await ctx.db.patient_rollups.create_index([("dim", 1), ("count", -1)], name="rollup_dim_count")
+    await ctx.db.patient_rollups.create_index([("dim", 1), ("key", -1)], name="rollup_dim_key")
+
+@migration(4, "unique_legacy_patient_id")
+async def unique_legacy_patient_id(ctx):
+    # Only older records carry a separate string "id". Limiting the unique index
+    # to those means documents without one no longer collide on null, so nothing
+    # has to be backfilled for it.
+    await ctx.replace_index(
+        "patients", [("id", 1)], "unique_patient_id",
+        unique=True, partialFilterExpression={"id": {"$type": "string"}}
+    )
+
+@migration(5, "backfill_search_fields")
+async def backfill_search_fields(ctx):
+    await ctx.backfill(
+        "patients",
+        {"search_keys": {"$exists": False}},
+        {"name": 1, "phone": 1, "chronicConditions": 1},
+        lambda patient: UpdateOne({"_id": patient["_id"]}, {"$set": search_fields(patient)})
+    )
+
+@migration(6, "build_patient_rollups")
+async def build_patient_rollups(ctx):
+    await rebuild_rollups(ctx.db)
+
+@migration(7, "create_appointment_indexes")
+async def create_appointment_indexes(ctx):
+    # Calendar queries: one department or doctor over a date range, or every appointment in one
+    await ctx.db.appointments.create_index([("department", 1), ("date", 1), ("_id", 1)], name="appointment_department_date")
+    await ctx.db.appointments.create_index([("doctor", 1), ("date", 1), ("_id", 1)], name="appointment_doctor_date")
+    await ctx.db.appointments.create_index([("date", 1), ("_id", 1)], name="appointment_date")
+    # Keeping the copy in step with a patient's embedded array
+    await ctx.db.appointments.create_index([("patient_id", 1), ("position", 1)], name="appointment_patient")
+
+@migration(8, "backfill_appointments")
+async def backfill_appointments(ctx):
+    if ctx.checkpoint is None:
+        # A fresh run (or redo) starts from an empty copy so nothing deleted survives
+        await ctx.db[APPOINTMENT_COLLECTION].delete_many({})
+    await ctx.backfill(
+        "patients",
+        {"appointments.0": {"$exists": True}},
+        {"name": 1, "appointments": 1},
+        appointment_operations,
+        target=APPOINTMENT_COLLECTION
+    )
+
+@migration(9, "create_dedup_index")
+async def create_dedup_index(ctx):
+    # Duplicate-detection candidates: patients sharing a phone, email or name+DOB key
+    await ctx.db.patients.create_index("dedup_keys", name="patient_dedup_keys")
+
+@migration(10, "backfill_dedup_fields")
+async def backfill_dedup_fields(ctx):
+    await ctx.backfill(
+        "patients",
+        {"dedup_keys": {"$exists": False}},
+        {"name": 1, "phone": 1, "email": 1, "dob": 1},
+        lambda patient: UpdateOne({"_id": patient["_id"]}, {"$set": dedup_fields(patient)})
+    )
+
+
+async def applied_versions(db):
+    cursor = db[MIGRATIONS_COLLECTION].find({"state": "applied"}, {"_id": 1})
+    return {document["_id"] async for document in cursor}
+
+def latest_version():
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+async def pending_migrations(db):
+    applied = await applied_versions(db)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+async def _acquire_lock(db):
+    try:
+        await db[MIGRATIONS_COLLECTION].insert_one({
+            "_id": LOCK_ID,
+            "owner": f"{socket.gethostname()}:{os.getpid()}",
+            "acquired_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        lock = await db[MIGRATIONS_COLLECTION].find_one({"_id": LOCK_ID})
+        raise MigrationLocked(
+            f"Migrations are locked by {lock and lock.get('owner')} since {lock and lock.get('acquired_at')}; "
+            "if that run is dead, use `python migrations.py unlock`"
+        )
+
+async def release_lock(db):
+    await db[MIGRATIONS_COLLECTION].delete_one({"_id": LOCK_ID})
+
+async def run_migration(db, m, batch_size=BACKFILL_BATCH_SIZE):
+    started = time.perf_counter()
+    # A migration left "running" by an interrupted run keeps its checkpoint
+    previous = await db[MIGRATIONS_COLLECTION].find_one_and_update(
+        {"_id": m.version},
+        {"$set": {"name": m.name, "state": "running", "started_at": datetime.utcnow()}},
+        upsert=True
+    )
+    checkpoint = previous.get("checkpoint") if previous and previous.get("state") == "running" else None
+    if checkpoint is not None:
+        logger.info(f"Resuming migration {m.version} ({m.name}) after {checkpoint}")
+    else:
+        logger.info(f"Applying migration {m.version} ({m.name})")
+
+    await m.apply(MigrationContext(db, m.version, batch_size, checkpoint))
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    await db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": m.version},
+        {"$set": {"state": "applied", "applied_at": datetime.utcnow(), "duration_ms": duration_ms},
+         "$unset": {"checkpoint": ""}}
+    )
+    logger.info(f"Applied migration {m.version} ({m.name}) in {duration_ms} ms")
+
+async def migrate(db, target=None, batch_size=BACKFILL_BATCH_SIZE):
+    # Applies every pending migration up to target (default: all); returns their versions
+    await _acquire_lock(db)
+    try:
+        applied = []
+        for m in await pending_migrations(db):
+            if target is not None and m.version > target:
+                break
+            await run_migration(db, m, batch_size)
+            applied.append(m.version)
+        return applied
+    finally:
+        await release_lock(db)
+
+async def redo(db, version, batch_size=BACKFILL_BATCH_SIZE):
+    # Runs one migration again from scratch, e.g. to recreate indexes that were dropped
+    m = next((m for m in MIGRATIONS if m.version == version), None)
+    if m is None:
+        raise ValueError(f"Unknown migration version {version}")
+    await _acquire_lock(db)
+    try:
+        await db[MIGRATIONS_COLLECTION].delete_one({"_id": version})
+        await run_migration(db, m, batch_size)
+    finally:
+        await release_lock(db)
+
+async def migration_status(db):
+    records = {
+        document["_id"]: document
+        async for document in db[MIGRATIONS_COLLECTION].find({"_id": {"$ne": LOCK_ID}})
+    }
+    return [
+        {
+            "version": m.version,
+            "name": m.name,
+            "state": records.get(m.version, {}).get("state", "pending"),
+            "applied_at": records.get(m.version, {}).get("applied_at"),
+            "duration_ms": records.get(m.version, {}).get("duration_ms")
+        }
+        for m in MIGRATIONS
+    ]
+
+async def check_schema(db, apply_pending=False):
+    # Startup check: one small query against schema_migrations
+    pending = await pending_migrations(db)
+    if not pending:
+        logger.info(f"Database schema is up to date (version {latest_version()})")
+        return []
+    if apply_pending:
+        return await _migrate_or_wait(db)
+    logger.warning(
+        f"{len(pending)} pending migration(s): "
+        f"{', '.join(f'{m.version} ({m.name})' for m in pending)}. Run `python migrations.py up`."
+    )
+    return [m.version for m in pending]
+
+async def _migrate_or_wait(db):
+    # Startup must not fail because another worker holds the lock: wait for it to
+    # finish (or take over if it gave up with migrations still pending)
+    deadline = time.monotonic() + MIGRATION_LOCK_WAIT_SECONDS
+    while True:
+        try:
+            return await migrate(db)
+        except MigrationLocked as e:
+            locked = e
+        while await db[MIGRATIONS_COLLECTION].find_one({"_id": LOCK_ID}, {"_id": 1}):
+            if time.monotonic() >= deadline:
+                logger.warning(f"Starting without waiting any longer for migrations: {locked}")
+                return [m.version for m in await pending_migrations(db)]
+            await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        if not await pending_migrations(db):
+            logger.info(f"Migrations applied by another process; schema is at version {latest_version()}")
+            return []
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python migrations.py", description="Database schema migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="list migrations and whether they are applied")
+    up = commands.add_parser("up", help="apply pending migrations")
+    up.add_argument("--to", type=int, default=None, help="stop after this version")
+    up.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    redo_parser = commands.add_parser("redo", help="run one migration again")
+    redo_parser.add_argument("version", type=int)
+    redo_parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    commands.add_parser("unlock", help="remove the lock left by a crashed run")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    client = AsyncIOMotorClient(os.getenv("MONGODB_URL"))
+    try:
+        db = client[os.getenv("DATABASE_NAME")]
+        if args.command == "status":
+            for row in await migration_status(db):
+                print(f"{row['version']:>4}  {row['name']:<28} {row['state']:<8} {row['applied_at'] or ''}")
+        elif args.command == "up":
+            applied = await migrate(db, args.to, args.batch_size)
+            print(f"Applied {len(applied)} migration(s); schema version {latest_version()}" if applied else "Nothing to apply")
+        elif args.command == "redo":
+            await redo(db, args.version, args.batch_size)
+        elif args.command == "unlock":
+            await release_lock(db)
+        return 0
+    except MigrationLocked as e:
+        logger.error(str(e))
+        return 1
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    setup_logging()
+    sys.exit(asyncio.run(main()))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -24,6 +24,14 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+class Principal(BaseModel):
+    username: str
+    user_id: str
+    email: Optional[str] = None
+    is_active: bool = True
+    is_admin: bool = False
+    expires_at: float
+
 # Patient Models
 class Prescription(BaseModel):
     date: str
@@ -57,15 +65,188 @@ class Patient(PatientBase):
     prescriptions: List[Prescription] = []
     appointments: List[Appointment] = []
     created_at: datetime
+    version: int = 0
 
     class Config:
         from_attributes = True
 
-class PaginatedPatients(BaseModel):
-    patients: List[Patient]
-    total: int
+# Partial update: only the fields sent are written. version, when given, must
+# match the stored version or the update is rejected with 409.
+class PatientUpdate(BaseModel):
+    name: Optional[str] = None
+    age: Optional[int] = None
+    gender: Optional[str] = None
+    dob: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    address: Optional[str] = None
+    chronicConditions: Optional[str] = None
+    allergies: Optional[str] = None
+    notes: Optional[str] = None
+    version: Optional[int] = None
+
+class PatientPatched(PatientUpdate):
+    id: str
+    version: int
+
+class PatientVersion(BaseModel):
+    id: str
+    version: int
+
+class PrescriptionAdded(PatientVersion):
+    prescription: Prescription
+
+class AppointmentAdded(PatientVersion):
+    appointment: Appointment
+
+# Batch endpoints (POST /api/patients/batch-get, batch-update, batch-delete).
+# fields limits batch-get to those Patient fields; every result keeps its id.
+class BatchGetRequest(BaseModel):
+    ids: List[str]
+    fields: Optional[List[str]] = None
+
+class BatchPatients(BaseModel):
+    patients: List[Dict]
+    missing: List[str]
+
+class BatchDeleteRequest(BaseModel):
+    ids: List[str]
+
+class BatchPatientUpdate(PatientUpdate):
+    id: str
+
+class BatchUpdateRequest(BaseModel):
+    patients: List[BatchPatientUpdate]
+
+class BatchItemResult(BaseModel):
+    id: str
+    # "updated", "deleted", "not_found", "conflict", "invalid" or "error"
+    status: str
+    version: Optional[int] = None
+    detail: Optional[str] = None
+
+class BatchResult(BaseModel):
+    results: List[BatchItemResult]
+    succeeded: int
+    failed: int
+
+# Lean shape for list views (no prescription/appointment history)
+class PatientSummary(BaseModel):
+    id: str
+    name: str
+    age: int
+    gender: str
+    phone: str
+    chronicConditions: Optional[str] = None
+    created_at: datetime
+
+class PageInfo(BaseModel):
+    total: Optional[int] = None
     page: int
-    total_pages: int
+    total_pages: Optional[int] = None
+    total_is_estimate: bool = False
+    # Ranked search pages through at most ranked_candidate_limit matches; when
+    # there are more, total is clamped to it and total_is_capped is set
+    total_is_capped: bool = False
+    ranked_candidate_limit: Optional[int] = None
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    has_more: bool = False
+
+class PaginatedPatients(PageInfo):
+    patients: List[Patient]
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+class PaginatedPatientSummaries(PageInfo):
+    patients: List[PatientSummary]
+
+# Typeahead (GET /api/patients/suggest)
+class PatientSuggestion(BaseModel):
+    id: str
+    name: Optional[str] = None
+    phone: Optional[str] = None
+
+class PatientSuggestions(BaseModel):
+    suggestions: List[PatientSuggestion]
+
+# Duplicate detection (see duplicates.py)
+class DuplicatePatient(BaseModel):
+    id: str
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    dob: Optional[str] = None
+
+class PossibleDuplicate(DuplicatePatient):
+    score: float
+    reasons: List[str]
+
+class PossibleDuplicates(BaseModel):
+    possible_duplicates: List[PossibleDuplicate]
+
+class DuplicatePair(BaseModel):
+    ids: List[str]
+    score: float
+    reasons: List[str]
+
+class DuplicateCluster(BaseModel):
+    patients: List[DuplicatePatient]
+    pairs: List[DuplicatePair]
+
+class DuplicateScan(BaseModel):
+    scanned: int
+    clusters: List[DuplicateCluster]
+
+# Calendar view over the denormalized appointments collection
+class AppointmentEntry(BaseModel):
+    id: str
+    patient_id: str
+    patient_name: Optional[str] = None
+    date: datetime
+    date_text: str
+    department: str
+    doctor: str
+
+class PaginatedAppointments(BaseModel):
+    appointments: List[AppointmentEntry]
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+
+# Analytics Models
+class CountBreakdown(BaseModel):
+    name: str
+    count: int
+    percentage: float
+
+class AgeRangeCount(BaseModel):
+    range: str
+    count: int
+    percentage: float
+
+class MonthlyVisits(BaseModel):
+    month: str
+    visits: int
+
+class PatientAnalytics(BaseModel):
+    total_patients: int
+    average_age: float
+    new_today: int
+    active_cases: int
+    gender_distribution: Dict[str, int]
+    age_distribution: List[AgeRangeCount]
+    conditions: List[CountBreakdown]
+    medications: List[CountBreakdown]
+    monthly_visits: List[MonthlyVisits]
+    generated_at: datetime
+
+class MetricsSummary(BaseModel):
+    total_patients: int
+    today_visits: int
+    active_cases: int
+    common_diagnosis: str
+    total_conditions: int
+    top_conditions: List[CountBreakdown]
+    gender_distribution: Dict[str, int]
+    age_distribution: Dict[str, int]
@@ -0,0 +1,131 @@
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+import base64
+import json
+import time
+
+# Patients are listed newest first. (created_at, _id) is unique and matches the
+# patient_created_at index, so both offset and keyset pages come straight off it.
+PATIENT_SORT = [("created_at", -1), ("_id", -1)]
+
+MAX_PAGE_SIZE = 100
+
+COUNT_MODES = ("exact", "estimated", "cached", "none")
+COUNT_CACHE_TTL_SECONDS = 30
+COUNT_CACHE_MAX_ENTRIES = 256
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(document, direction):
+    payload = {
+        "t": document["created_at"].isoformat() if isinstance(document.get("created_at"), datetime) else None,
+        "i": str(document["_id"]),
+        "d": direction
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        created_at = datetime.fromisoformat(payload["t"]) if payload["t"] else None
+        object_id = ObjectId(payload["i"])
+        direction = payload["d"]
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+    if direction not in ("next", "prev"):
+        raise InvalidCursor("Invalid cursor direction")
+    return created_at, object_id, direction
+
+def keyset_filter(created_at, object_id, direction):
+    # "next" walks towards older patients, "prev" towards newer ones
+    op = "$lt" if direction == "next" else "$gt"
+    return {
+        "$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "_id": {op: object_id}}
+        ]
+    }
+
+async def fetch_keyset_page(collection, query, limit, cursor=None, projection=None):
+    # Returns (documents, next_cursor, prev_cursor) for one page in PATIENT_SORT order.
+    # One extra document is fetched to know whether another page exists.
+    direction = "next"
+    page_query = query
+    if cursor:
+        created_at, object_id, direction = decode_cursor(cursor)
+        page_query = {"$and": [query, keyset_filter(created_at, object_id, direction)]} if query \
+            else keyset_filter(created_at, object_id, direction)
+
+    sort = PATIENT_SORT if direction == "next" else [(field, -order) for field, order in PATIENT_SORT]
+    documents = await collection.find(page_query, projection).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    if direction == "prev":
+        documents.reverse()
+
+    if not documents:
+        return documents, None, None
+
+    # Going forward there is a previous page whenever we came from a cursor;
+    # going backwards there is always a next page (the one we came from).
+    if direction == "next":
+        next_cursor = encode_cursor(documents[-1], "next") if has_more else None
+        prev_cursor = encode_cursor(documents[0], "prev") if cursor else None
+    else:
+        next_cursor = encode_cursor(documents[-1], "next")
+        prev_cursor = encode_cursor(documents[0], "prev") if has_more else None
+    return documents, next_cursor, prev_cursor
+
+
+class CountCache:
+    # Small TTL cache of count_documents results keyed by the query shape
+    def __init__(self, ttl=COUNT_CACHE_TTL_SECONDS, max_entries=COUNT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+
+    def _key(self, query):
+        return json.dumps(query, sort_keys=True, default=str)
+
+    def get(self, query):
+        entry = self._entries.get(self._key(query))
+        if entry and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def set(self, query, value):
+        if len(self._entries) >= self.max_entries:
+            now = time.monotonic()
+            self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        self._entries[self._key(query)] = (value, time.monotonic() + self.ttl)
+
+    def clear(self):
+        self._entries.clear()
+
+
+count_cache = CountCache()
+
+async def count_patients(collection, query, mode="exact"):
+    # Returns (total, is_estimate). "estimated" uses collection metadata when the
+    # query is unfiltered and falls back to the cache otherwise.
+    if mode == "none":
+        return None, True
+    if mode == "estimated" and not query:
+        return await collection.estimated_document_count(), True
+    if mode in ("estimated", "cached"):
+        cached = count_cache.get(query)
+        if cached is not None:
+            return cached, True
+        total = await collection.count_documents(query)
+        count_cache.set(query, total)
+        return total, False
+    return await collection.count_documents(query), False
@@ -0,0 +1,179 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from passlib.context import CryptContext
+from dotenv import load_dotenv
+import asyncio
+import logging
+import os
+import time
+import warnings
+
+# Suppress the bcrypt version warning
+warnings.filterwarnings("ignore", category=UserWarning, module="passlib.handlers.bcrypt")
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# bcrypt is deliberately slow (~250 ms at 12 rounds), so it never runs on the
+# event loop. Jobs go to a small worker pool; callers beyond the pool size wait
+# in a bounded queue and anything past that is rejected straight away.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5"))
+# "process" (default) or "thread"
+HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "process")
+
+LATENCY_SAMPLES = 1024
+
+_contexts = {}
+
+
+def get_crypt_context(rounds=BCRYPT_ROUNDS):
+    # Hashes created with a different round count are reported as needing an update
+    if rounds not in _contexts:
+        _contexts[rounds] = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+            bcrypt__ident="2b"  # Use the latest bcrypt format
+        )
+    return _contexts[rounds]
+
+# Worker entry points (must be module level so they can be pickled)
+def _hash_job(password, rounds):
+    return get_crypt_context(rounds).hash(password)
+
+def _verify_job(password, hashed, rounds):
+    try:
+        return get_crypt_context(rounds).verify_and_update(password, hashed)
+    except (ValueError, TypeError):
+        # Malformed hash in the database
+        return False, None
+
+
+class HashingOverloaded(Exception):
+    def __init__(self, retry_after=1):
+        super().__init__("Password hashing queue is full")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        workers=HASH_WORKERS,
+        queue_limit=HASH_QUEUE_LIMIT,
+        queue_timeout=HASH_QUEUE_TIMEOUT,
+        executor=HASH_EXECUTOR,
+        rounds=BCRYPT_ROUNDS
+    ):
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.executor_kind = executor
+        self.rounds = rounds
+        self._executor = None
+        self._slots = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._rehashed = 0
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._queue_waits = deque(maxlen=LATENCY_SAMPLES)
+
+    def start(self):
+        if self._executor is None:
+            if self.executor_kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._slots = asyncio.Semaphore(self.workers)
+            logger.info(f"Started password hashing pool ({self.executor_kind}, {self.workers} workers)")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+
+    async def _run(self, fn, *args):
+        self.start()
+        # Admission control: reject instead of queueing without bound
+        if self._slots.locked() and self._waiting >= self.queue_limit:
+            self._rejected += 1
+            raise HashingOverloaded(retry_after=max(1, round(self.queue_timeout)))
+
+        queued_at = time.perf_counter()
+        if not self._slots.locked():
+            # A worker is free: take it without yielding to the event loop
+            await self._slots.acquire()
+        else:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._timed_out += 1
+                raise HashingOverloaded(retry_after=max(1, round(self.queue_timeout)))
+            finally:
+                self._waiting -= 1
+
+        started_at = time.perf_counter()
+        self._queue_waits.append(started_at - queued_at)
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            self._completed += 1
+            self._latencies.append(time.perf_counter() - started_at)
+
+    async def hash(self, password):
+        return await self._run(_hash_job, password, self.rounds)
+
+    async def verify(self, password, hashed):
+        # Returns (valid, new_hash). new_hash is set when the stored hash used a
+        # different round count and should be replaced.
+        valid, new_hash = await self._run(_verify_job, password, hashed, self.rounds)
+        if new_hash:
+            self._rehashed += 1
+        return valid, new_hash
+
+    def stats(self):
+        def percentile(samples, pct):
+            if not samples:
+                return 0.0
+            ordered = sorted(samples)
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000, 2)
+
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "queue_limit": self.queue_limit,
+            "queue_depth": self._waiting,
+            "in_flight": self._in_flight,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+            "rehashed": self._rehashed,
+            "latency_ms": {
+                "p50": percentile(self._latencies, 0.50),
+                "p95": percentile(self._latencies, 0.95),
+                "p99": percentile(self._latencies, 0.99)
+            },
+            "queue_wait_ms": {
+                "p50": percentile(self._queue_waits, 0.50),
+                "p95": percentile(self._queue_waits, 0.95),
+                "p99": percentile(self._queue_waits, 0.99)
+            }
+        }
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,244 @@
+from bson import json_util
+from dotenv import load_dotenv
+from cache import TTLCache
+import logging
+import os
+import time
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # redis is optional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Read-through cache for single patient documents.
+#   L1: per-worker LRU (always on unless PATIENT_CACHE_ENABLED=false)
+#   L2: optional shared backend (Redis via PATIENT_CACHE_REDIS_URL)
+# Writes update or invalidate both tiers. Other workers' L1 entries are only
+# dropped by expiry, so the L1 TTL bounds cross-worker staleness; keep it short
+# when running several workers.
+# Every write also leaves a short-lived tombstone holding the lowest version a
+# read-through fill may cache, so a read that raced the write cannot put the
+# version it read back over the newer one.
+PATIENT_CACHE_ENABLED = os.getenv("PATIENT_CACHE_ENABLED", "true").lower() == "true"
+PATIENT_CACHE_SIZE = int(os.getenv("PATIENT_CACHE_SIZE", "2048"))
+PATIENT_CACHE_LOCAL_TTL = float(os.getenv("PATIENT_CACHE_LOCAL_TTL", "30"))
+PATIENT_CACHE_SHARED_TTL = int(os.getenv("PATIENT_CACHE_SHARED_TTL", "300"))
+PATIENT_CACHE_REDIS_URL = os.getenv("PATIENT_CACHE_REDIS_URL")
+# Must outlast the slowest read-through (database read plus fill)
+PATIENT_CACHE_TOMBSTONE_TTL = int(os.getenv("PATIENT_CACHE_TOMBSTONE_TTL", "60"))
+
+KEY_PREFIX = "patient:"
+TOMBSTONE_PREFIX = "patient-tombstone:"
+
+
+class InMemorySharedBackend:
+    # Local stand-in for a shared cache. Values are stored serialized, like they
+    # would be in Redis, so callers cannot rely on object identity.
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._store = {}
+
+    async def get(self, key):
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self._store[key]
+            return None
+        return value
+
+    async def set(self, key, value, ttl):
+        self._store[key] = (value, self.clock() + ttl)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._store.pop(key, None)
+
+    async def close(self):
+        self._store.clear()
+
+
+class RedisSharedBackend:
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("PATIENT_CACHE_REDIS_URL is set but the redis package is not installed")
+        self._client = redis.from_url(url)
+
+    async def get(self, key):
+        return await self._client.get(key)
+
+    async def set(self, key, value, ttl):
+        await self._client.set(key, value, ex=ttl)
+
+    async def delete(self, *keys):
+        if keys:
+            await self._client.delete(*keys)
+
+    async def close(self):
+        await self._client.close()
+
+
+class PatientCache:
+    def __init__(
+        self,
+        enabled=PATIENT_CACHE_ENABLED,
+        max_size=PATIENT_CACHE_SIZE,
+        local_ttl=PATIENT_CACHE_LOCAL_TTL,
+        shared_ttl=PATIENT_CACHE_SHARED_TTL,
+        tombstone_ttl=PATIENT_CACHE_TOMBSTONE_TTL,
+        shared=None
+    ):
+        self.enabled = enabled
+        self.shared_ttl = shared_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.local = TTLCache(max_size=max_size, ttl=local_ttl)
+        self.tombstones = TTLCache(max_size=max_size, ttl=tombstone_ttl)
+        self.shared = shared
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.shared_errors = 0
+        self.invalidations = 0
+        self.stale_fills = 0
+
+    @staticmethod
+    def keys_for(document):
+        # A patient may be addressed by its ObjectId or by the legacy "id" field
+        keys = {str(document["_id"])}
+        if document.get("id"):
+            keys.add(str(document["id"]))
+        return keys
+
+    async def get(self, patient_id):
+        if not self.enabled:
+            return None
+        document = self.local.get(patient_id)
+        if document is not None or self.shared is None:
+            return document
+        try:
+            raw = await self.shared.get(KEY_PREFIX + patient_id)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared patient cache read failed: {e}")
+            return None
+        if raw is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        document = json_util.loads(raw)
+        self.local.set(patient_id, document)
+        return document
+
+    async def set(self, document):
+        # Called with the version a write just produced
+        if not self.enabled:
+            return
+        version = document.get("version", 0)
+        await self._tombstone(document, version)
+        # A later write that finished first has already moved the tombstone on
+        if all(version >= self.tombstones.get(key, -1) for key in self.keys_for(document)):
+            await self._store(document)
+
+    async def fill(self, document):
+        # Read-through: caches a document read from the database unless a write
+        # has since produced a newer version of it
+        if not self.enabled:
+            return
+        if await self._is_stale(document):
+            self.stale_fills += 1
+            return
+        await self._store(document)
+
+    async def _store(self, document):
+        keys = self.keys_for(document)
+        for key in keys:
+            self.local.set(key, document)
+        if self.shared is not None:
+            raw = json_util.dumps(document)
+            try:
+                for key in keys:
+                    await self.shared.set(KEY_PREFIX + key, raw, self.shared_ttl)
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning(f"Shared patient cache write failed: {e}")
+
+    async def _tombstone(self, document, min_version):
+        keys = self.keys_for(document)
+        for key in keys:
+            self.tombstones.set(key, max(min_version, self.tombstones.get(key, -1)))
+        if self.shared is not None:
+            try:
+                for key in keys:
+                    await self.shared.set(TOMBSTONE_PREFIX + key, str(self.tombstones.get(key)), self.tombstone_ttl)
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning(f"Shared patient cache tombstone write failed: {e}")
+
+    async def _is_stale(self, document):
+        version = document.get("version", 0)
+        keys = self.keys_for(document)
+        for key in keys:
+            cached = self.local.get(key)
+            if version < self.tombstones.get(key, -1) or (cached is not None and version < cached.get("version", 0)):
+                return True
+        if self.shared is None:
+            return False
+        # Tombstones left by other workers. A write landing between this check
+        # and the store can still be overwritten; the shared TTL bounds that.
+        try:
+            for key in keys:
+                raw = await self.shared.get(TOMBSTONE_PREFIX + key)
+                if raw is not None and version < int(raw):
+                    return True
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"Shared patient cache tombstone read failed: {e}")
+            return True
+        return False
+
+    async def invalidate(self, document):
+        if not self.enabled:
+            return
+        keys = self.keys_for(document)
+        self.invalidations += 1
+        # document is the version being replaced or deleted; only later ones may be filled
+        await self._tombstone(document, document.get("version", 0) + 1)
+        for key in keys:
+            self.local.delete(key)
+        if self.shared is not None:
+            try:
+                await self.shared.delete(*(KEY_PREFIX + key for key in keys))
+            except Exception as e:
+                self.shared_errors += 1
+                logger.warning(f"Shared patient cache invalidation failed: {e}")
+
+    def clear(self):
+        self.local.clear()
+        self.tombstones.clear()
+
+    async def close(self):
+        if self.shared is not None:
+            await self.shared.close()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "local": self.local.stats(),
+            "shared": {
+                "backend": type(self.shared).__name__ if self.shared is not None else None,
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "errors": self.shared_errors
+            },
+            "invalidations": self.invalidations,
+            "stale_fills": self.stale_fills
+        }
+
+
+patient_cache = PatientCache(
+    shared=RedisSharedBackend(PATIENT_CACHE_REDIS_URL) if PATIENT_CACHE_REDIS_URL else None
+)
@@ -0,0 +1,260 @@
+from fastapi import Depends
+from pymongo import ReturnDocument, DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from database import get_db
+from search import search_fields, search_fields_update, SEARCH_PROJECTION
+from duplicates import dedup_fields, dedup_fields_update
+
+# Every method here costs exactly one round trip to MongoDB (conditional writes
+# take a second one only to tell a missing patient from a version conflict or
+# from one that is already up to date).
+# Batch methods cost one $in read plus one bulk_write, whatever the batch size.
+
+# Patient histories are not read back by partial writes, so their cost does
+# not grow with the number of prescriptions and appointments
+HISTORY_FIELDS = ("prescriptions", "appointments")
+PATCH_PROJECTION = dict(SEARCH_PROJECTION, **{field: 0 for field in HISTORY_FIELDS})
+
+
+def patient_filter(patient_id: str) -> dict:
+    # Patients are addressed by their ObjectId; older records may also carry a separate "id" field
+    if ObjectId.is_valid(patient_id):
+        return {"$or": [{"_id": ObjectId(patient_id)}, {"id": patient_id}]}
+    return {"id": patient_id}
+
+def patients_filter(patient_ids) -> dict:
+    # Batch form of patient_filter
+    object_ids = [ObjectId(patient_id) for patient_id in patient_ids if ObjectId.is_valid(patient_id)]
+    legacy = {"id": {"$in": list(patient_ids)}}
+    if object_ids:
+        return {"$or": [{"_id": {"$in": object_ids}}, legacy]}
+    return legacy
+
+def match_patients(patient_ids, documents) -> dict:
+    # {requested id: document}, for the requested ids that matched a document
+    by_id = {}
+    for document in documents:
+        by_id[str(document["_id"])] = document
+        if isinstance(document.get("id"), str):
+            by_id.setdefault(document["id"], document)
+    return {patient_id: by_id[patient_id] for patient_id in patient_ids if patient_id in by_id}
+
+def derived_fields(patient: dict) -> dict:
+    # Everything kept in step with a full patient document on insert or replace
+    return {**search_fields(patient), **dedup_fields(patient)}
+
+def derived_fields_update(fields: dict) -> dict:
+    # The same for an update pipeline that changes only some fields
+    return {**search_fields_update(fields), **dedup_fields_update(fields)}
+
+def version_filter(version: int) -> dict:
+    # Documents written before versioning have no version field and count as 0
+    if version == 0:
+        return {"version": {"$in": [0, None]}}
+    return {"version": version}
+
+def strip_search_fields(document: dict) -> dict:
+    return {k: v for k, v in document.items() if k not in SEARCH_PROJECTION}
+
+
+class VersionConflict(Exception):
+    def __init__(self, current_version: int):
+        super().__init__(f"Patient was modified concurrently (current version {current_version})")
+        self.current_version = current_version
+
+
+class PatientRepository:
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.patients
+
+    async def get(self, patient_id: str, projection=SEARCH_PROJECTION):
+        return await self.collection.find_one(patient_filter(patient_id), projection)
+
+    async def create(self, document: dict) -> dict:
+        # The stored document is exactly what we inserted, so there is no need to read it back
+        document = dict(document)
+        document.update(derived_fields(document))
+        document["version"] = 1
+        result = await self.collection.insert_one(document)
+        document["_id"] = result.inserted_id
+        return strip_search_fields(document)
+
+    async def update(self, patient_id: str, fields: dict):
+        # Returns (before, after), (current, None) if the patient already holds
+        # exactly these values, or (None, None) if the patient does not exist.
+        # The previous version comes back from findAndModify and the new one is
+        # derived locally, since $set of top-level fields is applied verbatim.
+        # Only a document that differs in some field matches, so a no-op write
+        # leaves the version alone.
+        changed = {"$or": [{field: {"$ne": value}} for field, value in fields.items()]}
+        fields = dict(fields)
+        fields.update(derived_fields(fields))
+        before = await self.collection.find_one_and_update(
+            {"$and": [patient_filter(patient_id), changed]},
+            {"$set": fields, "$inc": {"version": 1}},
+            projection=SEARCH_PROJECTION,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            # Missing or unchanged; the second round trip is only paid on this path
+            return await self.collection.find_one(patient_filter(patient_id), SEARCH_PROJECTION), None
+        return before, {**before, **strip_search_fields(fields), "version": before.get("version", 0) + 1}
+
+    async def patch(self, patient_id: str, fields: dict, expected_version: int = None):
+        # Sets only the given top-level fields. Returns (before, after) without
+        # the history arrays, or (None, None) if the patient does not exist.
+        # Raises VersionConflict if expected_version no longer matches.
+        stage = {field: {"$literal": value} for field, value in fields.items()}
+        stage.update(derived_fields_update(fields))
+        stage["version"] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+        before = await self._conditional_update(patient_id, [{"$set": stage}], expected_version, PATCH_PROJECTION)
+        if before is None:
+            return None, None
+        return before, {**before, **fields, "version": before.get("version", 0) + 1}
+
+    async def append(self, patient_id: str, field: str, entry: dict, expected_version: int = None):
+        # $push one entry onto a history array. Only the entry dates come back
+        # (for the last-prescription rollup and the new entry's position), not the
+        # history itself, plus the name for the appointments copy. Returns the
+        # previous version of the document or None if the patient does not exist.
+        projection = {"id": 1, "name": 1, "version": 1, f"{field}.date": 1}
+        update = {"$push": {field: entry}, "$inc": {"version": 1}}
+        return await self._conditional_update(patient_id, update, expected_version, projection)
+
+    async def _conditional_update(self, patient_id, update, expected_version, projection):
+        query = patient_filter(patient_id)
+        if expected_version is not None:
+            query = {"$and": [query, version_filter(expected_version)]}
+        before = await self.collection.find_one_and_update(
+            query,
+            update,
+            projection=projection,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None and expected_version is not None:
+            current = await self.collection.find_one(patient_filter(patient_id), {"version": 1})
+            if current is not None:
+                raise VersionConflict(current.get("version", 0))
+        return before
+
+    async def get_many(self, patient_ids, projection=SEARCH_PROJECTION) -> dict:
+        # {requested id: document} for the patients that exist
+        if projection and all(value for value in projection.values()):
+            # Inclusion projections still need the legacy id to match requests
+            projection = dict(projection, id=1)
+        documents = await self.collection.find(patients_filter(patient_ids), projection).to_list(length=None)
+        return match_patients(patient_ids, documents)
+
+    async def delete_many(self, patient_ids):
+        # Returns ({requested id: deleted document}, {requested id: error}).
+        # The documents are read first (rollups, caches and events need them) and
+        # each delete is conditional on the version read, so a patient changed in
+        # between is reported as a conflict instead of being removed unseen.
+        found = await self.get_many(patient_ids)
+        targets = list({document["_id"]: document for document in found.values()}.values())
+        operations = [
+            DeleteOne({"_id": document["_id"], **version_filter(document.get("version", 0))})
+            for document in targets
+        ]
+        errors = await self._bulk_write(operations, "nRemoved")
+        if errors is None:
+            return found, {}
+        failed = await self._unchanged(targets, errors, lambda document, current: current is None)
+        return (
+            {patient_id: document for patient_id, document in found.items() if document["_id"] not in failed},
+            {patient_id: failed[document["_id"]] for patient_id, document in found.items() if document["_id"] in failed}
+        )
+
+    async def patch_many(self, items):
+        # items are (patient_id, fields, expected_version) with distinct patients.
+        # Returns ({requested id: (before, after)}, {requested id: error}), with the
+        # same documents and version checks as patch(); patients that do not exist
+        # are in neither.
+        found = await self.get_many([patient_id for patient_id, _, _ in items], PATCH_PROJECTION)
+        operations, targets, changes, errors = [], [], {}, {}
+        seen = set()
+        for patient_id, fields, expected_version in items:
+            before = found.get(patient_id)
+            if before is None:
+                continue
+            if before["_id"] in seen:
+                # The same patient under its ObjectId and its legacy id
+                errors[patient_id] = ValueError("Patient appears more than once in the batch")
+                continue
+            version = before.get("version", 0)
+            if expected_version is not None and expected_version != version:
+                errors[patient_id] = VersionConflict(version)
+                continue
+            stage = {field: {"$literal": value} for field, value in fields.items()}
+            stage.update(derived_fields_update(fields))
+            stage["version"] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+            operations.append(UpdateOne({"_id": before["_id"], **version_filter(version)}, [{"$set": stage}]))
+            targets.append(before)
+            seen.add(before["_id"])
+            changes[patient_id] = (before, {**before, **fields, "version": version + 1})
+
+        write_errors = await self._bulk_write(operations, "nMatched")
+        if write_errors is not None:
+            wanted = {changes[patient_id][0]["_id"]: changes[patient_id][1] for patient_id in changes}
+
+            def applied(before, current):
+                # Ours if the document now holds exactly the version and values we wrote
+                after = wanted[before["_id"]]
+                return current is not None and all(current.get(field) == after.get(field) for field in current)
+
+            failed = await self._unchanged(targets, write_errors, applied, {
+                field: 1 for _, fields, _ in items for field in fields
+            })
+            for patient_id, (before, _) in list(changes.items()):
+                if before["_id"] in failed:
+                    errors[patient_id] = failed[before["_id"]]
+                    del changes[patient_id]
+        return changes, errors
+
+    async def _bulk_write(self, operations, count_field):
+        # None when every operation took effect, else {operation index: error message}
+        if not operations:
+            return None
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+        errors = {error["index"]: error.get("errmsg", "write error") for error in details.get("writeErrors", [])}
+        if not errors and details.get(count_field, 0) == len(operations):
+            return None
+        return errors
+
+    async def _unchanged(self, targets, write_errors, applied, projection=None):
+        # {_id: error} for targeted documents the bulk write did not change: write
+        # errors, VersionConflict, or LookupError if the patient was deleted meanwhile
+        failed = {targets[index]["_id"]: Exception(message) for index, message in write_errors.items()}
+        current = {
+            document["_id"]: document
+            for document in await self.collection.find(
+                {"_id": {"$in": [document["_id"] for document in targets]}},
+                {"version": 1, **(projection or {})}
+            ).to_list(length=None)
+        }
+        for document in targets:
+            if document["_id"] in failed or applied(document, current.get(document["_id"])):
+                continue
+            latest = current.get(document["_id"])
+            if latest is None:
+                failed[document["_id"]] = LookupError("Patient not found")
+            else:
+                failed[document["_id"]] = VersionConflict(latest.get("version", 0))
+        return failed
+
+    async def delete(self, patient_id: str):
+        # Returns the deleted document, or None if the patient does not exist
+        return await self.collection.find_one_and_delete(
+            patient_filter(patient_id),
+            projection=SEARCH_PROJECTION
+        )
+
+
+def get_patient_repository(db=Depends(get_db)) -> PatientRepository:
+    return PatientRepository(db)
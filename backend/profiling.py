@@ -0,0 +1,276 @@
+from collections import Counter, deque
+from datetime import datetime
+from fastapi import HTTPException
+from auth_utils import resolve_principal, bearer_token
+from database import get_db
+import asyncio
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# On-demand request profiling. An admin request carrying "X-Profile: 1" (or
+# ?profile=1) runs under a sampling profiler, as does a random PROFILE_SAMPLE_RATE
+# fraction of all traffic. A background thread samples, every PROFILE_INTERVAL_MS,
+# where the request's task is: the live stack while it runs on the event loop, or
+# its chain of awaits while it is suspended. The result is a wall-clock call tree,
+# kept in memory for the last PROFILE_HISTORY requests of this worker.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", "50"))
+# Sampling stops after this long so a hung request cannot grow a profile without bound
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_FLAGS = ("profile=1", "profile=true")
+AWAIT_FRAME = "[await]"
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+FORMATS = ("folded", "tree")
+
+
+def frame_label(code):
+    filename = code.co_filename
+    if filename.startswith(BACKEND_DIR):
+        filename = filename[len(BACKEND_DIR):]
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def _coroutine_frames(coro):
+    # Frames of a suspended coroutine and everything it is awaiting, outermost first
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+def _thread_frames(frame, root):
+    # Live stack of the loop thread, trimmed to start at the task's own coroutine
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        if frame is root:
+            break
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class Profile:
+    def __init__(self, task, loop, thread_id, method, path, reason):
+        self.id = uuid.uuid4().hex[:16]
+        self.task = task
+        self.loop = loop
+        self.thread_id = thread_id
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.route = None
+        self.status = None
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.truncated = False
+        self.samples = 0
+        self.stacks = Counter()
+
+    def sample(self, thread_frames):
+        if self.duration is not None:
+            return False
+        if time.perf_counter() - self.started > PROFILE_MAX_SECONDS:
+            self.truncated = True
+            return False
+        coro = self.task.get_coro()
+        root = getattr(coro, "cr_frame", None)
+        if asyncio.current_task(self.loop) is self.task and self.thread_id in thread_frames:
+            frames = _thread_frames(thread_frames[self.thread_id], root)
+            stack = [frame_label(frame.f_code) for frame in frames]
+        else:
+            stack = [frame_label(frame.f_code) for frame in _coroutine_frames(coro)]
+            stack.append(AWAIT_FRAME)
+        self.stacks[";".join(stack)] += 1
+        self.samples += 1
+        return True
+
+    def finish(self, status, route):
+        self.status = status
+        self.route = route
+        self.duration = time.perf_counter() - self.started
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "samples": self.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "truncated": self.truncated
+        }
+
+    def folded(self):
+        # Collapsed stacks: the input format of flamegraph.pl and speedscope
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def tree(self, min_fraction=0.005):
+        root = {"count": 0, "children": {}}
+        for stack, count in self.stacks.items():
+            node = root
+            node["count"] += count
+            for label in stack.split(";"):
+                node = node["children"].setdefault(label, {"count": 0, "children": {}})
+                node["count"] += count
+
+        total = root["count"] or 1
+        lines = [f"{self.method} {self.path} -> {self.status} in {self.summary()['duration_ms']} ms, {self.samples} samples"]
+
+        def render(node, depth):
+            for label, child in sorted(node["children"].items(), key=lambda item: -item[1]["count"]):
+                if child["count"] / total < min_fraction:
+                    continue
+                lines.append(f"{child['count'] / total:7.1%} {child['count']:6d}  {'  ' * depth}{label}")
+                render(child, depth + 1)
+
+        render(root, 0)
+        return "\n".join(lines) + "\n"
+
+
+class StackSampler:
+    # One daemon thread samples every active profile; it exits when none are left
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                profiles = list(self._active)
+            frames = sys._current_frames()
+            for profile in profiles:
+                try:
+                    if not profile.sample(frames):
+                        self.remove(profile)
+                except Exception as e:
+                    # The sampled objects change under our feet; a bad sample is just skipped
+                    logger.debug("Skipped profile sample: %s", e)
+
+
+class ProfileStore:
+    def __init__(self, max_size):
+        self._profiles = deque(maxlen=max_size)
+
+    def add(self, profile):
+        self._profiles.appendleft(profile)
+
+    def list(self):
+        return [profile.summary() for profile in self._profiles]
+
+    def get(self, profile_id):
+        for profile in self._profiles:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+
+sampler = StackSampler(PROFILE_INTERVAL_MS / 1000)
+profile_store = ProfileStore(PROFILE_HISTORY)
+
+
+def _profile_requested(scope):
+    if any(value in PROFILE_QUERY_FLAGS for value in scope.get("query_string", b"").decode("latin-1").split("&")):
+        return True
+    return any(name == PROFILE_HEADER and value in (b"1", b"true") for name, value in scope.get("headers", ()))
+
+async def _is_admin(scope):
+    authorization = next((value for name, value in scope.get("headers", ()) if name == b"authorization"), None)
+    token = bearer_token(authorization.decode("latin-1") if authorization else None)
+    if not token:
+        return False
+    try:
+        principal = await resolve_principal(token, get_db())
+    except HTTPException:
+        return False
+    return principal.is_admin
+
+
+class ProfilingMiddleware:
+    # Plain ASGI middleware. Requests that are not profiled cost one header scan
+    # (and one random() call when PROFILE_SAMPLE_RATE is set).
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        reason = None
+        if _profile_requested(scope):
+            # The flag is ignored, not rejected, for anyone but an admin
+            if await _is_admin(scope):
+                reason = "requested"
+        elif PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            reason = "sampled"
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(
+            asyncio.current_task(), asyncio.get_running_loop(), threading.get_ident(),
+            scope["method"], scope["path"], reason
+        )
+        status = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile.id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            sampler.remove(profile)
+            route = getattr(scope.get("route"), "path", None)
+            profile.finish(status, route)
+            profile_store.add(profile)
+            logger.info(
+                "Profiled %s %s (%s): %d samples, id %s",
+                profile.method, profile.path, reason, profile.samples, profile.id
+            )
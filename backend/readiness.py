@@ -0,0 +1,73 @@
+from events import event_bus
+from suggest import suggest_index
+from patient_cache import patient_cache
+from pagination import PATIENT_SORT, count_patients
+from search import SEARCH_PROJECTION
+import database
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# /ready reports whether this worker should get traffic: warmed up, not shutting
+# down, and able to reach MongoDB right now. /health stays a static liveness check.
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "2"))
+# Most recent patients loaded into the patient cache at startup
+PATIENT_CACHE_WARM = int(os.getenv("PATIENT_CACHE_WARM", "100"))
+
+
+class Readiness:
+    def __init__(self):
+        self.warm = False
+        self.draining = False
+
+    async def warm_up(self, db):
+        # Runs in the lifespan startup, before the worker accepts connections.
+        # A failed step is logged and skipped: a cold worker still serves correctly.
+        try:
+            # Concurrent pings check out min_pool_size connections at once, so the
+            # first requests do not pay for the TCP and TLS handshakes
+            await asyncio.gather(*(db.command("ping") for _ in range(database.min_pool_size)))
+        except Exception as e:
+            logger.warning(f"Connection pool warm-up failed: {e}")
+        try:
+            await count_patients(db.patients, {}, "cached")
+            if PATIENT_CACHE_WARM > 0:
+                recent = await db.patients.find({}, SEARCH_PROJECTION) \
+                    .sort(PATIENT_SORT).limit(PATIENT_CACHE_WARM).to_list(length=PATIENT_CACHE_WARM)
+                for patient in recent:
+                    await patient_cache.fill(patient)
+        except Exception as e:
+            logger.warning(f"Cache warm-up failed: {e}")
+        try:
+            # Until it is built, suggestions are served from MongoDB
+            await suggest_index.build(db)
+        except Exception as e:
+            logger.warning(f"Suggest index build failed: {e}")
+        suggest_index.start(db)
+        self.warm = True
+        logger.info("Worker warmed up")
+
+    def begin_drain(self):
+        # First shutdown signal: fail /ready so the load balancer stops sending
+        # traffic, and end event streams so in-flight requests can finish
+        if not self.draining:
+            logger.info("Draining worker")
+        self.draining = True
+        event_bus.drain()
+
+    async def check(self):
+        if self.draining:
+            return False, {"status": "draining"}
+        if not self.warm or database.db is None:
+            return False, {"status": "starting"}
+        try:
+            await asyncio.wait_for(database.db.command("ping"), READY_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"Readiness ping failed: {e}")
+            return False, {"status": "unavailable", "database": "unreachable"}
+        return True, {"status": "ready", "database": "ok"}
+
+
+readiness = Readiness()
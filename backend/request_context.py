@@ -0,0 +1,90 @@
+from contextvars import ContextVar
+from typing import Optional
+import re
+import threading
+import uuid
+
+# Per-request bookkeeping carried in contextvars. Motor copies the context into
+# its executor threads, so anything running on behalf of a request sees it.
+
+# A client's X-Request-ID is kept if it looks like an id, otherwise one is generated
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+class RequestStats:
+    # db_commands, db_time and pool_wait are filled in by the pymongo listeners in
+    # metrics.py, which run on Motor's executor threads, hence the lock. Every
+    # command the driver sends is one round trip, wherever in the code it comes from.
+    __slots__ = ("db_commands", "db_time", "pool_wait", "_lock")
+
+    def __init__(self):
+        self.db_commands = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record_command(self, duration: float):
+        with self._lock:
+            self.db_commands += 1
+            self.db_time += duration
+
+    def record_pool_wait(self, duration: float):
+        with self._lock:
+            self.pool_wait += duration
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def request_id_from(scope) -> str:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-request-id":
+            value = value.decode("latin-1")
+            if REQUEST_ID_PATTERN.match(value):
+                return value
+            break
+    return uuid.uuid4().hex
+
+
+class RequestStatsMiddleware:
+    # Plain ASGI middleware: starts a fresh RequestStats for every HTTP request and
+    # reports the MongoDB round trips (X-DB-Round-Trips, also sent as X-DB-Commands)
+    # and the time spent in them. The headers count what ran before the response
+    # started: background tasks and the body of a streamed response are not in them.
+    # It also sets the request id that log records carry, echoed as X-Request-ID.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        request_id = request_id_from(scope)
+        token = _request_stats.set(stats)
+        id_token = _request_id.set(request_id)
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                round_trips = str(stats.db_commands).encode()
+                headers.append((b"x-db-round-trips", round_trips))
+                headers.append((b"x-db-commands", round_trips))
+                headers.append((b"x-db-time-ms", f"{stats.db_time * 1000:.2f}".encode()))
+                headers.append((b"x-request-id", request_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _request_id.reset(id_token)
+            _request_stats.reset(token)
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException, Depends
+from models import PatientAnalytics, MetricsSummary
+from database import get_db
+from auth_utils import require_principal, require_admin
+from analytics import get_analytics, get_summary, rebuild_rollups, DEFAULT_TOP_N
+import logging
+
+router = APIRouter(dependencies=[Depends(require_principal)])
+logger = logging.getLogger(__name__)
+
+@router.get("/analytics", response_model=PatientAnalytics)
+async def get_patient_analytics(top: int = DEFAULT_TOP_N, db=Depends(get_db)):
+    try:
+        return await get_analytics(db, top_n=max(1, min(top, 50)))
+    except Exception as e:
+        logger.error(f"Error fetching patient analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch analytics")
+
+@router.get("/metrics/summary", response_model=MetricsSummary)
+async def get_metrics_summary(db=Depends(get_db)):
+    try:
+        return await get_summary(db)
+    except Exception as e:
+        logger.error(f"Error fetching metrics summary: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch metrics summary")
+
+# Full-collection aggregations: admins only
+@router.post("/analytics/rebuild", dependencies=[Depends(require_admin)])
+async def rebuild_patient_analytics(db=Depends(get_db)):
+    try:
+        documents = await rebuild_rollups(db)
+        return {"message": "Analytics rebuilt successfully", "documents": documents}
+    except Exception as e:
+        logger.error(f"Error rebuilding patient analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rebuild analytics")
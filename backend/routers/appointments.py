@@ -0,0 +1,51 @@
+from fastapi import APIRouter, HTTPException, Depends
+from models import PaginatedAppointments
+from database import get_db
+from auth_utils import require_principal
+from appointments import find_appointments, date_range
+from pagination import MAX_PAGE_SIZE, InvalidCursor
+from serialization import FastJSONResponse
+import logging
+
+router = APIRouter(dependencies=[Depends(require_principal)])
+logger = logging.getLogger(__name__)
+
+@router.get("/", response_model=PaginatedAppointments)
+async def get_appointments(
+    department: str = None,
+    doctor: str = None,
+    patient_id: str = None,
+    day: str = None,
+    start: str = None,
+    end: str = None,
+    limit: int = 50,
+    cursor: str = None,
+    db=Depends(get_db)
+):
+    # e.g. ?department=Cardiology&day=2024-06-01 or ?doctor=Dr. Rao&start=2024-06-03&end=2024-06-10
+    try:
+        try:
+            range_start, range_end = date_range(start, end, day)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        try:
+            documents, next_cursor = await find_appointments(
+                db, range_start, range_end, department, doctor, patient_id, limit, cursor
+            )
+        except InvalidCursor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        for document in documents:
+            document["id"] = document.pop("_id")
+        return FastJSONResponse({
+            "appointments": documents,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        })
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error fetching appointments: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch appointments")
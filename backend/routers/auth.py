@@ -1,19 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
 from database import get_db
-from models import UserCreate, User, Token
+from models import UserCreate, User, Token, Principal
 from auth_utils import (
-    verify_password,
-    get_password_hash,
+    verify_password_async,
+    get_password_hash_async,
     create_access_token,
+    get_current_principal,
+    require_admin,
+    invalidate_user,
+    principal_cache_stats,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from password_hashing import password_hasher, HashingOverloaded
 from bson import ObjectId
 from datetime import datetime
+import logging
 
 router = APIRouter()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+logger = logging.getLogger(__name__)
+
+def hashing_unavailable(e: HashingOverloaded) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication service is busy, please retry shortly",
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 @router.post("/register", response_model=User)
 async def register(user: UserCreate):
@@ -34,7 +47,10 @@ async def register(user: UserCreate):
     
     # Create new user
     user_dict = user.model_dump()
-    user_dict["password"] = get_password_hash(user_dict["password"])
+    try:
+        user_dict["password"] = await get_password_hash_async(user_dict["password"])
+    except HashingOverloaded as e:
+        raise hashing_unavailable(e)
     user_dict["created_at"] = datetime.utcnow()
     user_dict["is_active"] = True
     
@@ -55,16 +71,48 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         ]
     })
     
-    if not user or not verify_password(form_data.password, user["password"]):
+    valid = False
+    if user:
+        try:
+            valid, new_hash = await verify_password_async(form_data.password, user["password"])
+        except HashingOverloaded as e:
+            raise hashing_unavailable(e)
+
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username/email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Transparently upgrade hashes created with a different bcrypt round count
+    if new_hash:
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+        logger.info("Rehashed password for user %s", user["username"])
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["username"]}, expires_delta=access_token_expires
     )
     
-    return {"access_token": access_token, "token_type": "bearer"} 
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/me", response_model=Principal)
+async def read_current_user(principal: Principal = Depends(get_current_principal)):
+    return principal
+
+@router.post("/deactivate")
+async def deactivate_current_user(principal: Principal = Depends(get_current_principal)):
+    db = get_db()
+    await db.users.update_one({"username": principal.username}, {"$set": {"is_active": False}})
+    # Cached principals for this user must not outlive the deactivation
+    invalidate_user(principal.username)
+    return {"message": "User deactivated successfully"}
+
+@router.get("/principal-cache/stats", dependencies=[Depends(require_admin)])
+async def principal_cache_statistics():
+    return principal_cache_stats()
+
+@router.get("/hashing/stats", dependencies=[Depends(require_admin)])
+async def hashing_stats():
+    return password_hasher.stats()
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from database import get_db
+from auth_utils import require_principal
+from bulk_io import import_patients, export_patients, detect_format, FORMATS, MEDIA_TYPES
+from datetime import datetime
+import logging
+
+router = APIRouter(dependencies=[Depends(require_principal)])
+logger = logging.getLogger(__name__)
+
+@router.post("/bulk")
+async def bulk_import_patients(request: Request, format: str = None, db=Depends(get_db)):
+    fmt = detect_format(request.headers.get("content-type"), format)
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    try:
+        return await import_patients(db, request.stream(), fmt)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Request body must be UTF-8 encoded")
+    except Exception as e:
+        logger.error(f"Error importing patients: {e}")
+        raise HTTPException(status_code=500, detail="Failed to import patients")
+
+@router.get("/export")
+async def export_all_patients(format: str = "ndjson", gender: str = None, db=Depends(get_db)):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    query = {}
+    if gender and gender != "all":
+        query["gender"] = gender
+
+    filename = f"patients-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{format}"
+    return StreamingResponse(
+        export_patients(db, query, format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
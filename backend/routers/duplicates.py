@@ -0,0 +1,41 @@
+from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from models import PatientCreate, PossibleDuplicates, DuplicateScan
+from database import get_db
+from auth_utils import require_principal, require_admin
+from duplicates import find_possible_duplicates, find_duplicate_clusters, POSSIBLE_DUPLICATE_SCORE, SCAN_CHUNKS
+from serialization import FastJSONResponse
+import logging
+
+router = APIRouter(dependencies=[Depends(require_principal)])
+logger = logging.getLogger(__name__)
+
+MAX_SCAN_CHUNKS = 16
+
+@router.post("/duplicates/check", response_model=PossibleDuplicates)
+async def check_duplicates(patient: PatientCreate, min_score: float = POSSIBLE_DUPLICATE_SCORE, db=Depends(get_db)):
+    # Existing patients that look like this one, without creating it
+    try:
+        matches = await find_possible_duplicates(db, patient.model_dump(), min_score)
+        return FastJSONResponse({"possible_duplicates": matches})
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error checking for duplicate patients: {e}")
+        raise HTTPException(status_code=500, detail="Failed to check for duplicate patients")
+
+@router.get("/duplicates", response_model=DuplicateScan, dependencies=[Depends(require_admin)])
+async def scan_duplicates(
+    min_score: float = POSSIBLE_DUPLICATE_SCORE,
+    chunks: Optional[int] = None,
+    db=Depends(get_db)
+):
+    # Clusters of likely duplicates across the whole collection
+    try:
+        chunks = max(1, min(chunks or SCAN_CHUNKS, MAX_SCAN_CHUNKS))
+        return FastJSONResponse(await find_duplicate_clusters(db, chunks, min_score))
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error scanning for duplicate patients: {e}")
+        raise HTTPException(status_code=500, detail="Failed to scan for duplicate patients")
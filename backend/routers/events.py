@@ -0,0 +1,50 @@
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from database import get_db
+from auth_utils import require_principal
+from analytics import get_summary
+from events import event_bus, format_event
+import logging
+
+router = APIRouter(dependencies=[Depends(require_principal)])
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop nginx and similar proxies from buffering the stream
+    "X-Accel-Buffering": "no"
+}
+RECONNECT_MS = 5000
+
+@router.get("/events")
+async def patient_events(request: Request, db=Depends(get_db)):
+    # Server-Sent Events: a "snapshot" of the dashboard summary, then deltas as
+    # patients change (see events.py). A client that reconnects with Last-Event-ID
+    # may have missed events, so it starts with a "resync".
+    subscription = event_bus.subscribe()
+    if subscription is None and event_bus.draining:
+        raise HTTPException(status_code=503, detail="Server is shutting down", headers={"Retry-After": "5"})
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many event streams open", headers={"Retry-After": "30"})
+    if request.headers.get("last-event-id"):
+        subscription.request_resync()
+
+    async def stream():
+        try:
+            yield b"retry: %d\n\n" % RECONNECT_MS
+            # Subscribed first, so nothing written while the snapshot is read is lost
+            yield format_event(event_bus.sequence, "snapshot", await get_summary(db))
+            while True:
+                events = await subscription.next_batch()
+                if subscription.closed:
+                    break
+                if events is None:
+                    yield b": keepalive\n\n"
+                    continue
+                yield b"".join(format_event(event_bus.sequence, event_type, payload) for event_type, payload in events)
+        except Exception as e:
+            logger.error(f"Patient event stream failed: {e}")
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=SSE_HEADERS)
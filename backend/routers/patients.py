@@ -1,39 +1,138 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import Response
+from typing import List, Union
 from datetime import datetime, timedelta
-from models import Patient, PatientCreate, PaginatedPatients
+from models import (
+    Patient,
+    PatientCreate,
+    PatientUpdate,
+    PatientPatched,
+    Prescription,
+    PrescriptionAdded,
+    Appointment,
+    AppointmentAdded,
+    PaginatedPatients,
+    PaginatedPatientSummaries,
+    PatientSummary,
+    BatchGetRequest,
+    BatchPatients,
+    BatchDeleteRequest,
+    BatchUpdateRequest,
+    BatchResult
+)
 from database import get_db
+from auth_utils import require_principal, require_admin
+from analytics import apply_patient_changes
+from appointments import apply_appointment_changes, insert_appointment, rename_patient
+from events import event_bus
+from etags import bump_change_counter, list_version, patient_etag, list_etag, body_etag, etag_matches, cache_headers, not_modified
+from pagination import (
+    PATIENT_SORT,
+    MAX_PAGE_SIZE,
+    COUNT_MODES,
+    InvalidCursor,
+    fetch_keyset_page,
+    count_patients,
+    count_cache
+)
+from search import build_search, ranked_search, SEARCH_PROJECTION, MAX_RANKED_CANDIDATES
+from patient_repository import PatientRepository, VersionConflict, get_patient_repository
+from serialization import FastJSONResponse, dumps
+from bson_json import read_collection, is_raw, response_documents
+from patient_cache import patient_cache
+from duplicates import find_possible_duplicates
 from bson import ObjectId
 from pymongo.errors import DuplicateKeyError
 import logging
+import os
 
-router = APIRouter()
+router = APIRouter(dependencies=[Depends(require_principal)])
 logger = logging.getLogger(__name__)
 
+LIST_VIEWS = ("full", "summary")
+DUPLICATE_MODES = ("ignore", "check")
+# PatientBase fields that a PATCH may change but not clear
+REQUIRED_FIELDS = ("name", "age", "gender", "phone")
+SUMMARY_PROJECTION = {field: 1 for field in PatientSummary.model_fields if field != "id"}
+# Fields batch-get can be limited to
+PATIENT_FIELDS = tuple(field for field in Patient.model_fields if field != "id")
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+async def record_patient_write(background_tasks: BackgroundTasks, db, old=None, new=None, complete=True):
+    await record_patient_writes(background_tasks, db, [(old, new)], complete)
+
+async def record_patient_writes(background_tasks: BackgroundTasks, db, changes, complete=True):
+    # Keep caches in step with patient writes, given as (old, new) pairs; rollups are
+    # updated after the response is sent. complete=False means the new versions are
+    # missing fields (partial writes) and must not be cached.
+    if not changes:
+        return
+    count_cache.clear()
+    # Before the response, so a list fetched after it never matches an older ETag
+    list_version.bump()
+    # Only the typeahead refresh reads the counter, and it polls; list ETags come
+    # from the response body, so the write does not wait for this round trip
+    background_tasks.add_task(bump_change_counter, db)
+    for old, new in changes:
+        if new is not None and complete:
+            await patient_cache.set(new)
+        elif old is not None:
+            await patient_cache.invalidate(old)
+    background_tasks.add_task(apply_patient_changes, db, changes)
+    event_bus.publish_patient_changes(changes)
+    # Partial writes that touch appointments or the name sync the copy themselves
+    synced = [(old, new) for old, new in changes if complete or new is None]
+    if synced:
+        background_tasks.add_task(apply_appointment_changes, db, synced)
+
+def version_conflict(e: VersionConflict) -> HTTPException:
+    return HTTPException(status_code=409, detail={"message": str(e), "version": e.current_version})
+
+def to_response(patient: dict) -> dict:
+    response = dict(patient)
+    # Convert ObjectId to string
+    response["id"] = str(response.pop("_id"))
+    # Convert datetime to ISO format string
+    if isinstance(response.get("created_at"), datetime):
+        response["created_at"] = response["created_at"].isoformat()
+    return response
+
 @router.post("/", response_model=Patient)
-async def create_patient(patient: PatientCreate, db=Depends(get_db)):
+async def create_patient(
+    patient: PatientCreate,
+    background_tasks: BackgroundTasks,
+    duplicates: str = "ignore",
+    repo: PatientRepository = Depends(get_patient_repository)
+):
     try:
+        if duplicates not in DUPLICATE_MODES:
+            raise HTTPException(status_code=400, detail=f"duplicates must be one of: {', '.join(DUPLICATE_MODES)}")
+
         # Create patient document
         patient_dict = patient.model_dump()
+
+        # duplicates=check refuses a patient that looks like an existing one;
+        # the client can show the matches and resubmit with duplicates=ignore
+        if duplicates == "check":
+            possible_duplicates = await find_possible_duplicates(repo.db, patient_dict)
+            if possible_duplicates:
+                raise HTTPException(status_code=409, detail={
+                    "message": "Possible duplicate patients found",
+                    "possible_duplicates": possible_duplicates
+                })
         
         # Get current time in IST (UTC+5:30)
         ist_time = datetime.utcnow() + timedelta(hours=5, minutes=30)
-        patient_dict["created_at"] = ist_time
-        
-        # Insert into database
-        result = await db.patients.insert_one(patient_dict)
+        # BSON dates keep milliseconds only; truncate so the response matches what is stored
+        patient_dict["created_at"] = ist_time.replace(microsecond=ist_time.microsecond // 1000 * 1000)
         
-        # Get the created patient
-        created_patient = await db.patients.find_one({"_id": result.inserted_id})
-        if created_patient:
-            # Convert ObjectId to string
-            created_patient["id"] = str(created_patient["_id"])
-            # Convert datetime to ISO format string
-            created_patient["created_at"] = created_patient["created_at"].isoformat()
-            return created_patient
-        else:
-            raise HTTPException(status_code=500, detail="Failed to retrieve created patient")
+        # Insert into database; the response is built from the inserted document
+        created_patient = await repo.create(patient_dict)
+        await record_patient_write(background_tasks, repo.db, new=created_patient)
+        return to_response(created_patient)
             
+    except HTTPException as he:
+        raise he
     except DuplicateKeyError as e:
         error_msg = str(e)
         if "phone" in error_msg:
@@ -55,141 +154,401 @@ async def create_patient(patient: PatientCreate, db=Depends(get_db)):
         logger.error(f"Error creating patient: {e}")
         raise HTTPException(status_code=500, detail="Failed to create patient")
 
-@router.get("/", response_model=PaginatedPatients)
+@router.get("/", response_model=Union[PaginatedPatients, PaginatedPatientSummaries])
 async def get_patients(
+    request: Request,
     search: str = "",
     page: int = 1,
     limit: int = 10,
     gender: str = None,
+    cursor: str = None,
+    mode: str = "offset",
+    count: str = "exact",
+    view: str = "full",
     db=Depends(get_db)
 ):
     try:
+        if view not in LIST_VIEWS:
+            raise HTTPException(status_code=400, detail="view must be 'full' or 'summary'")
+        if mode not in ("offset", "cursor"):
+            raise HTTPException(status_code=400, detail="mode must be 'offset' or 'cursor'")
+        if count not in COUNT_MODES:
+            raise HTTPException(status_code=400, detail=f"count must be one of: {', '.join(COUNT_MODES)}")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        page = max(1, page)
+
+        # Read before the page, so the ETag is never newer than the data it labels
+        version = list_version.current()
+        etag = list_etag(version, request.query_params) if version is not None else None
+        if etag and etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag)
+
         # Build search query
         query = {}
-        if search:
-            query["$or"] = [
-                {"name": {"$regex": search, "$options": "i"}},
-                {"_id": {"$regex": search, "$options": "i"}},
-                {"chronicConditions": {"$regex": search, "$options": "i"}}
-            ]
+        score = preferred = None
+        if search.strip():
+            search_filter, score, preferred = build_search(search)
+            query.update(search_filter)
         if gender and gender != "all":
             query["gender"] = gender
 
+        projection = SUMMARY_PROJECTION if view == "summary" else SEARCH_PROJECTION
+
         # Get total count for pagination
-        total = await db.patients.count_documents(query)
-        
-        # Get paginated results
-        skip = (page - 1) * limit
-        patients = []
-        async for patient in db.patients.find(query).skip(skip).limit(limit):
-            # Convert ObjectId to string
-            patient["id"] = str(patient["_id"])
-            # Convert datetime to ISO format string
-            if "created_at" in patient:
-                patient["created_at"] = patient["created_at"].isoformat()
-            patients.append(patient)
-            
-        return {
+        total, total_is_estimate = await count_patients(db.patients, query, count)
+
+        # Raw BSON documents when RAW_BSON_READS is on (see bson_json.py)
+        collection = read_collection(db.patients)
+        next_cursor = prev_cursor = None
+        ranked_candidate_limit = None
+        total_is_capped = False
+        if cursor or mode == "cursor":
+            # Keyset pagination: cost is independent of how deep we are
+            try:
+                documents, next_cursor, prev_cursor = await fetch_keyset_page(
+                    collection, query, limit, cursor=cursor, projection=projection
+                )
+            except InvalidCursor as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            # Get paginated results, ranked by relevance when searching by name/condition
+            skip = (page - 1) * limit
+            if score is not None:
+                documents = await ranked_search(collection, query, score, skip, limit, projection, preferred)
+                # Pages stop where the ranked candidates do, so total and total_pages must too
+                ranked_candidate_limit = MAX_RANKED_CANDIDATES
+                if total is not None and total > MAX_RANKED_CANDIDATES:
+                    total, total_is_capped = MAX_RANKED_CANDIDATES, True
+            else:
+                documents = await collection.find(query, projection) \
+                    .sort(PATIENT_SORT).skip(skip).limit(limit).to_list(length=limit)
+            if total is not None:
+                has_more = skip + len(documents) < total
+            else:
+                has_more = len(documents) == limit
+
+        if is_raw(documents):
+            patients = response_documents(documents)
+        else:
+            patients = [to_response(patient) for patient in documents]
+
+        if cursor or mode == "cursor":
+            has_more = next_cursor is not None
+
+        # Documents are already in response shape: skip response-model re-validation
+        body = dumps({
             "patients": patients,
             "total": total,
             "page": page,
-            "total_pages": (total + limit - 1) // limit
-        }
+            "total_pages": (total + limit - 1) // limit if total is not None else None,
+            "total_is_estimate": total_is_estimate,
+            "total_is_capped": total_is_capped,
+            "ranked_candidate_limit": ranked_candidate_limit,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor,
+            "has_more": has_more
+        })
+        if etag is None:
+            etag = body_etag(body)
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return not_modified(etag)
+        return Response(body, media_type="application/json", headers=cache_headers(etag))
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error fetching patients: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch patients")
 
+@router.get("/cache/stats", dependencies=[Depends(require_admin)])
+async def get_patient_cache_stats():
+    return patient_cache.stats()
+
+def batch_ids(ids: List[str]) -> List[str]:
+    # Requested ids without repeats, in request order
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} patients per batch")
+    return ids
+
+def batch_failure(patient_id: str, error: Exception) -> dict:
+    if isinstance(error, VersionConflict):
+        return {"id": patient_id, "status": "conflict", "version": error.current_version, "detail": str(error)}
+    if isinstance(error, LookupError):
+        return {"id": patient_id, "status": "not_found", "detail": "Patient not found"}
+    return {"id": patient_id, "status": "error", "detail": str(error)}
+
+def batch_response(results: List[dict]) -> FastJSONResponse:
+    succeeded = sum(result["status"] in ("updated", "deleted") for result in results)
+    return FastJSONResponse({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded})
+
+@router.post("/batch-get", response_model=BatchPatients)
+async def batch_get_patients(batch: BatchGetRequest, repo: PatientRepository = Depends(get_patient_repository)):
+    # Several patients in one $in query, in the order asked for
+    try:
+        ids = batch_ids(batch.ids)
+        projection = SEARCH_PROJECTION
+        if batch.fields is not None:
+            unknown = [field for field in batch.fields if field not in PATIENT_FIELDS]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+            projection = {field: 1 for field in batch.fields}
+        found = await repo.get_many(ids, projection) if ids else {}
+        return FastJSONResponse({
+            "patients": [to_response(found[patient_id]) for patient_id in ids if patient_id in found],
+            "missing": [patient_id for patient_id in ids if patient_id not in found]
+        })
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error fetching patient batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to fetch patients")
+
+@router.post("/batch-update", response_model=BatchResult)
+async def batch_update_patients(
+    batch: BatchUpdateRequest,
+    background_tasks: BackgroundTasks,
+    repo: PatientRepository = Depends(get_patient_repository)
+):
+    # PATCH semantics per patient (optional version check), one bulk_write for all
+    try:
+        if len(batch.patients) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_ITEMS} patients per batch")
+        items, results, seen = [], [], set()
+        for patient in batch.patients:
+            update_data = patient.model_dump(exclude_unset=True)
+            patient_id = update_data.pop("id")
+            expected_version = update_data.pop("version", None)
+            cleared = [field for field in REQUIRED_FIELDS if field in update_data and update_data[field] is None]
+            if patient_id in seen:
+                results.append({"id": patient_id, "status": "invalid", "detail": "Patient appears more than once in the batch"})
+                continue
+            seen.add(patient_id)
+            if not update_data:
+                results.append({"id": patient_id, "status": "invalid", "detail": "No fields to update"})
+            elif cleared:
+                results.append({"id": patient_id, "status": "invalid", "detail": f"Fields cannot be null: {', '.join(cleared)}"})
+            else:
+                items.append((patient_id, update_data, expected_version))
+                # Filled in once the write is done
+                results.append({"id": patient_id})
+
+        changes, errors = await repo.patch_many(items) if items else ({}, {})
+        for result in results:
+            patient_id = result["id"]
+            if "status" in result:
+                continue
+            if patient_id in changes:
+                result.update(status="updated", version=changes[patient_id][1]["version"])
+            elif patient_id in errors:
+                result.update(batch_failure(patient_id, errors[patient_id]))
+            else:
+                result.update(status="not_found", detail="Patient not found")
+
+        # Neither version carries the history arrays, so cache entries are dropped rather than replaced
+        await record_patient_writes(background_tasks, repo.db, list(changes.values()), complete=False)
+        for existing_patient, updated_patient in changes.values():
+            if updated_patient.get("name") != existing_patient.get("name"):
+                background_tasks.add_task(rename_patient, repo.db, existing_patient["_id"], updated_patient["name"])
+        return batch_response(results)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error updating patient batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to update patients")
+
+@router.post("/batch-delete", response_model=BatchResult)
+async def batch_delete_patients(
+    batch: BatchDeleteRequest,
+    background_tasks: BackgroundTasks,
+    repo: PatientRepository = Depends(get_patient_repository)
+):
+    try:
+        ids = batch_ids(batch.ids)
+        deleted, errors = await repo.delete_many(ids) if ids else ({}, {})
+
+        results = []
+        for patient_id in ids:
+            if patient_id in deleted:
+                results.append({"id": patient_id, "status": "deleted"})
+            elif patient_id in errors:
+                results.append(batch_failure(patient_id, errors[patient_id]))
+            else:
+                results.append({"id": patient_id, "status": "not_found", "detail": "Patient not found"})
+
+        # A patient asked for by both its ObjectId and legacy id is one change
+        patients = {patient["_id"]: patient for patient in deleted.values()}
+        await record_patient_writes(background_tasks, repo.db, [(patient, None) for patient in patients.values()])
+        logger.info("Batch delete: %d of %d patients deleted", len(patients), len(ids))
+        return batch_response(results)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error deleting patient batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to delete patients")
+
 @router.get("/{patient_id}", response_model=Patient)
-async def get_patient(patient_id: str, db=Depends(get_db)):
+async def get_patient(patient_id: str, request: Request, repo: PatientRepository = Depends(get_patient_repository)):
     try:
-        patient = await db.patients.find_one({"id": patient_id})
-        if not patient:
-            raise HTTPException(status_code=404, detail="Patient not found")
-        # Convert ObjectId to string
-        patient["id"] = str(patient.pop("_id"))
-        return patient
+        patient = await patient_cache.get(patient_id)
+        if patient is None:
+            patient = await repo.get(patient_id)
+            if not patient:
+                raise HTTPException(status_code=404, detail="Patient not found")
+            await patient_cache.fill(patient)
+        etag = patient_etag(patient)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag)
+        # to_response copies, so the cached document is left untouched
+        return FastJSONResponse(to_response(patient), headers=cache_headers(etag))
+    except HTTPException as he:
+        raise he
     except Exception as e:
         logger.error(f"Error fetching patient: {e}")
         raise HTTPException(status_code=500, detail="Failed to fetch patient")
 
 @router.delete("/{patient_id}")
-async def delete_patient(patient_id: str, db=Depends(get_db)):
+async def delete_patient(
+    patient_id: str,
+    background_tasks: BackgroundTasks,
+    repo: PatientRepository = Depends(get_patient_repository)
+):
     try:
-        logger.info(f"Attempting to delete patient with ID: {patient_id}")
-        
-        # Try to find the patient by _id first
-        try:
-            object_id = ObjectId(patient_id)
-            patient = await db.patients.find_one({"_id": object_id})
-        except:
-            # If ObjectId conversion fails, try finding by id field
-            patient = await db.patients.find_one({"id": patient_id})
-        
+        # Find and delete in a single round trip
+        patient = await repo.delete(patient_id)
         if not patient:
-            logger.warning(f"Patient not found with ID: {patient_id}")
             raise HTTPException(status_code=404, detail="Patient not found")
 
-        # Delete the patient using the correct ID
-        if "_id" in patient:
-            result = await db.patients.delete_one({"_id": patient["_id"]})
-        else:
-            result = await db.patients.delete_one({"id": patient_id})
-            
-        logger.info(f"Delete operation result: {result.raw_result}")
-        
-        if result.deleted_count == 0:
-            logger.warning(f"No patient was deleted with ID: {patient_id}")
-            raise HTTPException(status_code=404, detail="Patient not found")
-            
-        logger.info(f"Successfully deleted patient with ID: {patient_id}")
+        await record_patient_write(background_tasks, repo.db, old=patient)
+
+        # Formatted by the log writer thread, not here (see logging_config.py)
+        logger.info("Deleted patient %s", patient_id)
         return {"message": "Patient deleted successfully"}
     except HTTPException as he:
-        logger.error(f"HTTP error while deleting patient: {str(he)}")
         raise he
     except Exception as e:
         logger.error(f"Unexpected error deleting patient: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/{patient_id}/", response_model=Patient)
-async def update_patient(patient_id: str, patient: PatientCreate, db=Depends(get_db)):
+async def update_patient(
+    patient_id: str,
+    patient: PatientCreate,
+    background_tasks: BackgroundTasks,
+    repo: PatientRepository = Depends(get_patient_repository)
+):
     try:
-        # Convert patient_id to ObjectId
-        try:
-            object_id = ObjectId(patient_id)
-        except:
+        if not ObjectId.is_valid(patient_id):
             raise HTTPException(status_code=400, detail="Invalid patient ID format")
 
-        # Check if patient exists
-        existing_patient = await db.patients.find_one({"_id": object_id})
-        if not existing_patient:
-            raise HTTPException(status_code=404, detail="Patient not found")
-
         # Prepare update data
         update_data = patient.model_dump()
-        
-        # Update the patient
-        result = await db.patients.update_one(
-            {"_id": object_id},
-            {"$set": update_data}
-        )
 
-        if result.modified_count == 0:
+        # Update the patient, getting the previous version back in the same round trip
+        existing_patient, updated_patient = await repo.update(patient_id, update_data)
+        if not existing_patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+
+        # Nothing was written, so the version, cache and ETag are all still current
+        if updated_patient is None:
             raise HTTPException(status_code=400, detail="No changes were made")
 
-        # Get the updated patient
-        updated_patient = await db.patients.find_one({"_id": object_id})
-        if updated_patient:
-            # Convert ObjectId to string
-            updated_patient["id"] = str(updated_patient["_id"])
-            # Convert datetime to ISO format string
-            if "created_at" in updated_patient:
-                updated_patient["created_at"] = updated_patient["created_at"].isoformat()
-            return updated_patient
-        else:
-            raise HTTPException(status_code=500, detail="Failed to retrieve updated patient")
+        await record_patient_write(background_tasks, repo.db, old=existing_patient, new=updated_patient)
+        return to_response(updated_patient)
 
     except HTTPException as he:
         raise he
     except Exception as e:
         logger.error(f"Error updating patient: {e}")
-        raise HTTPException(status_code=500, detail="Failed to update patient") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to update patient")
+
+@router.patch("/{patient_id}", response_model=PatientPatched)
+async def patch_patient(
+    patient_id: str,
+    patient: PatientUpdate,
+    background_tasks: BackgroundTasks,
+    repo: PatientRepository = Depends(get_patient_repository)
+):
+    try:
+        update_data = patient.model_dump(exclude_unset=True)
+        expected_version = update_data.pop("version", None)
+        if not update_data:
+            raise HTTPException(status_code=400, detail="No fields to update")
+        cleared = [field for field in REQUIRED_FIELDS if field in update_data and update_data[field] is None]
+        if cleared:
+            raise HTTPException(status_code=400, detail=f"Fields cannot be null: {', '.join(cleared)}")
+
+        try:
+            existing_patient, updated_patient = await repo.patch(patient_id, update_data, expected_version)
+        except VersionConflict as e:
+            raise version_conflict(e)
+        if not existing_patient:
+            raise HTTPException(status_code=404, detail="Patient not found")
+
+        # Neither version carries the history arrays, so the cache entry is dropped rather than replaced
+        await record_patient_write(background_tasks, repo.db, old=existing_patient, new=updated_patient, complete=False)
+        if "name" in update_data and update_data["name"] != existing_patient.get("name"):
+            background_tasks.add_task(rename_patient, repo.db, existing_patient["_id"], update_data["name"])
+        return FastJSONResponse({
+            "id": str(existing_patient["_id"]),
+            "version": updated_patient["version"],
+            **update_data
+        })
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error patching patient: {e}")
+        raise HTTPException(status_code=500, detail="Failed to update patient")
+
+async def append_history_entry(repo, background_tasks, patient_id, field, entry, expected_version):
+    try:
+        before = await repo.append(patient_id, field, entry, expected_version)
+    except VersionConflict as e:
+        raise version_conflict(e)
+    if before is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    # before only holds the history dates; everything else is identical on both
+    # sides, so the rollup delta comes down to the appended entry
+    version = before.get("version", 0) + 1
+    after = {**before, field: (before.get(field) or []) + [entry], "version": version}
+    await record_patient_write(background_tasks, repo.db, old=before, new=after, complete=False)
+    if field == "appointments":
+        # The entry was pushed onto the end of the array
+        background_tasks.add_task(insert_appointment, repo.db, before, len(before.get(field) or []), entry)
+    return {"id": str(before["_id"]), "version": version}
+
+@router.post("/{patient_id}/prescriptions", response_model=PrescriptionAdded)
+async def add_prescription(
+    patient_id: str,
+    prescription: Prescription,
+    background_tasks: BackgroundTasks,
+    version: int = None,
+    repo: PatientRepository = Depends(get_patient_repository)
+):
+    try:
+        entry = prescription.model_dump()
+        result = await append_history_entry(repo, background_tasks, patient_id, "prescriptions", entry, version)
+        return FastJSONResponse({**result, "prescription": entry})
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error adding prescription: {e}")
+        raise HTTPException(status_code=500, detail="Failed to add prescription")
+
+@router.post("/{patient_id}/appointments", response_model=AppointmentAdded)
+async def add_appointment(
+    patient_id: str,
+    appointment: Appointment,
+    background_tasks: BackgroundTasks,
+    version: int = None,
+    repo: PatientRepository = Depends(get_patient_repository)
+):
+    try:
+        entry = appointment.model_dump()
+        result = await append_history_entry(repo, background_tasks, patient_id, "appointments", entry, version)
+        return FastJSONResponse({**result, "appointment": entry})
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error adding appointment: {e}")
+        raise HTTPException(status_code=500, detail="Failed to add appointment")
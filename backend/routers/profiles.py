@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import PlainTextResponse
+from auth_utils import require_admin
+from profiling import profile_store, FORMATS
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/")
+async def list_profiles():
+    return profile_store.list()
+
+@router.get("/{profile_id}")
+async def download_profile(profile_id: str, format: str = "tree"):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    # folded stacks open directly in speedscope or feed flamegraph.pl
+    content = profile.folded() if format == "folded" else profile.tree()
+    return PlainTextResponse(
+        content,
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.{format}.txt"'}
+    )
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException, Depends
+from models import PatientSuggestions
+from database import get_db
+from auth_utils import require_principal
+from suggest import suggest_index, suggest_from_database, SUGGEST_LIMIT, MAX_SUGGEST_LIMIT
+from serialization import FastJSONResponse
+import logging
+
+router = APIRouter(dependencies=[Depends(require_principal)])
+logger = logging.getLogger(__name__)
+
+@router.get("/suggest", response_model=PatientSuggestions)
+async def suggest_patients(q: str = "", limit: int = SUGGEST_LIMIT, db=Depends(get_db)):
+    # Typeahead over names, phone numbers and IDs, e.g. ?q=ravi k or ?q=98765
+    try:
+        limit = max(1, min(limit, MAX_SUGGEST_LIMIT))
+        if not q.strip():
+            return FastJSONResponse({"suggestions": []})
+        if suggest_index.ready and suggest_index.complete:
+            suggestions = suggest_index.suggest(q, limit)
+        else:
+            suggestions = await suggest_from_database(db, q, limit)
+        return FastJSONResponse({"suggestions": suggestions})
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Error suggesting patients: {e}")
+        raise HTTPException(status_code=500, detail="Failed to suggest patients")
@@ -0,0 +1,167 @@
+from bson import ObjectId
+import logging
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Patients carry two derived fields maintained on every write:
+#   search_name - the normalized name, used for exact/starts-with ranking
+#   search_keys - namespaced edge n-grams behind the patient_search_keys index:
+#                 "n:" name token prefixes, "w:" whole name tokens,
+#                 "c:" chronic condition token prefixes, "p:" phone digit prefixes
+# Duplicate detection keeps three more (dedup_*, see duplicates.py). None of
+# them are part of patient responses.
+SEARCH_PROJECTION = {"search_keys": 0, "search_name": 0, "dedup_keys": 0, "dedup_name": 0, "dedup_dob": 0}
+
+MAX_PREFIX_LENGTH = 15
+MIN_PHONE_PREFIX = 3
+NATIONAL_NUMBER_LENGTH = 10
+MAX_QUERY_TOKENS = 5
+# Ranking is done over at most this many index matches so latency stays bounded.
+# Matches on whole name words are taken first and prefix matches fill the rest,
+# so a broad query still ranks its strongest matches; past the cap the list
+# reports total as this many and sets total_is_capped.
+MAX_RANKED_CANDIDATES = 1000
+
+_OBJECT_ID = re.compile(r"^[0-9a-fA-F]{24}$")
+_PHONE = re.compile(r"^\+?[\d\s\-().]+$")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text):
+    if not isinstance(text, str):
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", text.lower()).strip()
+
+def tokenize(text):
+    return normalize(text).split()
+
+def phone_digits(phone):
+    return re.sub(r"\D", "", phone) if isinstance(phone, str) else ""
+
+def edge_ngrams(token, min_length=1):
+    return [token[:i] for i in range(min_length, min(len(token), MAX_PREFIX_LENGTH) + 1)]
+
+# Source field -> namespaces of the search_keys derived from it
+SEARCH_KEY_SOURCES = {"name": ("w:", "n:"), "chronicConditions": ("c:",), "phone": ("p:",)}
+
+def field_search_keys(field, value):
+    keys = set()
+    if field == "name":
+        for token in tokenize(value):
+            keys.add(f"w:{token}")
+            keys.update(f"n:{prefix}" for prefix in edge_ngrams(token))
+    elif field == "chronicConditions":
+        for token in tokenize(value):
+            keys.update(f"c:{prefix}" for prefix in edge_ngrams(token))
+    elif field == "phone":
+        digits = phone_digits(value)
+        # Index the national number too so "98765..." finds "+91 98765..."
+        for number in {digits, digits[-NATIONAL_NUMBER_LENGTH:]} if digits else ():
+            keys.update(f"p:{prefix}" for prefix in edge_ngrams(number, MIN_PHONE_PREFIX))
+    return keys
+
+def search_fields(patient):
+    keys = set()
+    for field in SEARCH_KEY_SOURCES:
+        keys.update(field_search_keys(field, patient.get(field)))
+    return {
+        "search_name": normalize(patient.get("name")),
+        "search_keys": sorted(keys)
+    }
+
+def search_fields_update(fields):
+    # Aggregation expressions for an update pipeline $set stage that refresh the
+    # derived fields when only some of the source fields change: keys from the
+    # untouched sources are kept, keys from the changed ones are replaced.
+    changed = [field for field in SEARCH_KEY_SOURCES if field in fields]
+    if not changed:
+        return {}
+    stale = [namespace for field in changed for namespace in SEARCH_KEY_SOURCES[field]]
+    keys = set()
+    for field in changed:
+        keys.update(field_search_keys(field, fields[field]))
+    update = {
+        "search_keys": {
+            "$concatArrays": [
+                {"$filter": {
+                    "input": {"$ifNull": ["$search_keys", []]},
+                    "cond": {"$not": [{"$in": [{"$substrCP": ["$$this", 0, 2]}, stale]}]}
+                }},
+                {"$literal": sorted(keys)}
+            ]
+        }
+    }
+    if "name" in fields:
+        update["search_name"] = {"$literal": normalize(fields["name"])}
+    return update
+
+def build_search(search):
+    # Returns (filter, score expression, preferred filter). The score expression
+    # is None when ranking is pointless (exact ID and phone lookups); the
+    # preferred filter picks the matches ranked_search takes candidates from first.
+    search = search.strip()
+    if _OBJECT_ID.match(search):
+        return {"$or": [{"_id": ObjectId(search)}, {"id": search}]}, None, None
+
+    digits = phone_digits(search)
+    if _PHONE.match(search) and len(digits) >= MIN_PHONE_PREFIX:
+        return {"search_keys": f"p:{digits[:MAX_PREFIX_LENGTH]}"}, None, None
+
+    tokens = tokenize(search)[:MAX_QUERY_TOKENS]
+    if not tokens:
+        # Nothing searchable (e.g. only punctuation): match nothing rather than everything
+        return {"search_keys": {"$in": []}}, None, None
+
+    # Every token has to prefix-match either a name token or a condition token
+    prefixes = [token[:MAX_PREFIX_LENGTH] for token in tokens]
+    search_filter = {
+        "$and": [{"search_keys": {"$in": [f"n:{p}", f"c:{p}"]}} for p in prefixes]
+    } if len(prefixes) > 1 else {"search_keys": {"$in": [f"n:{prefixes[0]}", f"c:{prefixes[0]}"]}}
+
+    phrase = " ".join(tokens)
+    score = {"$add": [
+        {"$cond": [{"$eq": ["$search_name", phrase]}, 10, 0]},
+        {"$cond": [{"$eq": [{"$indexOfCP": [{"$ifNull": ["$search_name", ""]}, phrase]}, 0]}, 4, 0]}
+    ] + [
+        {"$cond": [{"$in": [f"{namespace}:{p}", {"$ifNull": ["$search_keys", []]}]}, weight, 0]}
+        for p in prefixes
+        for namespace, weight in (("w", 3), ("n", 2), ("c", 1))
+    ]}
+    # Every token a whole name word: includes the exact and phrase matches
+    preferred = {"search_keys": {"$all": [f"w:{p}" for p in prefixes]}}
+    return search_filter, score, preferred
+
+def candidate_stages(collection, query, preferred):
+    # Up to MAX_RANKED_CANDIDATES matches, preferred ones first. Both sides of
+    # the $unionWith are indexed and limited, and the whole thing is one command.
+    if preferred is None:
+        return [{"$match": query}, {"$limit": MAX_RANKED_CANDIDATES}]
+    return [
+        {"$match": {"$and": [query, preferred]}},
+        {"$limit": MAX_RANKED_CANDIDATES},
+        {"$addFields": {"_tier": 0}},
+        {"$unionWith": {"coll": collection.name, "pipeline": [
+            {"$match": {"$and": [query, {"$nor": [preferred]}]}},
+            {"$limit": MAX_RANKED_CANDIDATES},
+            {"$addFields": {"_tier": 1}}
+        ]}},
+        {"$sort": {"_tier": 1}},
+        {"$limit": MAX_RANKED_CANDIDATES}
+    ]
+
+async def ranked_search(collection, query, score, skip, limit, projection=SEARCH_PROJECTION, preferred=None):
+    if not any(projection.values()):
+        # Exclusion projection: also drop the computed fields
+        projection = dict(projection, _score=0, _tier=0)
+    pipeline = candidate_stages(collection, query, preferred) + [
+        {"$addFields": {"_score": score}},
+        {"$sort": {"_score": -1, "created_at": -1, "_id": -1}},
+        {"$skip": skip},
+        {"$limit": limit},
+        {"$project": projection}
+    ]
+    return await collection.aggregate(pipeline).to_list(length=limit)
@@ -0,0 +1,251 @@
+from bisect import bisect_left, insort
+from itertools import islice
+from search import normalize, tokenize, phone_digits, build_search, ranked_search, NATIONAL_NUMBER_LENGTH
+from etags import change_counter
+from events import event_bus
+import asyncio
+import heapq
+import logging
+import os
+import re
+import time
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:  # sortedcontainers is optional; a bisect-maintained list is the fallback
+    SortedList = None
+
+logger = logging.getLogger(__name__)
+
+# Per-worker prefix index behind GET /api/patients/suggest (typeahead). A sorted
+# array of (key, patient id) entries:
+#   "n:" the normalized name starting at each token ("ravi kumar", "kumar")
+#   "p:" phone digits, and the national number alone
+#   "i:" the ObjectId and legacy "id"
+# A prefix lookup is a bisect plus a short scan, so suggestions never touch MongoDB.
+# Built during worker warm-up and kept current from patient events (see events.py);
+# with EVENTS_SOURCE=changestream that includes other workers' writes. Otherwise
+# the index is rebuilt when the shared change counter moves, every
+# SUGGEST_REFRESH_SECONDS. Past SUGGEST_MAX_PATIENTS patients it stops growing
+# and suggestions fall back to a database search.
+SUGGEST_MAX_PATIENTS = int(os.getenv("SUGGEST_MAX_PATIENTS", "200000"))
+# Only needed when several workers or instances write; 0 turns the refresh off
+SUGGEST_REFRESH_SECONDS = float(os.getenv(
+    "SUGGEST_REFRESH_SECONDS", "60" if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 else "0"
+))
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 25
+# Entries looked at per key range before ranking, so a one-letter query stays cheap
+SCAN_LIMIT = 200
+MIN_PHONE_QUERY = 2
+BUILD_BATCH_SIZE = 5000
+PROJECTION = {"name": 1, "phone": 1, "id": 1}
+
+# Rank of a match, lower is better
+FULL_NAME, NAME_TOKEN, PHONE, ID = range(4)
+
+_ID_LIKE = re.compile(r"^([0-9a-f]+|.*[0-9].*)$")
+
+
+def patient_keys(patient):
+    # (keys, full-name key)
+    keys = set()
+    tokens = tokenize(patient.get("name"))
+    for i in range(len(tokens)):
+        keys.add("n:" + " ".join(tokens[i:]))
+    digits = phone_digits(patient.get("phone"))
+    if digits:
+        keys.add("p:" + digits)
+        keys.add("p:" + digits[-NATIONAL_NUMBER_LENGTH:])
+    keys.add("i:" + str(patient["_id"]).lower())
+    if isinstance(patient.get("id"), str) and patient["id"]:
+        keys.add("i:" + normalize(patient["id"]).replace(" ", ""))
+    return keys, "n:" + " ".join(tokens)
+
+def query_prefixes(query):
+    # (namespace prefix, rank) pairs to look up for a typed query
+    prefixes = []
+    name = normalize(query)
+    if name:
+        prefixes.append(("n:" + name, NAME_TOKEN))
+        compact = name.replace(" ", "")
+        # IDs are hex ObjectIds or codes with digits; plain words skip that range
+        if _ID_LIKE.match(compact):
+            prefixes.append(("i:" + compact, ID))
+    digits = phone_digits(query)
+    if len(digits) >= MIN_PHONE_QUERY and len(digits) * 2 >= len(query.replace(" ", "")):
+        prefixes.append(("p:" + digits, PHONE))
+    return prefixes
+
+
+class _SortedEntries:
+    def __init__(self, entries=()):
+        entries = sorted(entries)
+        self._items = SortedList(entries) if SortedList is not None else entries
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, entry):
+        if SortedList is not None:
+            self._items.add(entry)
+        else:
+            insort(self._items, entry)
+
+    def discard(self, entry):
+        if SortedList is not None:
+            self._items.discard(entry)
+            return
+        i = bisect_left(self._items, entry)
+        if i < len(self._items) and self._items[i] == entry:
+            del self._items[i]
+
+    def prefixed(self, prefix, limit):
+        # Up to limit entries whose key starts with prefix, in key order
+        if SortedList is not None:
+            return list(islice(self._items.irange((prefix,), (prefix + "\uffff",), inclusive=(True, False)), limit))
+        start = bisect_left(self._items, (prefix,))
+        end = bisect_left(self._items, (prefix + "\uffff",), start)
+        return self._items[start:min(end, start + limit)]
+
+
+class SuggestIndex:
+    def __init__(self, max_patients=SUGGEST_MAX_PATIENTS):
+        self.max_patients = max_patients
+        self.ready = False
+        self.complete = False
+        self.built_at_counter = None
+        self._entries = _SortedEntries()
+        # id -> (name, phone, legacy id, keys, full-name key) of indexed patients
+        self._patients = {}
+        self._pending = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._patients)
+
+    def _add(self, patient):
+        pid = str(patient["_id"])
+        keys, full_name = patient_keys(patient)
+        self._patients[pid] = (patient.get("name"), patient.get("phone"), patient.get("id"), keys, full_name)
+        for key in keys:
+            self._entries.add((key, pid))
+
+    def upsert(self, patient):
+        if self._pending is not None:
+            self._pending.append((None, patient))
+        pid = str(patient["_id"])
+        current = self._patients.get(pid)
+        if current is None and len(self._patients) >= self.max_patients:
+            self.complete = False
+            return
+        if current is not None:
+            name, phone, legacy_id, keys, _ = current
+            # Partial writes only carry the fields they changed
+            patient = {"name": name, "phone": phone, "id": legacy_id, **patient}
+            for key in keys:
+                self._entries.discard((key, pid))
+        self._add(patient)
+
+    def remove(self, patient):
+        if self._pending is not None:
+            self._pending.append((patient, None))
+        pid = str(patient["_id"])
+        current = self._patients.pop(pid, None)
+        if current is not None:
+            for key in current[3]:
+                self._entries.discard((key, pid))
+
+    def apply_changes(self, changes):
+        # Event bus listener; changes are (old, new) patient versions
+        for old, new in changes:
+            if new is not None:
+                self.upsert(new)
+            elif old is not None:
+                self.remove(old)
+
+    async def build(self, db):
+        started = time.perf_counter()
+        counter = await change_counter(db)
+        # Writes applied while the cursor runs are replayed onto the new index
+        self._pending = []
+        try:
+            entries, patients, complete = [], {}, True
+            async for patient in db.patients.find({}, PROJECTION, batch_size=BUILD_BATCH_SIZE):
+                if len(patients) >= self.max_patients:
+                    complete = False
+                    break
+                pid = str(patient["_id"])
+                keys, full_name = patient_keys(patient)
+                patients[pid] = (patient.get("name"), patient.get("phone"), patient.get("id"), keys, full_name)
+                entries.extend((key, pid) for key in keys)
+            pending, self._pending = self._pending, None
+        except Exception:
+            self._pending = None
+            raise
+        self._entries = _SortedEntries(entries)
+        self._patients = patients
+        self.complete = complete
+        self.apply_changes(pending)
+        self.built_at_counter = counter
+        self.ready = True
+        logger.info(
+            f"Suggest index built: {len(patients)} patients, {len(self._entries)} keys "
+            f"in {(time.perf_counter() - started) * 1000:.0f} ms" + ("" if complete else " (capped)")
+        )
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        candidates = {}
+        for prefix, rank in query_prefixes(query):
+            for key, pid in self._entries.prefixed(prefix, SCAN_LIMIT):
+                name, phone, _, _, full_name = self._patients[pid]
+                if rank == NAME_TOKEN and key == full_name:
+                    match = FULL_NAME
+                else:
+                    match = rank
+                # Exact matches first, then shorter keys (closer to what was typed)
+                score = (match, len(key) != len(prefix), len(key), key)
+                if pid not in candidates or score < candidates[pid][0]:
+                    candidates[pid] = (score, name, phone)
+        best = heapq.nsmallest(limit, candidates.items(), key=lambda item: item[1][0])
+        return [{"id": pid, "name": name, "phone": phone} for pid, (_, name, phone) in best]
+
+    def start(self, db):
+        if SUGGEST_REFRESH_SECONDS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._refresh(db))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh(self, db):
+        # Picks up writes made by other workers when no change stream feeds this one
+        while True:
+            await asyncio.sleep(SUGGEST_REFRESH_SECONDS)
+            if event_bus.source == "changestream":
+                continue
+            try:
+                if await change_counter(db) != self.built_at_counter:
+                    await self.build(db)
+            except Exception as e:
+                logger.error(f"Suggest index refresh failed: {e}")
+
+
+async def suggest_from_database(db, query, limit=SUGGEST_LIMIT):
+    # Used while the index is being built or when it is capped
+    search_filter, score, preferred = build_search(query)
+    projection = {"name": 1, "phone": 1}
+    if score is not None:
+        documents = await ranked_search(db.patients, search_filter, score, 0, limit, projection, preferred)
+    else:
+        documents = await db.patients.find(search_filter, projection).limit(limit).to_list(length=limit)
+    return [{"id": str(d["_id"]), "name": d.get("name"), "phone": d.get("phone")} for d in documents]
+
+
+suggest_index = SuggestIndex()
+event_bus.add_listener(suggest_index.apply_changes)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The app reads its settings at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("DATABASE_NAME", "healthcare_test")
+os.environ["ADMISSION_ENABLED"] = "false"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # The app against the in-memory MongoDB stand-in used by the benchmarks
+    from fastapi.testclient import TestClient
+    from benchmarks.memory_motor import MemoryMotorClient
+    import database
+    from main import app
+
+    memory_client = MemoryMotorClient()
+    monkeypatch.setattr(database, "AsyncIOMotorClient", lambda *args, **kwargs: memory_client)
+    monkeypatch.setattr(database, "DATABASE_NAME", os.environ["DATABASE_NAME"])
+    with TestClient(app) as test_client:
+        yield test_client
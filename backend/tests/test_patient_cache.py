@@ -0,0 +1,49 @@
+import asyncio
+
+from bson import ObjectId
+
+from patient_cache import PatientCache, InMemorySharedBackend
+
+PATIENT_ID = ObjectId()
+
+
+def patient(version):
+    return {"_id": PATIENT_ID, "name": f"v{version}", "version": version}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_fill_after_update_keeps_newer_version():
+    # A GET read version 1, then an update cached version 2 before the GET filled
+    cache = PatientCache()
+    run(cache.set(patient(2)))
+    run(cache.fill(patient(1)))
+    assert run(cache.get(str(PATIENT_ID)))["version"] == 2
+    assert cache.stale_fills == 1
+
+
+def test_fill_after_invalidation_is_skipped():
+    # The same after a partial write or delete, which only invalidate
+    cache = PatientCache()
+    run(cache.invalidate(patient(1)))
+    run(cache.fill(patient(1)))
+    assert run(cache.get(str(PATIENT_ID))) is None
+    run(cache.fill(patient(2)))
+    assert run(cache.get(str(PATIENT_ID)))["version"] == 2
+
+
+def test_out_of_order_writes_keep_newer_version():
+    cache = PatientCache()
+    run(cache.set(patient(3)))
+    run(cache.set(patient(2)))
+    assert run(cache.get(str(PATIENT_ID)))["version"] == 3
+
+
+def test_shared_tombstone_applies_to_other_workers():
+    shared = InMemorySharedBackend()
+    writer, reader = PatientCache(shared=shared), PatientCache(shared=shared)
+    run(writer.invalidate(patient(1)))
+    run(reader.fill(patient(1)))
+    assert run(reader.get(str(PATIENT_ID))) is None
@@ -0,0 +1,36 @@
+import asyncio
+import os
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+# Runs the index advisor (benchmarks/query_advisor.py) against a real mongod, so
+# a new query that scans the patients collection fails the build. Needs
+# MONGODB_URL; skipped without it, since the in-memory stand-in cannot explain.
+MONGODB_URL = os.getenv("MONGODB_URL")
+
+
+def mongod_available():
+    if not MONGODB_URL:
+        return False
+    client = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+@pytest.mark.skipif(not mongod_available(), reason="needs a mongod at MONGODB_URL")
+def test_no_query_scans_the_collection():
+    from benchmarks.query_advisor import run_advisor, format_report
+
+    report = asyncio.run(run_advisor(
+        size="1k", requests=2, mongodb_url=MONGODB_URL, database_name="healthcare_advisor_test"
+    ))
+    scans = [shape for shape in report["shapes"] if "COLLSCAN" in (shape["plan"] or "")]
+    assert not scans, format_report({**report, "shapes": scans})
+    assert report["flagged"] == 0, format_report(report)
@@ -0,0 +1,60 @@
+import pytest
+
+# MongoDB round trips each endpoint may make before it responds, as reported in
+# X-DB-Round-Trips (every command the driver sends is counted). Raising a
+# budget here should be a deliberate decision, not a side effect.
+PATIENT = {"name": "Asha Rao", "age": 30, "gender": "Female", "phone": "+91 9000000001"}
+PRESCRIPTION = {"date": "2025-01-01", "medication": "Amlodipine", "dosage": "5mg"}
+
+
+def round_trips(response):
+    assert response.status_code < 400, response.text
+    return int(response.headers["x-db-round-trips"])
+
+
+@pytest.fixture
+def patient_id(client):
+    return client.post("/api/patients/", json=PATIENT).json()["id"]
+
+
+def test_create(client):
+    assert round_trips(client.post("/api/patients/", json=PATIENT)) == 1
+
+def test_get_cached(client, patient_id):
+    assert round_trips(client.get(f"/api/patients/{patient_id}")) == 0
+
+@pytest.mark.parametrize("query", ["", "?search=asha", "?mode=cursor", "?view=summary"])
+def test_list(client, patient_id, query):
+    assert round_trips(client.get(f"/api/patients/{query}")) == 2
+
+def test_list_not_modified(client, patient_id):
+    etag = client.get("/api/patients/").headers["etag"]
+    response = client.get("/api/patients/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert int(response.headers["x-db-round-trips"]) == 0
+
+def test_update(client, patient_id):
+    assert round_trips(client.put(f"/api/patients/{patient_id}/", json=dict(PATIENT, age=41))) == 1
+
+def test_patch(client, patient_id):
+    assert round_trips(client.patch(f"/api/patients/{patient_id}", json={"age": 42, "version": 1})) == 1
+
+def test_add_prescription(client, patient_id):
+    assert round_trips(client.post(f"/api/patients/{patient_id}/prescriptions", json=PRESCRIPTION)) == 1
+
+def test_batch_get(client, patient_id):
+    assert round_trips(client.post("/api/patients/batch-get", json={"ids": [patient_id, "missing"]})) == 1
+
+# Batch writes read the pre-images with one $in query, then send one bulk_write,
+# whatever the batch size
+def test_batch_update(client, patient_id):
+    other_id = client.post("/api/patients/", json=PATIENT).json()["id"]
+    body = {"patients": [{"id": patient_id, "age": 43}, {"id": other_id, "age": 44, "version": 1}, {"id": "missing", "age": 45}]}
+    assert round_trips(client.post("/api/patients/batch-update", json=body)) == 2
+
+def test_batch_delete(client, patient_id):
+    other_id = client.post("/api/patients/", json=PATIENT).json()["id"]
+    assert round_trips(client.post("/api/patients/batch-delete", json={"ids": [patient_id, other_id, "missing"]})) == 2
+
+def test_delete(client, patient_id):
+    assert round_trips(client.delete(f"/api/patients/{patient_id}")) == 1
@@ -0,0 +1,36 @@
+from gunicorn.arbiter import Arbiter
+from uvicorn.server import Server
+from uvicorn.workers import UvicornWorker
+import sys
+
+# Gunicorn worker class (see gunicorn.conf.py). Unlike the stock UvicornWorker it
+# bounds the graceful shutdown and tells the app when draining starts.
+
+# Left after in-flight requests are given up on, for the lifespan shutdown
+SHUTDOWN_MARGIN_SECONDS = 5
+
+
+class DrainingServer(Server):
+    def handle_exit(self, sig, frame):
+        if not self.should_exit:
+            # Imported here so the gunicorn master never loads the app modules
+            from readiness import readiness
+            readiness.begin_drain()
+        super().handle_exit(sig, frame)
+
+
+class AppWorker(UvicornWorker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The stock worker waits for open connections forever; gunicorn would then
+        # SIGKILL it at graceful_timeout, before the pool and caches are closed
+        self.config.timeout_graceful_shutdown = max(1, self.cfg.graceful_timeout - SHUTDOWN_MARGIN_SECONDS)
+
+    async def _serve(self):
+        # UvicornWorker._serve with DrainingServer
+        self.config.app = self.wsgi
+        server = DrainingServer(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)